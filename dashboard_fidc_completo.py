@@ -9,12 +9,86 @@ import io
 from PIL import Image
 import matplotlib.pyplot as plt
 from datetime import datetime
+from dataclasses import replace
 from zoneinfo import ZoneInfo
 from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer
 from reportlab.lib.styles import getSampleStyleSheet
 from reportlab.lib.pagesizes import A4
 from io import BytesIO
 
+from fidc_engine import (
+    BUCKET_LABELS,
+    CENARIO_VARIAVEIS,
+    PARAM_INDEX,
+    PARAM_LABELS,
+    DIAS_UTEIS_ANO,
+    DIAS_UTEIS_MES,
+    MESES_ANO,
+    anual_to_diario,
+    avaliar_store,
+    buscar_meta,
+    calcular_snapshot,
+    curva_stress,
+    mensal_to_diario,
+    otimizar_estrutura,
+    params_para_matriz,
+    ponto_ruptura,
+    prob_ruptura,
+    sensibilidade_parametros,
+    simular_cenario,
+    taxa_carteira_necessaria,
+)
+from fidc_projecao import (
+    DRE_COLUNAS_PARAM,
+    DRE_IDX,
+    DRE_LINHAS,
+    agregar_dre,
+    aging_estacionario,
+    matriz_roll_rate,
+    projetar_aging,
+    fluxos_cotista,
+    projetar_dre,
+    rolagem_estacionaria,
+    taxa_perda_aging,
+)
+from fidc_carteira import (
+    LAYOUTS_AGING,
+    LIMITES_FAIXAS,
+    abrir_fita_cache,
+    aging_estado,
+    aging_indexado,
+    aplicar_delta,
+    aplicar_delta_exposicao,
+    carregar_fita,
+    estado_aging,
+    estado_exposicao,
+    indexar_vencimentos,
+    rotulos_faixas,
+)
+from fidc_paralelo import projetar_dre_paralelo, simular_perdas_paralelo
+from fidc_enquadramento import (
+    AJUSTE_RELACIONAMENTO_BPS,
+    AJUSTE_RESTRICAO_BPS,
+    RATING_ORDEM,
+    Operacao,
+    PoliticaFundo,
+    VerificadorPreTrade,
+    enquadrar_lote,
+    ler_operacoes,
+    premio_estrutural_bps as calcular_premio_estrutural_bps,
+)
+from fidc_precificacao import (
+    PRECIFICACAO_LABELS,
+    cenarios_pagamento,
+    exportar_precificacao,
+    ler_titulos,
+    precificar_bordero,
+    precificar_tabela,
+    precificar_titulos,
+)
+from fidc_simulacao import resumir_simulacao, simular_taxa_perda
+from fidc_tir import tir_lote
+
 
 
 
@@ -43,6 +117,250 @@ def save_fidc_store(store: dict):
         st.error(f"Erro ao salvar cadastro: {e}")
 
 
+def fidc_store_versao() -> int:
+    """Versão do fidcs.json em disco (mtime); muda a cada save_fidc_store."""
+    try:
+        return FIDC_STORE_PATH.stat().st_mtime_ns
+    except OSError:
+        return 0
+
+
+@st.cache_data(show_spinner=False)
+def monitor_risco_fundos(store_versao: int) -> pd.DataFrame:
+    """
+    KPIs de risco de todos os fundos cadastrados, calculados numa única
+    chamada em lote. O cache é invalidado quando o fidcs.json muda.
+    """
+    nomes, m = avaliar_store(load_fidc_store())
+    return pd.DataFrame({
+        "Fundo": nomes,
+        "PL Total (R$)": m["pl_total"],
+        "Subordinação (%)": m["sub_atual"] * 100,
+        "Sub. Mínima (%)": m["sub_min"] * 100,
+        "PDD Base (R$)": m["pdd_base"],
+        "Limite por Subordinação (R$)": m["perda_lim_sub"],
+        "Folga vs Limite (R$)": m["folga_limite"],
+        "Folga (%)": m["folga_pct"],
+        "Cobertura Jr vs PDD (x)": m["cobertura_jr_x"],
+        "Aporte Necessário (R$)": m["aporte_necessario"],
+        "ROE Júnior (% a.a.)": m["retorno_anualizado_junior"] * 100,
+    })
+
+
+# Perguntas do goal-seek em lote: alavanca, métrica, alvo, intervalo de busca
+# e como exibir a resposta. O alvo "cdi"/"sub_min" vem de cada fundo.
+PERGUNTAS_GOAL_SEEK = {
+    "Multiplicador máximo de PDD até ROE Júnior = CDI": dict(
+        alavanca="pdd_mult", metrica="retorno_anualizado_junior", alvo="cdi",
+        intervalo=(0.0, 50.0), rotulo="Multiplicador de PDD (x)",
+    ),
+    "% mínimo em recebíveis para o ROE alvo": dict(
+        alavanca="pct_recebiveis_pct", metrica="retorno_anualizado_junior", alvo="roe",
+        intervalo=(0.0, 100.0), rotulo="% do PL em recebíveis",
+    ),
+    "Taxa mínima da carteira para o ROE alvo": dict(
+        alavanca="taxa_carteira_am_pct", metrica="retorno_anualizado_junior", alvo="roe",
+        intervalo=(0.0, 20.0), rotulo="Taxa da carteira (% a.m.)",
+    ),
+    "Emissão Sênior máxima no limite de subordinação": dict(
+        alavanca="valor_senior", metrica="sub_atual", alvo="sub_min",
+        intervalo=(0.0, None), rotulo="Cota Sênior (R$)",
+    ),
+}
+
+
+@st.cache_data(show_spinner=False)
+def goal_seek_fundos(store_versao: int, pergunta: str, roe_alvo_pct: float) -> pd.DataFrame:
+    """
+    Resolve a mesma pergunta para todos os fundos do cadastro numa única
+    bisseção vetorizada (buscar_meta).
+    """
+    cfg = PERGUNTAS_GOAL_SEEK[pergunta]
+    nomes, X = params_para_matriz(load_fidc_store())
+    if not nomes:
+        return pd.DataFrame()
+
+    if cfg["alvo"] == "cdi":
+        alvo = X[:, PARAM_INDEX["cdi_aa_pct"]] / 100.0
+    elif cfg["alvo"] == "sub_min":
+        alvo = X[:, PARAM_INDEX["sub_min_pct"]] / 100.0
+    else:
+        alvo = roe_alvo_pct / 100.0
+
+    lo, hi = cfg["intervalo"]
+    if hi is None:
+        # Sênior: até 100x o PL atual é folga de sobra para cruzar a subordinação
+        hi = 100.0 * X[:, [PARAM_INDEX["valor_junior"], PARAM_INDEX["valor_mezz"], PARAM_INDEX["valor_senior"]]].sum(axis=1)
+
+    res = buscar_meta(X, cfg["alavanca"], cfg["metrica"], alvo, lo, hi)
+    atual = (
+        np.ones(len(nomes)) if cfg["alavanca"] == "pdd_mult"
+        else X[:, PARAM_INDEX[cfg["alavanca"]]]
+    )
+    return pd.DataFrame({
+        "Fundo": nomes,
+        "Atual": atual,
+        "Resposta": res["x"],
+        "Folga": res["x"] - atual,
+        "Solução no intervalo": res["encontrado"],
+    })
+
+
+@st.cache_data(show_spinner=False)
+def simulacao_perdas_mc(params: dict, n_caminhos: int, distribuicao: str, cv_faixa: float, vol_sistemica: float, seed: int):
+    """
+    Monte Carlo de perdas da carteira para o fundo em `params`. Cacheado
+    pelos próprios parâmetros: mexer em outra aba não re-simula. Os lotes
+    rodam no pool de processos (FIDC_WORKERS); o resultado não depende do
+    número de workers.
+    """
+    snap_mc = calcular_snapshot(params)
+    perdas = simular_perdas_paralelo(snap_mc, n_caminhos, distribuicao, cv_faixa, vol_sistemica, seed)
+    contagem, bordas = np.histogram(perdas, bins=80)
+    return resumir_simulacao(perdas, snap_mc), contagem, bordas
+
+
+@st.cache_data(show_spinner=False)
+def estrutura_otima(
+    params: dict,
+    prob_max_pct: float,
+    premio_senior_bps: float,
+    premio_mezz_bps: float,
+    distribuicao: str,
+    cv_faixa: float,
+    vol_sistemica: float,
+    seed: int,
+):
+    """
+    Busca da divisão Júnior/Mezz/Sênior que maximiza o ROE Júnior. A
+    probabilidade de ruptura usa uma única amostra Monte Carlo de taxas de
+    perda (fração da carteira), reaproveitada por todos os candidatos.
+    Devolve (resultado da busca, prob. de ruptura da estrutura atual).
+    """
+    snap_ot = calcular_snapshot(params)
+    amostra = np.sort(simular_taxa_perda(snap_ot, 100_000, distribuicao, cv_faixa, vol_sistemica, seed))
+    res = otimizar_estrutura(
+        params,
+        amostra,
+        prob_max_ruptura=prob_max_pct / 100.0,
+        pct_recebiveis_min=67.0,
+        premio_spread_senior=premio_senior_bps / 100.0,
+        premio_spread_mezz=premio_mezz_bps / 100.0,
+    )
+    limiar_atual = ponto_ruptura(snap_ot.valor_junior, snap_ot.pl_total, snap_ot.sub_min) / snap_ot.valor_recebiveis \
+        if snap_ot.valor_recebiveis > 0 else np.inf
+    return res, float(prob_ruptura(amostra, limiar_atual))
+
+
+@st.cache_resource(max_entries=4, show_spinner=False)
+def fita_compartilhada(chave: str):
+    """
+    Fita do cache em disco, aberta uma vez por processo e compartilhada
+    entre sessões: as colunas são memory-map somente leitura, nada é
+    copiado para o session_state de cada usuário.
+    """
+    return abrir_fita_cache(chave)
+
+
+@st.cache_resource(max_entries=4, show_spinner=False)
+def indice_fita_compartilhado(chave: str):
+    """Vencimentos ordenados da fita (uma ordenação por fita e processo)."""
+    return indexar_vencimentos(fita_compartilhada(chave))
+
+
+@st.cache_resource(max_entries=8, show_spinner=False)
+def estado_exposicao_compartilhado(chave: str, chaves_delta: tuple = ()):
+    """
+    Exposição por sacado / raiz de CNPJ da fita após os deltas, na ordem.
+    Como no estado do aging, cada prefixo fica no cache (a visão ordenada
+    da base é compartilhada) e um delta novo custa só a sua aplicação.
+    """
+    if not chaves_delta:
+        return estado_exposicao(fita_compartilhada(chave))
+    return aplicar_delta_exposicao(
+        estado_exposicao_compartilhado(chave, chaves_delta[:-1]), fita_compartilhada(chaves_delta[-1])
+    )
+
+
+def exposicao_fita_compartilhada(chave: str, chaves_delta: tuple = ()):
+    """Índice de exposição da fita após os deltas (só leitura aqui)."""
+    return estado_exposicao_compartilhado(chave, chaves_delta).indice
+
+
+@st.cache_data(max_entries=16, show_spinner=False)
+def enquadrar_fila(
+    conteudo: bytes,
+    politica: PoliticaFundo,
+    caixa_disponivel: float,
+    chave_fita: str = None,
+    acumular: bool = True,
+    chaves_delta: tuple = (),
+):
+    """Enquadramento em lote da fila de operações (CSV) contra a carteira da fita (com os deltas), se houver."""
+    indice = exposicao_fita_compartilhada(chave_fita, chaves_delta) if chave_fita else None
+    return enquadrar_lote(ler_operacoes(conteudo), politica, caixa_disponivel, indice, acumular)
+
+
+@st.cache_data(max_entries=8, show_spinner=False)
+def precificar_arquivo(conteudo: bytes, padroes: dict) -> pd.DataFrame:
+    """Precificação em lote do CSV de títulos (colunas ausentes usam `padroes`)."""
+    return precificar_tabela(ler_titulos(conteudo, padroes))
+
+
+@st.cache_data(max_entries=8, show_spinner=False)
+def exportar_arquivo_precificado(conteudo: bytes, padroes: dict, formato: str) -> bytes:
+    """Arquivo de download da precificação em lote, só no formato escolhido."""
+    return exportar_precificacao(precificar_arquivo(conteudo, padroes), formato)
+
+
+@st.cache_data(max_entries=8, show_spinner=False)
+def precificar_bordero_arquivo(conteudo: bytes, padroes: dict, data_operacao, tac: float) -> tuple:
+    """Borderô do CSV (face e vencimento por título): (tabela por título, consolidado da operação)."""
+    titulos = ler_titulos(conteudo, padroes)
+    if "vencimento" not in titulos:
+        raise ValueError("arquivo sem a coluna de vencimento")
+    bordero = precificar_bordero(
+        titulos["valor_face"].to_numpy(),
+        titulos["vencimento"].to_numpy(),
+        data_operacao,
+        titulos["taxa_am_pct"].to_numpy() / 100,
+        tac,
+        titulos["pd_pct"].to_numpy() / 100,
+    )
+    tabela = pd.DataFrame(bordero["titulos"])
+    tabela.insert(0, "id_titulo", titulos["id_titulo"].to_numpy())
+    return tabela, bordero["operacao"]
+
+
+@st.cache_data(max_entries=8, show_spinner=False)
+def exportar_bordero_arquivo(conteudo: bytes, padroes: dict, data_operacao, tac: float) -> bytes:
+    """CSV do borderô precificado (mesma chave de precificar_bordero_arquivo)."""
+    return exportar_precificacao(precificar_bordero_arquivo(conteudo, padroes, data_operacao, tac)[0], "csv")
+
+
+@st.cache_resource(max_entries=8, show_spinner=False)
+def estado_fita_compartilhado(chave: str, chaves_delta: tuple = ()):
+    """
+    Estado incremental da fita após os deltas, na ordem. Cada prefixo fica
+    no cache, então um delta novo custa só a sua aplicação (O(delta)).
+    Retorna (estado, resumo do último delta).
+    """
+    if not chaves_delta:
+        return estado_aging(fita_compartilhada(chave)), {}
+    anterior, _ = estado_fita_compartilhado(chave, chaves_delta[:-1])
+    return aplicar_delta(anterior, fita_compartilhada(chaves_delta[-1]))
+
+
+def aging_fita_importada(chave: str, data_referencia, num_faixas: int = 9, chaves_delta: tuple = ()) -> dict:
+    limites = LAYOUTS_AGING[num_faixas]
+    if chaves_delta:
+        aging = aging_estado(estado_fita_compartilhado(chave, chaves_delta)[0], data_referencia, limites=limites)
+    else:
+        aging = aging_indexado(indice_fita_compartilhado(chave), data_referencia, limites=limites)
+    aging["linhas_descartadas"] = fita_compartilhada(chave).linhas_descartadas
+    return aging
+
+
 def get_param(name, default):
     return st.session_state.get("fidc_params", {}).get(name, default)
 
@@ -137,12 +455,7 @@ st.markdown(
 # -------------------------------------------------------------------
 # FUNÇÕES AUXILIARES
 # -------------------------------------------------------------------
-def anual_to_diario(rate_aa, dias_uteis=252):
-    return (1 + rate_aa) ** (1 / dias_uteis) - 1
-
-def mensal_to_diario(rate_am, dias_uteis_ano=252):
-    rate_aa = (1 + rate_am) ** 12 - 1
-    return anual_to_diario(rate_aa, dias_uteis=dias_uteis_ano)
+# anual_to_diario / mensal_to_diario vêm de fidc_engine
 
 def format_pct(x):
     return f"{x*100:,.2f} %"
@@ -318,6 +631,92 @@ st.sidebar.caption(
 
 st.sidebar.caption("Valores iniciais seguem a política interna: bucket 0–30 com 95% da carteira, demais 0,5% e último 1,5%.")
 
+# --- Importação da fita de recebíveis (preenche os % por faixa) ---
+with st.sidebar.expander("📥 Importar fita de recebíveis"):
+    arquivo_fita = st.file_uploader(
+        "Fita (CSV ou XLSX)", type=["csv", "xlsx"], key="fita_arquivo",
+        help="Uma linha por título: sacado, cedente, valor de face, vencimento, data de aquisição e status. "
+             "Títulos liquidados/recomprados ficam fora do aging.",
+    )
+    data_ref_fita = st.date_input(
+        "Data de referência", value=datetime.now(ZoneInfo("America/Sao_Paulo")).date(),
+        format="DD/MM/YYYY", key="fita_data_ref",
+    )
+
+    if arquivo_fita is None:
+        st.session_state.pop("fita_upload_id", None)
+        st.session_state.pop("fita_chave", None)
+    elif st.session_state.get("fita_upload_id") != arquivo_fita.file_id:
+        # Só o hash fica na sessão; as colunas vêm do cache em disco (mapeado)
+        barra_fita = st.progress(0.0, text="Lendo fita...")
+        try:
+            _, chave_conteudo, _ = carregar_fita(
+                arquivo_fita,
+                nome=arquivo_fita.name,
+                progresso=lambda f: barra_fita.progress(f, text=f"Lendo fita... {f * 100:.0f}%"),
+            )
+            st.session_state["fita_chave"] = chave_conteudo
+        except ValueError as e:
+            st.session_state.pop("fita_chave", None)
+            st.error(f"Não foi possível ler a fita: {e}")
+        st.session_state["fita_upload_id"] = arquivo_fita.file_id
+        barra_fita.empty()
+
+    # --- Deltas diários: aplicados sobre os agregados da fita, sem reler a base ---
+    chaves_delta = ()
+    if arquivo_fita is not None and st.session_state.get("fita_chave"):
+        arquivos_delta = st.file_uploader(
+            "Arquivos delta (D+1, D+2…)", type=["csv", "xlsx"], accept_multiple_files=True, key="fita_deltas",
+            help="Títulos novos, liquidados ou alterados, com a mesma estrutura da fita e o identificador do título. "
+                 "Aplicados em ordem de nome do arquivo.",
+        )
+        mapa_deltas = st.session_state.setdefault("fita_deltas_chaves", {})
+        try:
+            for arquivo_delta in sorted(arquivos_delta or [], key=lambda a: a.name):
+                if arquivo_delta.file_id not in mapa_deltas:
+                    mapa_deltas[arquivo_delta.file_id] = carregar_fita(arquivo_delta, nome=arquivo_delta.name)[1]
+            chaves_delta = tuple(mapa_deltas[a.file_id] for a in sorted(arquivos_delta or [], key=lambda a: a.name))
+            if chaves_delta:
+                _, resumo_delta = estado_fita_compartilhado(st.session_state["fita_chave"], chaves_delta)
+                st.caption(
+                    f"{len(chaves_delta)} delta(s) aplicado(s). Último: {resumo_delta['novos']} novos, "
+                    f"{resumo_delta['alterados']} alterados, {resumo_delta['baixados']} baixados."
+                )
+        except ValueError as e:
+            chaves_delta = ()
+            st.error(f"Não foi possível aplicar o delta: {e}")
+
+    aging_importado = (
+        aging_fita_importada(st.session_state["fita_chave"], data_ref_fita, chaves_delta=chaves_delta)
+        if arquivo_fita is not None and st.session_state.get("fita_chave") else None
+    )
+    if aging_importado is not None:
+        n_titulos_fita = f"{aging_importado['n_titulos']:,}".replace(",", ".")
+        st.caption(f"{n_titulos_fita} títulos em carteira · {format_brl(aging_importado['valor_carteira'])}")
+        if aging_importado["linhas_descartadas"]:
+            st.caption(f"⚠️ {aging_importado['linhas_descartadas']} linhas sem valor/vencimento válidos foram ignoradas.")
+        faixas_fita = st.radio(
+            "Faixas", [9, 6], horizontal=True, key="fita_faixas",
+            format_func=lambda n: "9 (sidebar)" if n == 9 else "6 (0–15 … >180)",
+        )
+        aging_layout = aging_importado if faixas_fita == 9 else aging_fita_importada(
+            st.session_state["fita_chave"], data_ref_fita, faixas_fita, chaves_delta
+        )
+        st.dataframe(
+            pd.DataFrame({
+                "Faixa": aging_layout["rotulos"],
+                "Títulos": aging_layout["quantidade"],
+                "Valor (R$)": aging_layout["exposicao"],
+                "%": aging_layout["pct"] * 100,
+            }).style.format({"Títulos": "{:,.0f}", "Valor (R$)": format_brl, "%": "{:.2f}%"}),
+            hide_index=True,
+            use_container_width=True,
+        )
+        if st.button("Aplicar distribuição da fita", key="fita_aplicar", help="Usa sempre as 9 faixas da sidebar."):
+            # os number_input das faixas vêm logo abaixo: basta gravar no session_state
+            for campo, valor in aging_importado["params"].items():
+                st.session_state[campo] = round(valor, 4)
+
 st.sidebar.markdown("**0–30 dias**")
 c1, c2 = st.sidebar.columns(2)
 with c1:
@@ -413,6 +812,13 @@ st.sidebar.metric(
     help="Média ponderada das provisões aplicada à distribuição atual da carteira."
 )
 
+if aging_importado is not None:
+    st.sidebar.metric(
+        "📥 PDD da Fita Importada",
+        format_brl(aging_importado["exposicao"] @ (provs_raw / 100.0)),
+        help="Valor de face em carteira por faixa de aging × % de provisão de cada faixa.",
+    )
+
 st.sidebar.markdown("---")
 incluir_pdd = st.sidebar.checkbox(
     "Incluir PDD no P&L e DRE", value=bool(get_param("incluir_pdd", True))
@@ -457,141 +863,62 @@ st.session_state["fidc_params"] = current_params
 # -------------------------------------------------------------------
 # CÁLCULOS PRINCIPAIS – CENÁRIO ATUAL
 # -------------------------------------------------------------------
+# As contas ficam em fidc_engine (funções puras sobre current_params). O
+# snapshot é memoizado pelo hash dos parâmetros: reruns que não alteram o
+# fundo (troca de aba, textos do comitê) não refazem o cálculo.
+snap = calcular_snapshot(current_params)
+
 # Alocação em recebíveis e caixa
-valor_recebiveis = pl_total * pct_recebiveis
-valor_caixa      = pl_total - valor_recebiveis
+valor_recebiveis = snap.valor_recebiveis
+valor_caixa      = snap.valor_caixa
 
 # Receitas com a taxa atual (para P&L e DRE)
-receita_carteira_dia     = valor_recebiveis * taxa_carteira_diaria
-receita_caixa_dia        = valor_caixa      * cdi_diario
-receita_financeira_dia   = receita_carteira_dia + receita_caixa_dia
-receita_total_dia        = receita_financeira_dia + receita_outros_dia
+receita_carteira_dia     = snap.receita_carteira_dia
+receita_caixa_dia        = snap.receita_caixa_dia
+receita_total_dia        = snap.receita_total_dia
 
 # Custos das cotas
-custo_senior_dia = valor_senior * taxa_senior_diaria
-custo_mezz_dia   = valor_mezz   * taxa_mezz_diaria
+custo_senior_dia = snap.custo_senior_dia
+custo_mezz_dia   = snap.custo_mezz_dia
 
 # Taxas adm / gestão
-custo_adm_dia    = pl_total * taxa_adm_diaria
-custo_gestao_dia = pl_total * taxa_gestao_diaria
+custo_adm_dia    = snap.custo_adm_dia
+custo_gestao_dia = snap.custo_gestao_dia
 
 
 # --- PDD (perda esperada anual, diária e impacto em taxa) ---
 
 # taxas de provisão por bucket em DECIMAL (ex: 5% -> 0.05)
-prov_rates = np.array([
-    prov_0_30, prov_31_60, prov_61_90, prov_91_120, prov_121_150,
-    prov_151_180, prov_181_240, prov_241_300, prov_300p
-]) / 100.0
+prov_rates = np.array(snap.prov_rates)
 
 # taxa_perda_esperada: % a.a. de perda esperada SOBRE OS RECEBÍVEIS (decimal)
 # ex.: 0.0292 = 2,92% a.a.
-taxa_perda_esperada = float(np.sum(buckets_pct_norm * prov_rates))
-
-# converte para taxa diária aproximada
-taxa_perda_esp_diaria = taxa_perda_esperada / 252.0
-
-# converte para taxa MENSAL equivalente (sobre os recebíveis)
-taxa_perda_esp_am = (1 + taxa_perda_esp_diaria) ** 21 - 1
+taxa_perda_esperada = snap.taxa_perda_esperada
 
 # PDD "econômica" ANUAL em R$ (sempre existe, para risco)
-pdd_base = valor_recebiveis * taxa_perda_esperada
-
-# PDD que ENTRA no P&L / DRE (controlada pelo checkbox)
-pdd_ano = pdd_base if incluir_pdd else 0.0
-pdd_dia = pdd_ano / 252.0
-
-
-def taxa_carteira_necessaria_diaria(target_roe_jr_pct_aa: float) -> float:
-    """
-    Retorna a taxa DIÁRIA necessária nos RECEBÍVEIS (r_carteira_dia)
-    para que a Cota Júnior tenha ROE alvo 'target_roe_jr_pct_aa' (% a.a.),
-    usando retorno linear.
-
-    Equação base (por dia):
-
-        Resultado_Júnior_dia(r) = R * r
-                                  + receita_caixa_dia
-                                  + receita_outros_dia
-                                  - custos_fixos_dia
-                                  - pdd_dia
-
-    Onde:
-      - R = valor_recebiveis
-      - custos_fixos_dia = senior + mezz + adm + gest + outros
-      - receita_caixa_dia = valor_caixa * cdi_diario
-      - pdd_dia = PDD econômica diária
-    """
-
-    if valor_recebiveis <= 0 or valor_junior <= 0:
-        return 0.0
-
-    # ROE alvo em decimal (ex.: 46% -> 0.46)
-    roe_alvo = target_roe_jr_pct_aa / 100.0
-
-    # Resultado diário NECESSÁRIO para a Júnior (linear)
-    resultado_jr_ano_alvo = roe_alvo * valor_junior
-    resultado_jr_dia_alvo = resultado_jr_ano_alvo / 252.0
-
-    # Custos fixos por dia (não dependem da taxa da carteira)
-    custos_fixos_dia = (
-        custo_senior_dia
-        + custo_mezz_dia
-        + custo_adm_dia
-        + custo_gestao_dia
-        + custo_outros_dia
-    )
-
-    # Receitas FIXAS por dia (AGORA inclui o CDI do caixa)
-    receitas_fixas_totais_dia = receita_caixa_dia + receita_outros_dia
+pdd_base = snap.pdd_base
 
-    # K = receitas_fixas - custos_fixos - pdd_dia
-    K = receitas_fixas_totais_dia - custos_fixos_dia - pdd_dia
-
-    # Equação:
-    #   Resultado_jr_dia_alvo = R * r + K
-    # => R * r = Resultado_jr_dia_alvo - K
-    # => r     = (Resultado_jr_dia_alvo - K) / R
-    numerador = resultado_jr_dia_alvo - K
-    r_dia = numerador / valor_recebiveis
-
-    # Se por algum motivo ficar negativo (meta muito baixa), força 0%
-    return max(0.0, r_dia)
+# PDD que ENTRA no P&L / DRE (controlada pelo checkbox), por dia
+pdd_dia = snap.pdd_dia
 
 
 
 # ----------------------------
-# TAXA MÍNIMA DA CARTEIRA (BREAK-EVEN: ROE JÚNIOR = 0)
+# RESULTADO DA COTA JÚNIOR (RESÍDUO DO FUNDO)
 # ----------------------------
-dias_uteis_ano = 252
-dias_uteis_mes = dias_uteis_ano / 12  # ~21 dias úteis (aprox.)
-
-# Resultado diário
-resultado_liquido_dia = (
-    receita_total_dia
-    - custo_senior_dia
-    - custo_mezz_dia
-    - custo_adm_dia
-    - custo_gestao_dia
-    - pdd_dia
-    - custo_outros_dia
-)
-
-resultado_junior_dia = resultado_liquido_dia
-resultado_junior_mes = resultado_junior_dia * dias_uteis_mes
-resultado_junior_ano = resultado_junior_dia * dias_uteis_ano
-
-if valor_junior > 0:
-    # Retornos lineares da Cota Júnior
-    retorno_diario_junior      = resultado_junior_dia  / valor_junior
-    retorno_mensal_junior      = resultado_junior_mes  / valor_junior
-    retorno_anualizado_junior  = resultado_junior_ano  / valor_junior
-else:
-    retorno_diario_junior      = 0.0
-    retorno_mensal_junior      = 0.0
-    retorno_anualizado_junior  = 0.0
+dias_uteis_ano = DIAS_UTEIS_ANO
+meses_ano = MESES_ANO
+dias_uteis_mes = DIAS_UTEIS_MES  # ~21 dias úteis/mês
 
+resultado_liquido_dia = snap.resultado_junior_dia
+resultado_junior_dia  = snap.resultado_junior_dia
+resultado_junior_mes  = snap.resultado_junior_mes
+resultado_junior_ano  = snap.resultado_junior_ano
 
+# Retornos lineares da Cota Júnior
+retorno_diario_junior      = snap.retorno_diario_junior
+retorno_mensal_junior      = snap.retorno_mensal_junior
+retorno_anualizado_junior  = snap.retorno_anualizado_junior
 
 retorno_anualizado_senior = taxa_senior_aa
 retorno_mensal_senior     = taxa_senior_aa / 12.0
@@ -601,74 +928,16 @@ retorno_anualizado_mezz = taxa_mezz_aa
 retorno_mensal_mezz     = taxa_mezz_aa / 12.0
 retorno_diario_mezz     = taxa_mezz_aa / 252.0
 
-
-
-# ------------------------------
-# Projeção anual / mensal (DRE)
-# ------------------------------
-dias_uteis_ano = 252
-meses_ano = 12
-dias_uteis_mes = dias_uteis_ano / meses_ano  # ~21 dias úteis/mês
-
-# Receitas (anual)
-receita_carteira_ano       = receita_carteira_dia       * dias_uteis_ano
-receita_caixa_ano          = receita_caixa_dia          * dias_uteis_ano
-receita_financeira_ano     = receita_financeira_dia     * dias_uteis_ano
-receita_outros_ano         = receita_outros_dia         * dias_uteis_ano
-receita_total_ano          = receita_total_dia          * dias_uteis_ano
-
-# Custos das cotas (anual)
-custo_senior_ano = custo_senior_dia * dias_uteis_ano
-custo_mezz_ano   = custo_mezz_dia   * dias_uteis_ano
-
-# Taxas (anual)
-custo_adm_ano    = custo_adm_dia    * dias_uteis_ano
-custo_gestao_ano = custo_gestao_dia * dias_uteis_ano
-
-
-# Outros custos (anual)
-custo_outros_ano = custo_outros_dia * dias_uteis_ano
-
-# Resultado (anual)
-resultado_liquido_ano = resultado_liquido_dia * dias_uteis_ano
-resultado_junior_ano  = resultado_junior_dia  * dias_uteis_ano
-
-# Resultado (mensal)
-receita_carteira_mes       = receita_carteira_dia       * dias_uteis_mes
-receita_caixa_mes          = receita_caixa_dia          * dias_uteis_mes
-receita_financeira_mes     = receita_financeira_dia     * dias_uteis_mes
-receita_outros_mes         = receita_outros_dia         * dias_uteis_mes
-receita_total_mes          = receita_total_dia          * dias_uteis_mes
-
-custo_senior_mes = custo_senior_dia * dias_uteis_mes
-custo_mezz_mes   = custo_mezz_dia   * dias_uteis_mes
-custo_adm_mes    = custo_adm_dia    * dias_uteis_mes
-custo_gestao_mes = custo_gestao_dia * dias_uteis_mes
-pdd_mes          = pdd_dia          * dias_uteis_mes
-custo_outros_mes = custo_outros_dia * dias_uteis_mes
-
-resultado_liquido_mes = resultado_liquido_dia * dias_uteis_mes
-resultado_junior_mes  = resultado_junior_dia  * dias_uteis_mes
-
 # Subordinação: perda limite mantendo índice mínimo Júnior / PL ≥ sub_min
-if pl_total > 0 and sub_min < 1:
-    if valor_junior / pl_total <= sub_min:
-        perda_lim_sub = 0.0
-    else:
-        # L = (J - s*P) / (1 - s)
-        perda_lim_sub = (valor_junior - sub_min * pl_total) / (1 - sub_min)
-else:
-    perda_lim_sub = 0.0
-
-perda_lim_sub_pct_recebiveis = (
-    perda_lim_sub / valor_recebiveis if valor_recebiveis > 0 else 0.0
-)
+perda_lim_sub = snap.perda_lim_sub
+perda_lim_sub_pct_recebiveis = snap.perda_lim_sub_pct_recebiveis
 
 # -------------------------------------------------------------------
 # TABS
 # -------------------------------------------------------------------
-tab_cadastro, tab_estrutura, tab_risco, tab_alvo, tab_dre, tab_rating = st.tabs([
+tab_cadastro, tab_monitor, tab_estrutura, tab_risco, tab_alvo, tab_dre, tab_rating = st.tabs([
     'Cadastro e Controle de FIDCs',
+    'Monitor de Risco dos Fundos',
     'Estrutura & P&L',
     'Gestao de Risco & Stress Test',
     'Taxa de Juros & Simulacoes',
@@ -860,6 +1129,116 @@ Resultados atuais (anualizados):
             mime="application/pdf"
         )
 
+# -------------------------------------------------------------------
+# ABA 0.1 – MONITOR DE RISCO DOS FUNDOS (CARTEIRA CONSOLIDADA)
+# -------------------------------------------------------------------
+with tab_monitor:
+    st.markdown('<div class="section-header"> Monitor de Risco dos Fundos</div>', unsafe_allow_html=True)
+    st.caption(
+        "KPIs da aba 'Gestão de Risco & Stress Test' para todos os fundos salvos em fidcs.json, "
+        "calculados em lote. Fundos com alterações ainda não salvas não aparecem aqui."
+    )
+
+    df_monitor = monitor_risco_fundos(fidc_store_versao())
+
+    if df_monitor.empty:
+        st.info("Nenhum fundo cadastrado ainda.")
+    else:
+        desenquadrados = df_monitor["Aporte Necessário (R$)"] > 0
+
+        m1, m2, m3, m4 = st.columns(4)
+        m1.metric("Fundos Monitorados", f"{len(df_monitor)}")
+        m2.metric(
+            "Desenquadrados",
+            f"{int(desenquadrados.sum())}",
+            delta="Aporte necessário" if desenquadrados.any() else "Todos enquadrados",
+            delta_color="inverse" if desenquadrados.any() else "off",
+        )
+        m3.metric("Folga Total vs Limite", format_brl(df_monitor["Folga vs Limite (R$)"].sum()))
+        m4.metric("Aporte Total Necessário", format_brl(df_monitor["Aporte Necessário (R$)"].sum()))
+
+        criterios_monitor = {
+            "Folga vs Limite (menor primeiro)": ("Folga vs Limite (R$)", True),
+            "Cobertura Júnior vs PDD (menor primeiro)": ("Cobertura Jr vs PDD (x)", True),
+            "Aporte Necessário (maior primeiro)": ("Aporte Necessário (R$)", False),
+        }
+        criterio = st.radio("Ordenar por:", list(criterios_monitor.keys()), horizontal=True, key="monitor_ordem")
+        col_ordem, asc = criterios_monitor[criterio]
+
+        df_rank = df_monitor.sort_values(col_ordem, ascending=asc).reset_index(drop=True)
+        df_rank.insert(1, "Status", np.where(df_rank["Aporte Necessário (R$)"] > 0, "DESENQUADRADO", "ENQUADRADO"))
+
+        st.dataframe(
+            df_rank.style.format({
+                "PL Total (R$)": format_brl,
+                "Subordinação (%)": "{:.2f}%",
+                "Sub. Mínima (%)": "{:.2f}%",
+                "PDD Base (R$)": format_brl,
+                "Limite por Subordinação (R$)": format_brl,
+                "Folga vs Limite (R$)": format_brl,
+                "Folga (%)": "{:.1f}%",
+                "Cobertura Jr vs PDD (x)": lambda v: f"{v:.1f}x" if np.isfinite(v) else "∞",
+                "Aporte Necessário (R$)": format_brl,
+                "ROE Júnior (% a.a.)": "{:.2f}%",
+            }),
+            use_container_width=True,
+            hide_index=True,
+        )
+
+        fig_monitor = go.Figure(go.Bar(
+            x=df_rank["Folga vs Limite (R$)"],
+            y=df_rank["Fundo"],
+            orientation="h",
+            marker_color=["#27ae60" if v >= 0 else "#c0392b" for v in df_rank["Folga vs Limite (R$)"]],
+            hovertemplate="%{y}<br>Folga: R$ %{x:,.2f}<extra></extra>",
+        ))
+        fig_monitor.update_layout(
+            title="Folga vs Limite de Subordinação por Fundo",
+            xaxis_title="Folga (R$)",
+            yaxis=dict(autorange="reversed"),
+            height=max(300, 28 * len(df_rank)),
+            margin=dict(l=20, r=20, t=50, b=20),
+        )
+        st.plotly_chart(fig_monitor, use_container_width=True)
+
+        # ---- GOAL-SEEK EM LOTE (TODOS OS FUNDOS) ----
+        st.markdown("---")
+        st.markdown("#### Goal-Seek em Lote")
+        st.caption(
+            "Resolve a mesma pergunta para todos os fundos de uma vez (bisseção vetorizada sobre o motor). "
+            "Sem solução no intervalo: a meta já está atendida (ou é inatingível) em todo o intervalo de busca."
+        )
+        cG1, cG2 = st.columns([3, 1])
+        with cG1:
+            pergunta_gs = st.selectbox("Pergunta", list(PERGUNTAS_GOAL_SEEK), key="gs_pergunta")
+        with cG2:
+            roe_alvo_gs = st.number_input(
+                "ROE alvo Júnior (% a.a.)", -50.0, 200.0, 20.0, 0.5, key="gs_roe_alvo",
+                disabled=PERGUNTAS_GOAL_SEEK[pergunta_gs]["alvo"] != "roe",
+            )
+
+        df_gs = goal_seek_fundos(fidc_store_versao(), pergunta_gs, roe_alvo_gs)
+        rotulo_gs = PERGUNTAS_GOAL_SEEK[pergunta_gs]["rotulo"]
+        if rotulo_gs.endswith("(R$)"):
+            fmt_gs = lambda v: format_brl(v) if np.isfinite(v) else "—"
+        else:
+            fmt_gs = lambda v: f"{v:,.2f}" if np.isfinite(v) else "—"
+
+        st.dataframe(
+            df_gs.rename(columns={
+                "Atual": f"{rotulo_gs} – atual",
+                "Resposta": f"{rotulo_gs} – resposta",
+                "Folga": "Folga (resposta − atual)",
+            }).style.format({
+                f"{rotulo_gs} – atual": fmt_gs,
+                f"{rotulo_gs} – resposta": fmt_gs,
+                "Folga (resposta − atual)": fmt_gs,
+                "Solução no intervalo": lambda v: "Sim" if v else "Não",
+            }),
+            use_container_width=True,
+            hide_index=True,
+        )
+
 # -------------------------------------------------------------------
 # ABA 1 – ESTRUTURA & P&L
 # -------------------------------------------------------------------
@@ -1232,6 +1611,218 @@ with tab_estrutura:
 
     st.plotly_chart(fig_wf, use_container_width=True)
 
+    # =========================================================
+    # SENSIBILIDADE POR PARÂMETRO (TORNADO)
+    # =========================================================
+    st.markdown("---")
+    st.markdown('<div class="section-header"> Sensibilidade por Parâmetro (Tornado)</div>', unsafe_allow_html=True)
+    st.caption(
+        "Cada parâmetro do fundo é movido para baixo e para cima, um de cada vez, "
+        "e o impacto é ordenado pela amplitude. Todos os cenários (2N+1) são avaliados numa única passada."
+    )
+
+    metricas_tornado = {
+        "ROE Júnior (% a.a.)": ("retorno_anualizado_junior", 100.0, "p.p."),
+        "Folga vs Limite de Subordinação (R$)": ("folga_limite", 1.0, "R$"),
+        "Aporte Necessário (R$)": ("aporte_necessario", 1.0, "R$"),
+    }
+
+    cT1, cT2, cT3 = st.columns([2, 1, 1])
+    with cT1:
+        metrica_tornado = st.radio("Métrica", list(metricas_tornado), horizontal=True, key="tornado_metrica")
+    with cT2:
+        choque_tornado = st.slider("Choque relativo (±%)", 1, 50, 10, 1, key="tornado_choque")
+    with cT3:
+        top_tornado = st.slider("Parâmetros exibidos", 5, 31, 12, 1, key="tornado_top")
+
+    sens = sensibilidade_parametros(current_params, choque_tornado / 100.0)
+    campo_t, escala_t, unidade_t = metricas_tornado[metrica_tornado]
+    res_t = sens["metricas"][campo_t]
+    base_t = res_t["base"] * escala_t
+    delta_baixo_t = res_t["baixo"] * escala_t - base_t
+    delta_alto_t = res_t["alto"] * escala_t - base_t
+
+    df_tornado = pd.DataFrame({
+        "Parâmetro": [PARAM_LABELS[c] for c in sens["campos"]],
+        "Valor Atual": sens["valor_base"],
+        f"Impacto −{choque_tornado}%": delta_baixo_t,
+        f"Impacto +{choque_tornado}%": delta_alto_t,
+        "Amplitude": np.abs(delta_alto_t - delta_baixo_t),
+    }).sort_values("Amplitude", ascending=False, kind="stable").reset_index(drop=True)
+
+    df_tornado_top = df_tornado.head(top_tornado).iloc[::-1]
+    if unidade_t == "p.p.":
+        fmt_delta_t = lambda v: f"{v:+.2f} p.p."
+        fmt_amp_t = lambda v: f"{v:.2f} p.p."
+    else:
+        fmt_delta_t = lambda v: f"{'+' if v >= 0 else '-'} {format_brl(abs(v))}"
+        fmt_amp_t = format_brl
+
+    fig_tornado = go.Figure()
+    fig_tornado.add_trace(go.Bar(
+        y=df_tornado_top["Parâmetro"], x=df_tornado_top[f"Impacto −{choque_tornado}%"],
+        orientation="h", name=f"−{choque_tornado}%", marker_color="#c0392b",
+        customdata=[fmt_delta_t(v) for v in df_tornado_top[f"Impacto −{choque_tornado}%"]],
+        hovertemplate="%{y}<br>−" + f"{choque_tornado}%: " + "%{customdata}<extra></extra>",
+    ))
+    fig_tornado.add_trace(go.Bar(
+        y=df_tornado_top["Parâmetro"], x=df_tornado_top[f"Impacto +{choque_tornado}%"],
+        orientation="h", name=f"+{choque_tornado}%", marker_color="#27ae60",
+        customdata=[fmt_delta_t(v) for v in df_tornado_top[f"Impacto +{choque_tornado}%"]],
+        hovertemplate="%{y}<br>+" + f"{choque_tornado}%: " + "%{customdata}<extra></extra>",
+    ))
+    fig_tornado.add_vline(x=0, line_color="black", line_width=1)
+    fig_tornado.update_layout(
+        barmode="overlay",
+        title=f"{metrica_tornado}: variação em relação ao cenário atual",
+        xaxis_title="Variação",
+        height=max(350, 28 * len(df_tornado_top) + 120),
+        margin=dict(l=20, r=20, t=60, b=40),
+        legend=dict(orientation="h", y=-0.12, x=0.5, xanchor="center"),
+    )
+
+    col_tor_graf, col_tor_tab = st.columns([3, 2])
+    with col_tor_graf:
+        st.plotly_chart(fig_tornado, use_container_width=True)
+    with col_tor_tab:
+        lider_t = df_tornado.iloc[0]
+        if lider_t["Amplitude"] > 0:
+            st.metric(
+                "Principal driver",
+                lider_t["Parâmetro"],
+                delta=f"Amplitude: {fmt_amp_t(lider_t['Amplitude'])}",
+                delta_color="off",
+            )
+        else:
+            st.metric("Principal driver", "—", delta="Nenhum choque altera a métrica", delta_color="off")
+        st.dataframe(
+            df_tornado.head(top_tornado).style.format({
+                "Valor Atual": "{:,.2f}",
+                f"Impacto −{choque_tornado}%": fmt_delta_t,
+                f"Impacto +{choque_tornado}%": fmt_delta_t,
+                "Amplitude": fmt_amp_t,
+            }),
+            use_container_width=True,
+            hide_index=True,
+            height=min(460, 38 + 35 * top_tornado),
+        )
+
+    # =========================================================
+    # ESTRUTURA ÓTIMA DE CAPITAL
+    # =========================================================
+    st.markdown("---")
+    st.markdown('<div class="section-header"> Estrutura Ótima de Capital</div>', unsafe_allow_html=True)
+    st.caption(
+        "Busca a divisão Júnior/Mezz/Sênior (PL total fixo) e o % em recebíveis que maximizam o ROE Júnior, "
+        "respeitando a subordinação mínima (antes e depois da PDD), o mínimo de 67% do PL em recebíveis e "
+        "um teto de probabilidade de ruptura. A probabilidade usa a calibração do Monte Carlo da aba de "
+        "Gestão de Risco. Dezenas de milhares de estruturas são avaliadas em lote numa grade grossa, "
+        "refinada em volta das melhores."
+    )
+
+    cOT1, cOT2, cOT3 = st.columns(3)
+    with cOT1:
+        prob_max_ot = st.slider(
+            "Prob. máxima de ruptura (%)", 0.1, 20.0, 1.0, 0.1, key="ot_prob_max",
+            help="Chance máxima aceita de a perda simulada levar a subordinação abaixo do mínimo.",
+        )
+    with cOT2:
+        premio_sr_ot = st.slider(
+            "Prêmio Sênior (bps por p.p. de subordinação)", 0, 50, 0, 1, key="ot_premio_senior",
+            help="Quanto o spread Sênior sobe para cada p.p. de reforço de crédito perdido em relação à estrutura atual "
+                 "(e cai quando o reforço aumenta). 0 = spread fixo.",
+        )
+    with cOT3:
+        premio_mz_ot = st.slider(
+            "Prêmio Mezanino (bps por p.p. de subordinação)", 0, 50, 0, 1, key="ot_premio_mezz",
+            help="Mesmo ajuste para o spread Mezanino, contra a subordinação da Júnior.",
+        )
+
+    res_ot, prob_atual_ot = estrutura_otima(
+        current_params,
+        prob_max_ot,
+        premio_sr_ot,
+        premio_mz_ot,
+        st.session_state.get("mc_dist", "beta"),
+        st.session_state.get("mc_cv", 0.5),
+        st.session_state.get("mc_vol_sist", 0.3),
+        int(st.session_state.get("mc_seed", 42)),
+    )
+
+    if not res_ot["encontrado"]:
+        st.warning(
+            "Nenhuma estrutura atende às restrições com o PL atual. "
+            "Aumente a probabilidade máxima de ruptura ou revise a carteira/subordinação mínima."
+        )
+    else:
+        ot = {k: v[0] for k, v in res_ot["candidatos"].items()}
+        kOT1, kOT2, kOT3, kOT4 = st.columns(4)
+        kOT1.metric(
+            "ROE Júnior Ótimo",
+            format_pct(ot["retorno_anualizado_junior"]),
+            delta=f"{(ot['retorno_anualizado_junior'] - retorno_anualizado_junior) * 100:+.2f} p.p. vs atual",
+        )
+        kOT2.metric("Subordinação Ótima", f"{ot['sub_atual'] * 100:.2f}%", delta=f"Mínimo: {sub_min * 100:.2f}%", delta_color="off")
+        kOT3.metric("Prob. de Ruptura", f"{ot['prob_ruptura'] * 100:.2f}%", delta=f"Atual: {prob_atual_ot * 100:.2f}%", delta_color="off")
+        kOT4.metric("Estruturas Avaliadas", f"{res_ot['n_avaliados']:,}".replace(",", "."))
+
+        df_ot = pd.DataFrame(
+            {
+                "Atual": [
+                    format_brl(valor_junior), format_brl(valor_mezz), format_brl(valor_senior),
+                    f"{current_params['pct_recebiveis_pct']:.2f}%",
+                    f"{current_params['spread_senior_aa_pct']:.2f}%", f"{current_params['spread_mezz_aa_pct']:.2f}%",
+                    format_pct(retorno_anualizado_junior), f"{snap.sub_atual * 100:.2f}%", f"{prob_atual_ot * 100:.2f}%",
+                ],
+                "Ótima": [
+                    format_brl(ot["valor_junior"]), format_brl(ot["valor_mezz"]), format_brl(ot["valor_senior"]),
+                    f"{ot['pct_recebiveis_pct']:.2f}%",
+                    f"{ot['spread_senior_aa_pct']:.2f}%", f"{ot['spread_mezz_aa_pct']:.2f}%",
+                    format_pct(ot["retorno_anualizado_junior"]), f"{ot['sub_atual'] * 100:.2f}%", f"{ot['prob_ruptura'] * 100:.2f}%",
+                ],
+            },
+            index=[
+                "Cota Júnior", "Cota Mezanino", "Cota Sênior", "% em Recebíveis",
+                "Spread Sênior (a.a.)", "Spread Mezanino (a.a.)", "ROE Júnior (a.a.)", "Subordinação", "Prob. de Ruptura",
+            ],
+        )
+
+        # Melhor ROE viável da grade grossa para cada par (Júnior, Mezz)
+        grade_ot = pd.DataFrame({
+            "junior": np.round(res_ot["grade"]["junior"] * 100, 4),
+            "mezz": np.round(res_ot["grade"]["mezz"] * 100, 4),
+            "roe": np.where(res_ot["grade"]["viavel"], res_ot["grade"]["roe"] * 100, np.nan),
+        })
+        mapa_ot = grade_ot.pivot_table(index="mezz", columns="junior", values="roe", aggfunc="max", dropna=False)
+
+        fig_ot = go.Figure(go.Heatmap(
+            x=mapa_ot.columns, y=mapa_ot.index, z=mapa_ot.values,
+            colorscale="RdYlGn", colorbar=dict(title="ROE Jr (%)"),
+            hovertemplate="Júnior: %{x:.1f}% do PL<br>Mezz: %{y:.1f}% do PL<br>ROE Jr: %{z:.2f}%<extra></extra>",
+        ))
+        fig_ot.add_trace(go.Scatter(
+            x=[valor_junior / pl_total * 100], y=[valor_mezz / pl_total * 100],
+            mode="markers", name="Atual", marker=dict(symbol="x", size=13, color="black"),
+        ))
+        fig_ot.add_trace(go.Scatter(
+            x=[ot["valor_junior"] / pl_total * 100], y=[ot["valor_mezz"] / pl_total * 100],
+            mode="markers", name="Ótima", marker=dict(symbol="star", size=16, color="#1f77b4", line=dict(color="white", width=1)),
+        ))
+        fig_ot.update_layout(
+            title="Melhor ROE Júnior viável por divisão do PL (células vazias = restrição violada)",
+            xaxis_title="Júnior (% do PL)",
+            yaxis_title="Mezanino (% do PL)",
+            height=480,
+            margin=dict(l=20, r=20, t=60, b=40),
+            legend=dict(orientation="h", y=-0.15, x=0.5, xanchor="center"),
+        )
+
+        col_ot_graf, col_ot_tab = st.columns([3, 2])
+        with col_ot_graf:
+            st.plotly_chart(fig_ot, use_container_width=True)
+        with col_ot_tab:
+            st.dataframe(df_ot, use_container_width=True)
+
     
 # -------------------------------------------------------------------
 # ABA 2 – GESTÃO DE RISCO & STRESS TEST (UNIFICADA E CORRIGIDA)
@@ -1239,21 +1830,13 @@ with tab_estrutura:
 with tab_risco:
     st.markdown('<div class="section-header"> Gestão de Risco & Stress Test</div>', unsafe_allow_html=True)
 
-    # ---- CÁLCULOS DOS KPIs ----
-    folga_limite = perda_lim_sub - pdd_base
-    folga_pct = folga_limite / perda_lim_sub * 100 if perda_lim_sub > 0 else 0.0
-    cobertura_jr_x = valor_junior / pdd_base if pdd_base > 0 else np.inf
+    # ---- KPIs (já calculados no snapshot do fundo) ----
+    folga_limite = snap.folga_limite
+    folga_pct = snap.folga_pct
+    cobertura_jr_x = snap.cobertura_jr_x
 
-    # Cálculo do Aporte (Reenquadramento)
-    pl_pos_pdd = max(0, pl_total - pdd_base)
-    jr_pos_pdd = max(0, valor_junior - pdd_base)
-    sub_atual_pos = jr_pos_pdd / pl_pos_pdd if pl_pos_pdd > 0 else 0.0
-    
-    if sub_atual_pos < sub_min and (1 - sub_min) != 0:
-        aporte_necessario = (sub_min * pl_pos_pdd - jr_pos_pdd) / (1 - sub_min)
-        aporte_necessario = max(0.0, aporte_necessario)
-    else:
-        aporte_necessario = 0.0
+    # Aporte para reenquadrar a subordinação após a PDD
+    aporte_necessario = snap.aporte_necessario
 
     # ---- SEÇÃO 1: PAINEL DE CONTROLE DE RISCO (KPIs) ----
     cR1, cR2, cR3, cR4, cR5 = st.columns(5)
@@ -1278,10 +1861,8 @@ with tab_risco:
         # Detecta quantas faixas vêm da Sidebar e ajusta os labels dinamicamente
         num_faixas = len(buckets_pct_norm)
         
-        if num_faixas == 6:
-            buckets = ["0–15", "16–30", "31–60", "61–90", "91–180", ">180"]
-        elif num_faixas == 9:
-            buckets = ["0–30", "31–60", "61–90", "91–120", "121–150", "151–180", "181–240", "241–300", ">300"]
+        if num_faixas in LAYOUTS_AGING:
+            buckets = rotulos_faixas(LAYOUTS_AGING[num_faixas])
         else:
             buckets = [f"Faixa {i+1}" for i in range(num_faixas)]
             
@@ -1316,18 +1897,9 @@ with tab_risco:
         st.info("Informe um PL total maior que zero para simular.")
     else:
         # --- 1. CÁLCULO DO PONTO DE RUPTURA (BREAKEVEN) ---
-        # Perda máxima (L) tal que: (Jr - L) / (PL - L) = Sub_min
-        # L = (Jr - Sub_min * PL) / (1 - Sub_min)
-        if sub_min >= 1.0:
-            ruptura_rs = 0.0
-        else:
-            numerador = valor_junior - (sub_min * pl_total)
-            denominador = 1 - sub_min
-            ruptura_rs = max(0.0, numerador / denominador) if denominador != 0 else 0.0
-            
-            # A perda não pode ser maior que a própria cota júnior (equity floor)
-            if ruptura_rs > valor_junior:
-                ruptura_rs = valor_junior
+        # Perda máxima (L) tal que: (Jr - L) / (PL - L) = Sub_min,
+        # limitada à própria cota júnior (equity floor)
+        ruptura_rs = float(ponto_ruptura(valor_junior, pl_total, sub_min))
 
         # Multiplicador de ruptura (Quantas vezes a PDD atual?)
         mult_ruptura = ruptura_rs / pdd_base if pdd_base > 0 else 0
@@ -1394,31 +1966,17 @@ with tab_risco:
             # Formatação do tooltip
             hover_template = "Perda: R$ %{x:,.2f}<br>Sub: %{y:.2f}%"
 
-        # --- 4. CÁLCULO DAS CURVAS ---
-        y_sub = []
-        for x in x_grid:
-            loss = get_loss_from_x(x)
-            pl_s = max(pl_total - loss, 1e-9) # Evitar div/0
-            jr_s = max(valor_junior - loss, 0.0)
-            y_sub.append(jr_s / pl_s * 100)
-
-        # Ponto Simulado (Bolinha Roxa)
-        pl_pos_sim = max(pl_total - perda_simulada_rs, 1e-9)
-        jr_pos_sim = max(valor_junior - perda_simulada_rs, 0.0)
-        sub_pos_sim = jr_pos_sim / pl_pos_sim * 100
+        # --- 4. CÁLCULO DAS CURVAS (vetorizado sobre a grade inteira) ---
+        # Um fundo e 100 pontos: direto no motor (o pool fica para lotes de fundos)
+        curva = curva_stress(get_loss_from_x(x_grid), valor_junior, pl_total, sub_min)
+        y_sub = curva["subordinacao_pct"]
 
-        # Ponto Atual (Quadrado Preto)
-        pl_pos_atual = max(pl_total - pdd_base, 1e-9)
-        jr_pos_atual = max(valor_junior - pdd_base, 0.0)
-        sub_pos_atual = jr_pos_atual / pl_pos_atual * 100
+        # Ponto Simulado (Bolinha Roxa) e Ponto Atual (Quadrado Preto)
+        pontos = curva_stress(np.array([perda_simulada_rs, pdd_base]), valor_junior, pl_total, sub_min)
+        sub_pos_sim, sub_pos_atual = (float(v) for v in pontos["subordinacao_pct"])
 
         # Aporte Necessário (Se simulado < minimo)
-        if sub_pos_sim < sub_min_pct:
-            num = (sub_min * pl_pos_sim) - jr_pos_sim
-            den = 1 - sub_min
-            aporte_sim = max(0.0, num / den) if den != 0 else 0.0
-        else:
-            aporte_sim = 0.0
+        aporte_sim = float(pontos["aporte"][0])
 
         # --- 5. PLOTAGEM DO GRÁFICO ---
         fig_stress = go.Figure()
@@ -1507,6 +2065,114 @@ with tab_risco:
             if aporte_sim > 0:
                 st.warning(f"⚠️ O fundo desenquadrou! É necessário aportar **{format_brl(aporte_sim)}** na Cota Júnior.")
 
+    # ---- SEÇÃO 4: SIMULAÇÃO MONTE CARLO DE PERDAS ----
+    st.markdown("---")
+    st.markdown("###  Simulação Monte Carlo de Perdas")
+    st.caption(
+        "A taxa de perda de cada faixa é sorteada em torno da provisão (média = provisão), "
+        "com um fator sistêmico comum que move todas as faixas juntas. "
+        "Cada caminho passa pela mesma conta de subordinação do stress test."
+    )
+
+    if pl_total <= 0 or valor_recebiveis <= 0:
+        st.info("Informe PL e alocação em recebíveis maiores que zero para simular.")
+    else:
+        cMC1, cMC2, cMC3, cMC4, cMC5 = st.columns(5)
+        with cMC1:
+            n_caminhos_mc = st.selectbox(
+                "Caminhos",
+                [10_000, 100_000, 250_000, 1_000_000],
+                index=1,
+                format_func=lambda n: f"{n:,}".replace(",", "."),
+                key="mc_caminhos",
+            )
+        with cMC2:
+            distribuicao_mc = st.radio("Distribuição", ["beta", "lognormal"], horizontal=True, key="mc_dist")
+        with cMC3:
+            cv_faixa_mc = st.slider(
+                "Dispersão por faixa (CV)", 0.1, 2.0, 0.5, 0.05, key="mc_cv",
+                help="Desvio-padrão da taxa de perda de cada faixa, em múltiplos da provisão.",
+            )
+        with cMC4:
+            vol_sistemica_mc = st.slider(
+                "Volatilidade sistêmica", 0.0, 1.0, 0.3, 0.05, key="mc_vol_sist",
+                help="Choque comum a todas as faixas (0 = faixas independentes).",
+            )
+        with cMC5:
+            seed_mc = int(st.number_input("Semente", min_value=0, value=42, step=1, key="mc_seed"))
+
+        res_mc, hist_contagem, hist_bordas = simulacao_perdas_mc(
+            current_params, n_caminhos_mc, distribuicao_mc, cv_faixa_mc, vol_sistemica_mc, seed_mc
+        )
+
+        kMC1, kMC2, kMC3, kMC4, kMC5 = st.columns(5)
+        kMC1.metric(
+            "Prob. de Desenquadramento",
+            f"{res_mc['prob_desenquadramento']*100:.2f}%",
+            delta=f"Ruptura em {format_brl(ruptura_rs)}",
+            delta_color="off",
+        )
+        kMC2.metric("Aporte Esperado", format_brl(res_mc["aporte_esperado"]))
+        kMC3.metric(
+            "Perda Média Simulada",
+            format_brl(res_mc["perda_media"]),
+            delta=f"PDD base: {format_brl(pdd_base)}",
+            delta_color="off",
+        )
+        idx_q99 = int(np.argmin(np.abs(res_mc["quantis"] - 0.99)))
+        kMC4.metric("Perda 99% (VaR)", format_brl(res_mc["perda_quantis"][idx_q99]))
+        kMC5.metric("Perda Média na Cauda 1% (ES)", format_brl(res_mc["es_99"]))
+
+        col_mc_graf, col_mc_tab = st.columns([2, 1])
+
+        with col_mc_graf:
+            centros = (hist_bordas[:-1] + hist_bordas[1:]) / 2
+            cores_hist = np.where(centros >= ruptura_rs, "#c0392b", "#2980b9")
+            fig_mc = go.Figure(go.Bar(
+                x=centros,
+                y=hist_contagem / res_mc["n_caminhos"] * 100,
+                width=np.diff(hist_bordas),
+                marker_color=cores_hist,
+                name="Caminhos",
+                hovertemplate="Perda: R$ %{x:,.0f}<br>Frequência: %{y:.2f}%<extra></extra>",
+            ))
+            fig_mc.add_vline(x=pdd_base, line_dash="dot", line_color="black",
+                             annotation_text="PDD base", annotation_position="top left")
+            if ruptura_rs <= hist_bordas[-1]:
+                fig_mc.add_vline(x=ruptura_rs, line_dash="dash", line_color="#c0392b",
+                                 annotation_text="Ruptura", annotation_position="top right")
+            fig_mc.update_layout(
+                title="Distribuição da Perda da Carteira",
+                xaxis_title="Perda (R$)",
+                yaxis_title="% dos caminhos",
+                height=380,
+                bargap=0,
+                margin=dict(l=20, r=20, t=60, b=20),
+            )
+            st.plotly_chart(fig_mc, use_container_width=True)
+
+        with col_mc_tab:
+            df_quantis = pd.DataFrame({
+                "Quantil": [f"{q*100:g}%" for q in res_mc["quantis"]],
+                "Perda (R$)": res_mc["perda_quantis"],
+                "% da Carteira": res_mc["perda_quantis"] / valor_recebiveis * 100,
+                "Subordinação (%)": res_mc["subordinacao_quantis"],
+            })
+            st.dataframe(
+                df_quantis.style.format({
+                    "Perda (R$)": format_brl,
+                    "% da Carteira": "{:.2f}%",
+                    "Subordinação (%)": "{:.2f}%",
+                }),
+                use_container_width=True,
+                hide_index=True,
+            )
+            if res_mc["prob_desenquadramento"] > 0:
+                st.caption(
+                    f"Aporte médio nos caminhos desenquadrados: "
+                    f"**{format_brl(res_mc['aporte_medio_se_desenquadrado'])}**"
+                )
+
 
 # -------------------------------------------------------------------
 # ABA 3 – ANÁLISE DE SENSIBILIDADE E SIMULAÇÃO (VERSÃO FINAL DEFINITIVA)
@@ -1556,55 +2222,29 @@ with tab_alvo:
         prob_pdd = prob_pdd_pct / 100.0
         
         # ========== CÁLCULOS ==========
-        prazo_meses = prazo_dias / 30.0
-        # Deságio pelo valor de face: aplica taxa direto sobre o face para o período
-        desagio_valor = ticket * taxa_juros_am * prazo_meses
-        desagio_pct = (desagio_valor / ticket * 100) if ticket > 0 else 0
-        
-        preco_compra = ticket - desagio_valor
-        desembolso_liquido = preco_compra - tac_val
-        
-        mora_dia = mora_pct / 30.0
-        multa_val = ticket * multa_pct if dias_atraso > 0 else 0
-        mora_val = ticket * mora_dia * dias_atraso
-        penalidade_total = multa_val + mora_val
-        recebimento_final = ticket + penalidade_total
-        
-        # TIR Bruta
-        if recebimento_final > 0 and desembolso_liquido > 0:
-            irr_d_bruto = (recebimento_final / desembolso_liquido) ** (1 / max(1, prazo_dias)) - 1
-            irr_m_bruto = (1 + irr_d_bruto) ** 30 - 1
-            irr_a_bruto = (1 + irr_d_bruto) ** 365 - 1
-            retorno_periodo_bruto = (recebimento_final / desembolso_liquido) - 1
-            irr_valid = True
-        else:
-            irr_d_bruto = irr_m_bruto = irr_a_bruto = retorno_periodo_bruto = 0
-            irr_valid = False
-        
-        # TIR Líquida
-        if irr_valid:
-            irr_m_liquido = irr_m_bruto * (1 - prob_pdd)
-            irr_a_liquido = (1 + irr_m_liquido) ** 12 - 1
-            retorno_periodo_liquido = retorno_periodo_bruto * (1 - prob_pdd)
-            irr_liq_valid = True
-        else:
-            irr_m_liquido = irr_a_liquido = retorno_periodo_liquido = 0
-            irr_liq_valid = False
-        
-        receita_total_bruta = recebimento_final - desembolso_liquido
-        pdd_esperada_valor = receita_total_bruta * prob_pdd
-        receita_total_liquida = receita_total_bruta - pdd_esperada_valor
-        
-        # Impacto TAC
-        desembolso_sem_tac = preco_compra
-        if recebimento_final > 0 and desembolso_sem_tac > 0:
-            irr_d_sem_tac = (recebimento_final / desembolso_sem_tac) ** (1 / max(1, prazo_dias)) - 1
-            irr_m_sem_tac = (1 + irr_d_sem_tac) ** 30 - 1
-            irr_m_sem_tac_liq = irr_m_sem_tac * (1 - prob_pdd)
-            impacto_tac = (irr_m_bruto - irr_m_sem_tac) * 100
-        else:
-            irr_m_sem_tac_liq = np.nan
-            impacto_tac = 0
+        # Mesma função da precificação em lote (fidc_precificacao), com um título
+        preco_unit = {k: float(v) for k, v in precificar_titulos(
+            ticket, taxa_juros_am, prazo_dias, tac_val, mora_pct, multa_pct, prob_pdd, dias_atraso
+        ).items()}
+
+        desagio_valor = preco_unit["desagio_valor"]
+        desagio_pct = preco_unit["desagio_pct"]
+        preco_compra = preco_unit["preco_compra"]
+        desembolso_liquido = preco_unit["desembolso_liquido"]
+
+        penalidade_total = preco_unit["penalidade_total"]
+        recebimento_final = preco_unit["recebimento_final"]
+
+        irr_valid = irr_liq_valid = bool(preco_unit["irr_valida"])
+        irr_m_bruto = preco_unit["irr_m_bruto"]
+        irr_m_liquido = preco_unit["irr_m_liquido"]
+        irr_a_liquido = preco_unit["irr_a_liquido"]
+        retorno_periodo_liquido = preco_unit["retorno_periodo_liquido"]
+
+        receita_total_bruta = preco_unit["receita_total_bruta"]
+        pdd_esperada_valor = preco_unit["pdd_esperada_valor"]
+        receita_total_liquida = preco_unit["receita_total_liquida"]
+        impacto_tac = preco_unit["impacto_tac_pp"]
         
         # ========== RESULTADOS ==========
         st.markdown("---")
@@ -1659,30 +2299,200 @@ with tab_alvo:
             {'nome': '241-300d', 'dias': 270, 'pdd': prov_241_300/100, 'desc': 'Faixa 241-300'},
             {'nome': '>300d', 'dias': 330, 'pdd': prov_300p/100, 'desc': 'Faixa >300'},
         ]
-        res_list = []
-        for c in cenarios_pag:
-            pen = (ticket * multa_pct if c['dias']>0 else 0) + (ticket * mora_dia * c['dias'])
-            rec = ticket + pen
-            pdd_c = c.get('pdd', 0.0)
-            pdd_val = ticket * pdd_c  # provisão em R$
-            rec_ajust = rec - pdd_val
-
-            if rec_ajust > 0 and desembolso_liquido > 0:
-                id_ = (rec_ajust / desembolso_liquido) ** (1/max(1, prazo_dias)) - 1
-                im_ = ((1+id_)**30 - 1)
-                ia_ = (1+im_)**12 - 1
-                rec_l = rec_ajust - desembolso_liquido
-            else:
-                im_ = ia_ = rec_l = 0
-
-            res_list.append({
-                'Cenário': c['nome'], 'Descrição': c['desc'],
-                'PDD %': f"{pdd_c*100:.2f}%",
-                'PDD (R$)': format_brl(pdd_val),
-                'TIR Mensal': f"{im_*100:.2f}%", 'TIR Anual': f"{ia_*100:.2f}%", 
-                'Rec. Líquida (R$)': format_brl(rec_l)
-            })
-        st.dataframe(pd.DataFrame(res_list), use_container_width=True, hide_index=True)
+        # Todos os cenários numa avaliação vetorizada (fidc_precificacao.cenarios_pagamento)
+        pdd_cenarios = np.array([c.get('pdd', 0.0) for c in cenarios_pag])
+        res_cen = cenarios_pagamento(
+            ticket, taxa_juros_am, prazo_dias,
+            [c['dias'] for c in cenarios_pag], pdd_cenarios,
+            tac_val, mora_pct, multa_pct,
+        )
+        res_list = pd.DataFrame({
+            'Cenário': [c['nome'] for c in cenarios_pag],
+            'Descrição': [c['desc'] for c in cenarios_pag],
+            'PDD %': [f"{p*100:.2f}%" for p in pdd_cenarios],
+            'PDD (R$)': [format_brl(v) for v in res_cen["pdd_valor"]],
+            'TIR Mensal': [f"{v*100:.2f}%" for v in res_cen["irr_m"]],
+            'TIR Anual': [f"{v*100:.2f}%" for v in res_cen["irr_a"]],
+            'Rec. Líquida (R$)': [format_brl(v) for v in res_cen["receita_liquida"]],
+        })
+        st.dataframe(res_list, use_container_width=True, hide_index=True)
+
+        # Superfície completa: atraso 0–360 dias × prazo × provisão por faixa
+        st.markdown("##### Superfície Atraso × Prazo")
+        st.caption(
+            "Mesma conta da tabela acima para cada atraso de 0 a 360 dias e cada prazo, com a provisão de "
+            "cada faixa da barra lateral; a grade inteira sai de uma única expressão vetorizada."
+        )
+        cg1, cg2, cg3, cg4 = st.columns(4)
+        with cg1:
+            prazos_grade = st.slider("Prazos (dias)", 1, 360, (15, 180), key="grade_prazos")
+        with cg2:
+            passo_prazo_grade = st.select_slider("Passo do prazo (dias)", [1, 5, 15, 30], value=5, key="grade_passo")
+        with cg3:
+            opcoes_prov_grade = ["Faixa do atraso"] + [f"Faixa {rotulo}" for rotulo in BUCKET_LABELS]
+            prov_grade_sel = st.selectbox("Provisão", opcoes_prov_grade, key="grade_provisao",
+                                          help="'Faixa do atraso' usa a provisão da faixa em que cada atraso cai (sem atraso, 0%).")
+        with cg4:
+            metrica_grade = st.selectbox("Métrica", ["TIR Mensal (%)", "TIR Anual (%)", "Rec. Líquida (R$)"], key="grade_metrica")
+        atraso_no_prazo = st.checkbox(
+            "Contar o atraso no prazo da TIR", value=False, key="grade_atraso_prazo",
+            help="Desmarcado (como na tabela): a TIR usa o prazo contratado. Marcado: o recebimento ocorre em prazo + atraso.",
+        )
+
+        atrasos_grade = np.arange(0, 361)
+        eixo_prazos = np.arange(prazos_grade[0], prazos_grade[1] + 1, passo_prazo_grade)
+        provs_grade = provs_raw / 100.0
+        grade = cenarios_pagamento(
+            ticket, taxa_juros_am,
+            eixo_prazos[:, None, None], atrasos_grade[None, :, None], provs_grade[None, None, :],
+            tac_val, mora_pct, multa_pct, atraso_no_prazo,
+        )
+        campo_grade, escala_grade = {
+            "TIR Mensal (%)": ("irr_m", 100.0),
+            "TIR Anual (%)": ("irr_a", 100.0),
+            "Rec. Líquida (R$)": ("receita_liquida", 1.0),
+        }[metrica_grade]
+        valores_grade = grade[campo_grade] * escala_grade            # (prazos, atrasos, faixas)
+        if prov_grade_sel == "Faixa do atraso":
+            faixa_atraso = np.searchsorted(LIMITES_FAIXAS, atrasos_grade, side="left")
+            z_grade = np.take_along_axis(valores_grade, faixa_atraso[None, :, None], axis=2)[:, :, 0]
+            # sem atraso não há provisão
+            z_grade[:, 0] = cenarios_pagamento(ticket, taxa_juros_am, eixo_prazos, 0, 0.0, tac_val, mora_pct, multa_pct)[campo_grade] * escala_grade
+        else:
+            z_grade = valores_grade[:, :, opcoes_prov_grade.index(prov_grade_sel) - 1]
+
+        fig_grade = go.Figure(go.Heatmap(
+            x=atrasos_grade,
+            y=eixo_prazos,
+            z=z_grade,
+            colorscale="RdYlGn",
+            zmid=0 if np.nanmin(z_grade) < 0 < np.nanmax(z_grade) else None,
+            colorbar=dict(title=metrica_grade),
+            hovertemplate="Atraso: %{x} dias<br>Prazo: %{y} dias<br>" + metrica_grade + ": %{z:,.2f}<extra></extra>",
+        ))
+        for limite in LIMITES_FAIXAS:
+            fig_grade.add_vline(x=limite + 0.5, line=dict(color="rgba(0,0,0,0.25)", width=1, dash="dot"))
+        fig_grade.add_hline(y=prazo_dias, line=dict(color="black", width=1, dash="dash"),
+                            annotation_text="prazo atual", annotation_position="top left")
+        fig_grade.update_layout(
+            height=450,
+            xaxis_title="Dias de atraso",
+            yaxis_title="Prazo (dias)",
+            margin=dict(l=40, r=40, t=30, b=40),
+        )
+        st.plotly_chart(fig_grade, use_container_width=True)
+
+        # Precificação em lote
+        st.markdown("---")
+        st.markdown('<div class="section-header"> Precificação em Lote (Borderô)</div>', unsafe_allow_html=True)
+        st.caption(
+            "Envie um CSV com uma linha por título. Só o valor de face é obrigatório; taxa (% a.m.), prazo (dias), "
+            "outras taxas (R$), mora (% a.m.), multa (%), PD (%) e dias de atraso ausentes usam os parâmetros acima."
+        )
+        arquivo_titulos = st.file_uploader("Títulos para precificar", type=["csv", "txt"], key="prec_arquivo")
+        if arquivo_titulos is not None:
+            padroes_prec = {
+                "taxa_am_pct": taxa_juros_am * 100,
+                "prazo_dias": prazo_dias,
+                "tac": tac_val,
+                "mora_am_pct": mora_pct * 100,
+                "multa_pct": multa_pct * 100,
+                "pd_pct": prob_pdd_pct,
+                "dias_atraso": dias_atraso,
+            }
+            try:
+                tabela_prec = precificar_arquivo(arquivo_titulos.getvalue(), padroes_prec)
+            except ValueError as e:
+                st.error(f"Não foi possível ler os títulos: {e}")
+                tabela_prec = None
+
+            if tabela_prec is not None:
+                validos = tabela_prec["irr_valida"]
+                desemb_total = tabela_prec.loc[validos, "desembolso_liquido"].sum()
+                # TIR mensal média ponderada pelo desembolso (aproximação; a TIR consolidada do borderô é outra conta)
+                tir_media = (
+                    (tabela_prec.loc[validos, "irr_m_liquido"] * tabela_prec.loc[validos, "desembolso_liquido"]).sum() / desemb_total
+                    if desemb_total > 0 else 0.0
+                )
+                b1, b2, b3, b4 = st.columns(4)
+                b1.metric("Títulos", f"{len(tabela_prec):,}".replace(",", "."), delta=f"{int((~validos).sum())} sem TIR", delta_color="off")
+                b2.metric("Valor de Face", format_brl(tabela_prec["valor_face"].sum()))
+                b3.metric("Desembolso Líquido", format_brl(tabela_prec["desembolso_liquido"].sum()))
+                b4.metric("TIR Mensal Líquida (média pond.)", f"{tir_media*100:.2f}%")
+
+                st.dataframe(
+                    tabela_prec.head(1_000).rename(columns=PRECIFICACAO_LABELS),
+                    use_container_width=True,
+                    hide_index=True,
+                )
+                if len(tabela_prec) > 1_000:
+                    st.caption(f"Exibindo 1.000 de {len(tabela_prec):,} títulos; a exportação traz todos.".replace(",", "."))
+
+                d1, d2 = st.columns([1, 2])
+                formato_prec = d1.radio("Formato", ["CSV", "Parquet"], horizontal=True, key="prec_formato")
+                d2.download_button(
+                    f"Baixar ({formato_prec})",
+                    data=exportar_arquivo_precificado(arquivo_titulos.getvalue(), padroes_prec, formato_prec.lower()),
+                    file_name=f"precificacao_titulos.{formato_prec.lower()}",
+                    mime="text/csv" if formato_prec == "CSV" else "application/octet-stream",
+                    use_container_width=True,
+                )
+
+        # Borderô: títulos com vencimentos diferentes, TIR consolidada (XIRR)
+        st.markdown("---")
+        st.markdown('<div class="section-header"> Borderô — TIR Consolidada da Operação</div>', unsafe_allow_html=True)
+        st.caption(
+            "CSV com valor de face e vencimento de cada duplicata (taxa % a.m. e PD % opcionais por título). "
+            "O deságio é calculado título a título pelo prazo até o vencimento; a TAC acima é cobrada uma vez "
+            "na operação e a TIR consolidada é a XIRR do fluxo (desembolso hoje, face em cada vencimento)."
+        )
+        cb1, cb2 = st.columns([2, 1])
+        with cb1:
+            arquivo_bordero = st.file_uploader("Borderô (duplicatas)", type=["csv", "txt"], key="bordero_arquivo")
+        with cb2:
+            data_operacao_bordero = st.date_input("Data da operação", value=datetime.now(ZoneInfo("America/Sao_Paulo")).date(), key="bordero_data", format="DD/MM/YYYY")
+
+        if arquivo_bordero is not None:
+            padroes_bordero = {
+                "taxa_am_pct": taxa_juros_am * 100, "pd_pct": prob_pdd_pct, "prazo_dias": prazo_dias,
+                "tac": 0.0, "mora_am_pct": 0.0, "multa_pct": 0.0, "dias_atraso": 0.0,
+            }
+            try:
+                df_bordero, op_b = precificar_bordero_arquivo(
+                    arquivo_bordero.getvalue(), padroes_bordero, data_operacao_bordero, tac_val
+                )
+            except ValueError as e:
+                st.error(f"Não foi possível precificar o borderô: {e}")
+                df_bordero = None
+
+            if df_bordero is not None:
+                tir_ok = op_b["irr_valida"]
+                o1, o2, o3, o4, o5 = st.columns(5)
+                o1.metric("Títulos", f"{op_b['n_titulos']:,}".replace(",", "."), delta=f"Prazo médio {op_b['prazo_medio_dias']:.0f}d", delta_color="off")
+                o2.metric("Deságio Total", format_brl(op_b["desagio_total"]), delta=f"{op_b['desagio_total']/op_b['valor_face_total']*100:.2f}% do face" if op_b["valor_face_total"] > 0 else None, delta_color="off")
+                o3.metric("Desembolso Líquido", format_brl(op_b["desembolso_liquido"]), delta=f"TAC: -{format_brl(op_b['tac'])}", delta_color="inverse")
+                o4.metric("XIRR Mensal Bruta", f"{op_b['irr_m_bruto']*100:.2f}%" if tir_ok else "N/A", delta=f"TAC: {op_b['impacto_tac_pp']:+.2f} pp" if tir_ok else None, delta_color="off")
+                o5.metric("XIRR Mensal Líquida", f"{op_b['irr_m_liquido']*100:.2f}%" if tir_ok else "N/A", delta=f"Esperada: {op_b['irr_m_esperada']*100:.2f}%" if tir_ok else None, delta_color="off",
+                          help="Líquida: bruta × (1 − PD médio), como no simulador. Esperada: XIRR com cada face × (1 − PD do título).")
+
+                st.dataframe(
+                    df_bordero.head(1_000).rename(columns={
+                        **PRECIFICACAO_LABELS,
+                        "id_titulo": "Título",
+                        "vencimento": "Vencimento",
+                        "prazo_dias": "Prazo (dias)",
+                        "participacao_pct": "Participação (%)",
+                        "irr_m_bruto": "TIR Mensal do Título",
+                    }),
+                    use_container_width=True,
+                    hide_index=True,
+                )
+                st.download_button(
+                    "Baixar borderô precificado (CSV)",
+                    data=exportar_bordero_arquivo(arquivo_bordero.getvalue(), padroes_bordero, data_operacao_bordero, tac_val),
+                    file_name="bordero_precificado.csv",
+                    mime="text/csv",
+                )
 
     # ============================================================
     # SUB-ABA 1 (ou 2): SIMULADOR DE CENÁRIOS (AJUSTADO)
@@ -1737,19 +2547,10 @@ with tab_alvo:
             spr_sr_sim = st.number_input("Spread Sênior", 0.0, 10.0, float(spread_senior_aa_pct), 0.25, key="s_spr_sr") / 100
             spr_mz_sim = st.number_input("Spread Mezz", 0.0, 10.0, float(spread_mezz_aa_pct), 0.25, key="s_spr_mz") / 100
             
-            # Alinha com o cenÇ­rio base: juros lineares /252
-            tx_sr_sim_d = (cdi_aa + spr_sr_sim) / 252.0
-            tx_mz_sim_d = (cdi_aa + spr_mz_sim) / 252.0
-            
             # Sliders de Variação de Custos/Receitas Fixas (Solicitados anteriormente)
             st.markdown("---")
             var_outros_custos_pct = st.slider("Var. Custos Fixos (%)", -100, 100, 0, 5, key="s_var_cf") / 100.0
             var_outras_rec_pct = st.slider("Var. Outras Receitas (%)", -100, 100, 0, 5, key="s_var_or") / 100.0
-
-            custo_outros_sim = custo_outros_dia * (1 + var_outros_custos_pct)
-            rec_outros_sim = receita_outros_dia * (1 + var_outras_rec_pct)
-            
-            custo_adm_gestao_sim = custo_adm_dia + custo_gestao_dia + custo_outros_sim
         
         with col_sim3:
             st.markdown("**Risco (PDD):**")
@@ -1762,21 +2563,32 @@ with tab_alvo:
             st.caption(f"**Nova Estrutura:**\n\n🟦 Recebíveis: {format_brl(val_rec_sim)}\n\n🟩 Caixa: {format_brl(val_cx_sim)}")
 
         # ========== CÁLCULOS SIMULADOS ==========
-        rec_cart_s = val_rec_sim * mensal_to_diario(taxa_cart_sim)
-        rec_caixa_s = val_cx_sim * anual_to_diario(taxa_caixa_sim)
-        rec_tot_s = rec_cart_s + rec_caixa_s + rec_outros_sim
-        
-        custo_sr_s = valor_senior * tx_sr_sim_d
-        custo_mz_s = valor_mezz * tx_mz_sim_d
-        
+        # Valores do painel (em fração); a mesma função gera a superfície abaixo
+        ajustes_sim = {
+            "pct_recebiveis": pct_alocacao_sim,
+            "taxa_carteira_am": taxa_cart_sim,
+            "taxa_caixa_aa": taxa_caixa_sim,
+            "spread_senior_aa": spr_sr_sim,
+            "spread_mezz_aa": spr_mz_sim,
+            "var_outros_custos": var_outros_custos_pct,
+            "var_outras_receitas": var_outras_rec_pct,
+            "pdd_mult": pdd_mul_sim,
+        }
+        sim = simular_cenario(snap, **ajustes_sim)
+
+        rec_cart_s = float(sim["receita_carteira_dia"])
+        rec_caixa_s = float(sim["receita_caixa_dia"])
+        rec_outros_sim = float(sim["receita_outros_dia"])
+        custo_sr_s = float(sim["custo_senior_dia"])
+        custo_mz_s = float(sim["custo_mezz_dia"])
+        custo_adm_gestao_sim = float(sim["custos_fixos_dia"])
+
         # PDD escala com volume E multiplicador
-        pdd_val_s = (val_rec_sim * taxa_perda_esperada / 252.0) * pdd_mul_sim
-        
-        custo_tot_s = custo_sr_s + custo_mz_s + custo_adm_gestao_sim + pdd_val_s
-        res_liq_s = rec_tot_s - custo_tot_s
-        
+        pdd_val_s = float(sim["pdd_dia"])
+        res_liq_s = float(sim["resultado_junior_dia"])
+
         # Retorno (Simples/Linear)
-        ret_jr_aa_s = (res_liq_s * 252) / valor_junior if valor_junior > 0 else 0
+        ret_jr_aa_s = float(sim["retorno_anualizado_junior"])
         
         # Deltas
         delta_res_dia = res_liq_s - res_jr_dia_atual
@@ -1888,6 +2700,108 @@ with tab_alvo:
         })
         st.dataframe(df_comp_sim, use_container_width=True, hide_index=True)
 
+        # ========== SUPERFÍCIE DE SENSIBILIDADE (2 VARIÁVEIS) ==========
+        st.markdown("---")
+        st.markdown('<div class="section-header"> Superfície de Sensibilidade</div>', unsafe_allow_html=True)
+        st.caption(
+            "Escolha duas variáveis do simulador e a faixa de cada uma. As demais ficam nos valores do "
+            "painel acima; a grade inteira é calculada numa única avaliação vetorizada."
+        )
+
+        # Limites das faixas, na unidade exibida
+        limites_superficie = {
+            "pct_recebiveis": (0.0, 100.0),
+            "taxa_carteira_am": (0.0, 10.0),
+            "taxa_caixa_aa": (0.0, 30.0),
+            "spread_senior_aa": (0.0, 15.0),
+            "spread_mezz_aa": (0.0, 15.0),
+            "var_outros_custos": (-100.0, 100.0),
+            "var_outras_receitas": (-100.0, 100.0),
+            "pdd_mult": (0.0, 10.0),
+        }
+        metricas_superficie = {
+            "ROE Júnior (% a.a.)": ("retorno_anualizado_junior", 100.0),
+            "Resultado Diário (R$)": ("resultado_junior_dia", 1.0),
+            "Subordinação pós-PDD (%)": ("sub_pos_pdd", 100.0),
+        }
+        rotulo_var = lambda nome: CENARIO_VARIAVEIS[nome][0]
+
+        cSup1, cSup2, cSup3, cSup4 = st.columns(4)
+        with cSup1:
+            var_x_sup = st.selectbox("Eixo X", list(CENARIO_VARIAVEIS), index=1, format_func=rotulo_var, key="sup_var_x")
+        with cSup2:
+            opcoes_y_sup = [n for n in CENARIO_VARIAVEIS if n != var_x_sup]
+            var_y_sup = st.selectbox(
+                "Eixo Y", opcoes_y_sup, index=opcoes_y_sup.index("pdd_mult") if "pdd_mult" in opcoes_y_sup else 0,
+                format_func=rotulo_var, key="sup_var_y",
+            )
+        with cSup3:
+            metrica_sup = st.selectbox("Métrica", list(metricas_superficie), key="sup_metrica")
+        with cSup4:
+            n_grade_sup = st.slider("Resolução (pontos por eixo)", 50, 300, 200, 25, key="sup_resolucao")
+
+        def faixa_superficie(nome, coluna):
+            lo, hi = limites_superficie[nome]
+            atual = ajustes_sim[nome] / CENARIO_VARIAVEIS[nome][1]
+            meia = (hi - lo) / 4
+            with coluna:
+                return st.slider(
+                    f"Faixa – {rotulo_var(nome)}", lo, hi,
+                    (float(max(lo, atual - meia)), float(min(hi, atual + meia))),
+                    key=f"sup_faixa_{nome}",
+                )
+
+        cFx, cFy = st.columns(2)
+        faixa_x_sup = faixa_superficie(var_x_sup, cFx)
+        faixa_y_sup = faixa_superficie(var_y_sup, cFy)
+
+        grade_x_sup = np.linspace(*faixa_x_sup, n_grade_sup)
+        grade_y_sup = np.linspace(*faixa_y_sup, n_grade_sup)
+        ajustes_grade = dict(ajustes_sim)
+        ajustes_grade[var_x_sup] = grade_x_sup[None, :] * CENARIO_VARIAVEIS[var_x_sup][1]
+        ajustes_grade[var_y_sup] = grade_y_sup[:, None] * CENARIO_VARIAVEIS[var_y_sup][1]
+
+        campo_sup, escala_sup = metricas_superficie[metrica_sup]
+        z_sup = np.broadcast_to(
+            simular_cenario(snap, **ajustes_grade)[campo_sup] * escala_sup,
+            (n_grade_sup, n_grade_sup),
+        )
+
+        fig_sup = go.Figure(go.Heatmap(
+            x=grade_x_sup,
+            y=grade_y_sup,
+            z=z_sup,
+            colorscale="RdYlGn",
+            colorbar=dict(title=metrica_sup),
+            hovertemplate=f"{rotulo_var(var_x_sup)}: " + "%{x:.2f}<br>"
+                          + f"{rotulo_var(var_y_sup)}: " + "%{y:.2f}<br>"
+                          + f"{metrica_sup}: " + "%{z:,.2f}<extra></extra>",
+        ))
+        # Isolinha de referência: enquadramento na subordinação, break-even nas demais
+        nivel_ref = sub_min_pct if campo_sup == "sub_pos_pdd" else 0.0
+        if z_sup.min() < nivel_ref < z_sup.max():
+            fig_sup.add_trace(go.Contour(
+                x=grade_x_sup, y=grade_y_sup, z=z_sup,
+                contours=dict(start=nivel_ref, end=nivel_ref, size=1, coloring="none", showlabels=True),
+                line=dict(color="black", width=2, dash="dash"),
+                showscale=False, hoverinfo="skip", name="Referência",
+            ))
+        fig_sup.add_trace(go.Scatter(
+            x=[ajustes_sim[var_x_sup] / CENARIO_VARIAVEIS[var_x_sup][1]],
+            y=[ajustes_sim[var_y_sup] / CENARIO_VARIAVEIS[var_y_sup][1]],
+            mode="markers+text", text=["Simulado"], textposition="top center",
+            marker=dict(size=12, color="black", symbol="x"), name="Simulado",
+        ))
+        fig_sup.update_layout(
+            title=f"{metrica_sup}: {rotulo_var(var_y_sup)} × {rotulo_var(var_x_sup)}",
+            xaxis_title=rotulo_var(var_x_sup),
+            yaxis_title=rotulo_var(var_y_sup),
+            height=520,
+            margin=dict(l=20, r=20, t=60, b=20),
+            showlegend=False,
+        )
+        st.plotly_chart(fig_sup, use_container_width=True)
+
        
         # ============================================================
         # SUB-ABA 3: TAXA-ALVO DO FUNDO (CÁLCULO POR CUSTO IMPLÍCITO)
@@ -1925,9 +2839,10 @@ with tab_alvo:
         
             # --- CÁLCULO REVERSO: dado o ROE alvo da Júnior, qual taxa preciso na carteira? ---
             if target_roe_jr > -100.0 and valor_recebiveis > 0 and valor_junior > 0:
-                # usa SEMPRE a função unificada (com CDI e PDD)
-                taxa_dia_nec = taxa_carteira_necessaria_diaria(target_roe_jr)
-                taxa_mes_nec = ((1 + taxa_dia_nec) ** dias_uteis_mes - 1) * 100.0
+                # usa SEMPRE o solver unificado do engine (com CDI e PDD)
+                taxa_nec = taxa_carteira_necessaria(snap, target_roe_jr)
+                taxa_dia_nec = float(taxa_nec["taxa_dia"])
+                taxa_mes_nec = float(taxa_nec["taxa_am"]) * 100.0
                 rec_carteira_necessaria = valor_recebiveis * taxa_dia_nec
             else:
                 taxa_dia_nec = 0.0
@@ -1973,11 +2888,7 @@ with tab_alvo:
             roe_max = max(roe_min + 1.0, target_roe_jr + 20)
             roe_range = np.linspace(roe_min, roe_max, 50)
         
-            taxas_necessarias = []
-            for roe in roe_range:
-                t_dia_i = taxa_carteira_necessaria_diaria(roe)
-                t_mes_i = ((1 + t_dia_i) ** dias_uteis_mes - 1) * 100.0
-                taxas_necessarias.append(t_mes_i)
+            taxas_necessarias = taxa_carteira_necessaria(snap, roe_range)["taxa_am"] * 100.0
         
             fig_target = go.Figure()
         
@@ -2023,6 +2934,41 @@ with tab_alvo:
         
             st.plotly_chart(fig_target, use_container_width=True)
 
+            # --- SUPERFÍCIE: ROE ALVO × MULTIPLICADOR DE PDD ---
+            st.markdown("---")
+            st.markdown("#### Superfície de Taxa Necessária: ROE Alvo × Multiplicador de PDD")
+            st.caption("Taxa mensal necessária nos recebíveis (% a.m.) para cada combinação de meta de ROE e nível de perda, na alocação atual.")
+
+            pdd_mult_range = np.linspace(0.0, 5.0, 101)
+            roe_range_sup = np.linspace(roe_min, roe_max, 161)
+            superficie_taxa = taxa_carteira_necessaria(snap, roe_range_sup, pdd_mult=pdd_mult_range[:, None])["taxa_am"] * 100.0
+
+            fig_sup = go.Figure(go.Heatmap(
+                x=roe_range_sup,
+                y=pdd_mult_range,
+                z=superficie_taxa,
+                colorscale="RdYlGn_r",
+                colorbar=dict(title="% a.m."),
+                hovertemplate="ROE: %{x:.2f}%<br>PDD: %{y:.1f}x<br>Taxa: %{z:.4f}% a.m.<extra></extra>",
+            ))
+            fig_sup.add_trace(go.Contour(
+                x=roe_range_sup,
+                y=pdd_mult_range,
+                z=superficie_taxa,
+                contours=dict(start=taxa_carteira_am_pct, end=taxa_carteira_am_pct, size=1, coloring="none", showlabels=True),
+                line=dict(color="black", width=2, dash="dash"),
+                showscale=False,
+                name="Taxa Atual",
+                hoverinfo="skip",
+            ))
+            fig_sup.update_layout(
+                xaxis_title="ROE Alvo da Júnior (% a.a.)",
+                yaxis_title="Multiplicador de PDD (x)",
+                height=450,
+                margin=dict(l=20, r=20, t=30, b=20),
+            )
+            st.plotly_chart(fig_sup, use_container_width=True)
+
 
 
     
@@ -2038,7 +2984,15 @@ with tab_dre:
     # ---------------------------
     # TABELA EDITÁVEL DE PARÂMETROS POR MÊS
     # ---------------------------
-    meses = [f"Mês {i}" for i in range(1, 13)]
+    horizonte_meses = st.slider(
+        "Horizonte da projeção (meses)",
+        min_value=12,
+        max_value=120,
+        value=12,
+        step=12,
+        key="dre_horizonte",
+    )
+    meses = [f"Mês {i}" for i in range(1, horizonte_meses + 1)]
 
     # Valores "base" vindos do cenário atual
     base_taxa_carteira = taxa_carteira_am_pct
@@ -2048,14 +3002,14 @@ with tab_dre:
 
     df_param_base = pd.DataFrame({
         "Mês": meses,
-        "Taxa carteira (% a.m.)": [base_taxa_carteira] * 12,
-        "% PL em recebíveis": [base_pct_recebiveis] * 12,
-        "Outras receitas (R$/mês)": [base_outras_receitas_mes] * 12,
-        "Outros custos (R$/mês)": [base_outros_custos_mes] * 12,
-        "PDD manual (R$/mês)": [0.0] * 12,
-        "Movimento Júnior (R$/mês)": [0.0] * 12,
-        "Movimento Mezz (R$/mês)": [0.0] * 12,
-        "Movimento Sênior (R$/mês)": [0.0] * 12,
+        "Taxa carteira (% a.m.)": [base_taxa_carteira] * horizonte_meses,
+        "% PL em recebíveis": [base_pct_recebiveis] * horizonte_meses,
+        "Outras receitas (R$/mês)": [base_outras_receitas_mes] * horizonte_meses,
+        "Outros custos (R$/mês)": [base_outros_custos_mes] * horizonte_meses,
+        "PDD manual (R$/mês)": [0.0] * horizonte_meses,
+        "Movimento Júnior (R$/mês)": [0.0] * horizonte_meses,
+        "Movimento Mezz (R$/mês)": [0.0] * horizonte_meses,
+        "Movimento Sênior (R$/mês)": [0.0] * horizonte_meses,
     })
 
     st.markdown("#### Parâmetros mês a mês")
@@ -2067,139 +3021,174 @@ with tab_dre:
         use_container_width=True
     )
 
+    params_dre = {arg: df_param[coluna].to_numpy(dtype=float) for arg, coluna in DRE_COLUNAS_PARAM.items()}
+
     # ---------------------------
-    # SIMULAÇÃO MÊS A MÊS
+    # PDD AUTOMÁTICA: CONSTANTE OU ROLL-RATE (MARKOV)
     # ---------------------------
-    dias_uteis_ano = 252
-    meses_ano = 12
-    dias_uteis_mes = dias_uteis_ano / meses_ano
-
-    # PL inicial por classe (mês 1)
-    pl_junior = valor_junior
-    pl_mezz   = valor_mezz
-    pl_senior = valor_senior
-
-    linhas_dre_mensal = []
-
-    for idx, row in df_param.iterrows():
-        mes_label = row["Mês"]
-
-        # ----- PL INICIAL DO MÊS -----
-        pl_inicial_junior = pl_junior
-        pl_inicial_mezz   = pl_mezz
-        pl_inicial_senior = pl_senior
-        pl_inicial_total  = pl_inicial_junior + pl_inicial_mezz + pl_inicial_senior
-
-        # ----- MOVIMENTOS (aporte/resgate líquido) -----
-        mov_j = float(row["Movimento Júnior (R$/mês)"])
-        mov_m = float(row["Movimento Mezz (R$/mês)"])
-        mov_s = float(row["Movimento Sênior (R$/mês)"])
-
-        pl_junior_mov = pl_inicial_junior + mov_j
-        pl_mezz_mov   = pl_inicial_mezz   + mov_m
-        pl_senior_mov = pl_inicial_senior + mov_s
-
-        pl_total_mov = pl_junior_mov + pl_mezz_mov + pl_senior_mov
-
-        # ----- PARÂMETROS ESPECÍFICOS DO MÊS -----
-        taxa_carteira_am_mes = float(row["Taxa carteira (% a.m.)"]) / 100.0
-        pct_recebiveis_mes   = float(row["% PL em recebíveis"]) / 100.0
-
-        outras_receitas_mes  = float(row["Outras receitas (R$/mês)"])
-        outros_custos_mes    = float(row["Outros custos (R$/mês)"])
-        pdd_manual_mes       = float(row["PDD manual (R$/mês)"])
-
-        taxa_carteira_diaria_mes = mensal_to_diario(taxa_carteira_am_mes)
-
-        # ----- ALOCAÇÃO EM RECEBÍVEIS E CAIXA -----
-        valor_recebiveis_mes = pl_total_mov * pct_recebiveis_mes
-        valor_caixa_mes      = pl_total_mov - valor_recebiveis_mes
-
-        # ----- RECEITAS DO MÊS -----
-        receita_carteira_mes   = valor_recebiveis_mes * taxa_carteira_diaria_mes * dias_uteis_mes
-        receita_caixa_mes      = valor_caixa_mes      * cdi_diario              * dias_uteis_mes
-        receita_outros_mes_sim = outras_receitas_mes
-        receita_total_mes      = receita_carteira_mes + receita_caixa_mes + receita_outros_mes_sim
-
-        # ----- CUSTOS DO MÊS -----
-        custo_senior_mes = pl_senior_mov * taxa_senior_diaria * dias_uteis_mes
-        custo_mezz_mes   = pl_mezz_mov   * taxa_mezz_diaria   * dias_uteis_mes
-        custo_adm_mes    = pl_total_mov  * taxa_adm_diaria    * dias_uteis_mes
-        custo_gestao_mes = pl_total_mov  * taxa_gestao_diaria * dias_uteis_mes
-
-        pdd_auto_mes = (
-            valor_recebiveis_mes * taxa_perda_esperada / meses_ano
-            if incluir_pdd else 0.0
-        )
-        pdd_mes = pdd_manual_mes + pdd_auto_mes
-
-        custo_outros_mes_sim = outros_custos_mes
-
-        # ----- RESULTADO DO MÊS -----
-        resultado_fundo_mes = (
-            receita_total_mes
-            - custo_senior_mes
-            - custo_mezz_mes
-            - custo_adm_mes
-            - custo_gestao_mes
-            - pdd_mes
-            - custo_outros_mes_sim
+    st.markdown("#### PDD automática")
+    modo_pdd_dre = st.radio(
+        "Perda esperada mês a mês",
+        ["Constante (aging atual)", "Roll-rate (Markov)"],
+        horizontal=True,
+        key="dre_modo_pdd",
+        help="Constante: usa a perda esperada do aging da barra lateral em todos os meses. "
+             "Roll-rate: projeta a migração da carteira entre as faixas e recalcula a perda a cada mês.",
+    )
+
+    taxa_perda_dre = None
+    if modo_pdd_dre == "Roll-rate (Markov)":
+        rolagem_sugerida = rolagem_estacionaria(snap.buckets_pct_norm)
+        aging_estavel = bool(aging_estacionario(snap.buckets_pct_norm))
+        st.caption(
+            "Rolagem mensal de cada faixa para a seguinte (na >300, a baixa). O restante liquida e é "
+            "reposto com títulos novos na faixa 0–30. "
+            + ("As taxas sugeridas mantêm o aging atual estável. " if aging_estavel else "")
+            + "A velocidade multiplica todas as taxas (limitadas a 100%)."
         )
+        if not aging_estavel:
+            st.warning(
+                "O aging da barra lateral cresce de uma faixa para a seguinte antes da >300: nenhuma "
+                "rolagem o mantém estável, e as taxas sugeridas são só uma aproximação. A projeção é "
+                "não estacionária: mesmo a 1x o aging e a perda esperada se afastam dos atuais, e a DRE "
+                "usa essa perda projetada (para a PDD do aging atual, escolha \"Constante\")."
+            )
+        col_rr1, col_rr2 = st.columns([1, 2])
+        with col_rr1:
+            df_rolagem = st.data_editor(
+                pd.DataFrame({
+                    "Faixa": BUCKET_LABELS,
+                    "Rolagem / Baixa (% a.m.)": rolagem_sugerida * 100,
+                }),
+                disabled=["Faixa"],
+                hide_index=True,
+                num_rows="fixed",
+                use_container_width=True,
+                key="dre_rolagem",
+            )
+            velocidade_migracao = st.slider(
+                "Velocidade de migração (x)", 0.25, 4.0, 1.0, 0.25, key="dre_vel_migracao"
+            )
 
-        resultado_junior_mes = resultado_fundo_mes
-
-        # ----- PL FINAL DO MÊS -----
-        pl_mezz_final   = pl_mezz_mov + custo_mezz_mes
-        pl_senior_final = pl_senior_mov + custo_senior_mes
-        pl_junior_final = pl_junior_mov + resultado_junior_mes
-        pl_total_final  = pl_mezz_final + pl_senior_final + pl_junior_final # Ajustado para PL Total Real
-
-        # Retorno da Júnior no mês
-        base_retorno_jr = pl_junior_mov if pl_junior_mov != 0 else 1.0
-        retorno_jr_mes_pct = resultado_junior_mes / base_retorno_jr
-
-        linhas_dre_mensal.append({
-            "Mês": mes_label,
-            "PL Inicial (R$)": pl_inicial_total,
-            "PL Após Movimentos (R$)": pl_total_mov,
-            "Receita Carteira (R$)": receita_carteira_mes,
-            "Receita Caixa (R$)": receita_caixa_mes,
-            "Outras Receitas (R$)": receita_outros_mes_sim,
-            "Receita Total (R$)": receita_total_mes,
-            "Custo Sênior (R$)": custo_senior_mes,
-            "Custo Mezz (R$)": custo_mezz_mes,
-            "Taxa Adm (R$)": custo_adm_mes,
-            "Taxa Gestão (R$)": custo_gestao_mes,
-            "PDD (R$)": pdd_mes,
-            "Outros Custos (R$)": custo_outros_mes_sim,
-            "Resultado Cota Júnior (R$)": resultado_junior_mes,
-            "PL Final (R$)": pl_total_final,
-            "PL Final Sênior (R$)": pl_senior_final, # Guardado para o gráfico novo
-            "PL Final Mezz (R$)": pl_mezz_final,     # Guardado para o gráfico novo
-            "PL Final Júnior (R$)": pl_junior_final,
-            "Retorno Júnior no mês (%)": retorno_jr_mes_pct * 100,
+        # Cenários de velocidade em lote: K matrizes de transição de uma vez
+        rolagem_base = df_rolagem["Rolagem / Baixa (% a.m.)"].to_numpy(dtype=float) / 100
+        velocidades = np.unique(np.r_[[0.5, 1.0, 1.5, 2.0, 3.0], velocidade_migracao])
+        P_cenarios = matriz_roll_rate(rolagem_base * velocidades[:, None])
+        dist_cenarios = projetar_aging(snap.buckets_pct_norm, P_cenarios, horizonte_meses)
+        taxa_perda_cenarios = taxa_perda_aging(dist_cenarios, snap.prov_rates)
+
+        idx_vel = int(np.searchsorted(velocidades, velocidade_migracao))
+        taxa_perda_dre = taxa_perda_cenarios[idx_vel]
+
+        with col_rr2:
+            fig_aging = go.Figure()
+            for b, label in enumerate(BUCKET_LABELS):
+                fig_aging.add_trace(go.Scatter(
+                    x=meses, y=dist_cenarios[idx_vel, :, b] * 100, name=label,
+                    mode="lines", stackgroup="aging",
+                    hovertemplate=f"{label}: " + "%{y:.2f}%<extra></extra>",
+                ))
+            fig_aging.add_trace(go.Scatter(
+                x=meses, y=taxa_perda_dre * 100, name="Perda esperada (%)",
+                mode="lines", line=dict(color="black", width=2, dash="dot"), yaxis="y2",
+            ))
+            fig_aging.update_layout(
+                title=f"Aging Projetado (velocidade {velocidade_migracao:.2f}x"
+                      f"{'' if aging_estavel else ', não estacionário'})",
+                height=380,
+                yaxis=dict(title="% da carteira", range=[0, 100]),
+                yaxis2=dict(title="Perda esperada (%)", overlaying="y", side="right", showgrid=False),
+                legend=dict(orientation="h", y=-0.2, x=0.5, xanchor="center"),
+                margin=dict(l=40, r=40, t=50, b=40),
+                hovermode="x unified",
+            )
+            st.plotly_chart(fig_aging, use_container_width=True)
+
+        # DRE dos K cenários de migração numa chamada só (lotes no pool de processos)
+        dre_cenarios = projetar_dre_paralelo(snap, taxa_perda_esperada=taxa_perda_cenarios, **params_dre)
+        df_cen_rr = pd.DataFrame({
+            "Velocidade (x)": velocidades,
+            "Perda esperada final (%)": taxa_perda_cenarios[:, -1] * 100,
+            "PDD acumulada (R$)": dre_cenarios[:, :, DRE_IDX["PDD (R$)"]].sum(axis=1),
+            "Resultado Júnior acumulado (R$)": dre_cenarios[:, :, DRE_IDX["Resultado Cota Júnior (R$)"]].sum(axis=1),
+            "PL Final Júnior (R$)": dre_cenarios[:, -1, DRE_IDX["PL Final Júnior (R$)"]],
+            # TIR do cotista Júnior no horizonte: todos os cenários numa chamada
+            "TIR Júnior (% a.a.)": ((1 + tir_lote(fluxos_cotista(snap, dre_cenarios, "junior", params_dre["mov_junior"]))) ** 12 - 1) * 100,
         })
+        st.markdown("##### Cenários de velocidade de migração")
+        st.dataframe(
+            df_cen_rr.style.format({
+                "Velocidade (x)": "{:.2f}x",
+                "Perda esperada final (%)": "{:.2f}%",
+                "PDD acumulada (R$)": format_brl,
+                "Resultado Júnior acumulado (R$)": format_brl,
+                "PL Final Júnior (R$)": format_brl,
+                "TIR Júnior (% a.a.)": "{:.2f}%",
+            }, na_rep="N/A"),
+            use_container_width=True,
+            hide_index=True,
+        )
 
-        pl_junior = pl_junior_final
-        pl_mezz   = pl_mezz_final
-        pl_senior = pl_senior_final
+    # ---------------------------
+    # SIMULAÇÃO MÊS A MÊS (engine vetorizado; aqui, 1 cenário)
+    # ---------------------------
+    dre_proj = projetar_dre(snap, taxa_perda_esperada=taxa_perda_dre, **params_dre)
 
     # ---------------------------
     # TABELA FINAL DA DRE MENSAL
     # ---------------------------
-    df_dre_mensal = pd.DataFrame(linhas_dre_mensal)
+    df_dre_mensal = pd.DataFrame(dre_proj[0], columns=DRE_LINHAS)
+    df_dre_mensal.insert(0, "Mês", df_param["Mês"].to_numpy())
 
-    st.markdown("#### DRE mês a mês (12 meses)")
-
-    df_dre_show = df_dre_mensal.copy()
-    for col in df_dre_show.columns:
-        if col == "Mês": continue
-        if "Retorno" in col and "(%)" in col:
-            df_dre_show[col] = df_dre_show[col].apply(lambda x: f"{x:,.2f} %")
-        else:
-            df_dre_show[col] = df_dre_show[col].apply(format_brl)
+    # ---------------------------
+    # VISÃO EXIBIDA: janela de 12 meses ou agregação trimestral/anual
+    # (tabela e gráficos abaixo usam só df_dre_view)
+    # ---------------------------
+    st.markdown(f"#### DRE mês a mês ({horizonte_meses} meses)")
+
+    col_v1, col_v2 = st.columns([1, 2])
+    with col_v1:
+        visao_dre = st.radio(
+            "Visão",
+            ["Mensal", "Trimestral", "Anual"],
+            horizontal=True,
+            key="dre_visao",
+        )
+    if visao_dre == "Mensal":
+        rotulo_periodo = "Mês"
+        inicio_janela = 1
+        if horizonte_meses > 12:
+            with col_v2:
+                inicio_janela = st.slider(
+                    "Janela exibida (mês inicial)",
+                    min_value=1,
+                    max_value=horizonte_meses - 11,
+                    value=1,
+                    key="dre_janela",
+                )
+        df_dre_view = df_dre_mensal.iloc[inicio_janela - 1:inicio_janela + 11].reset_index(drop=True)
+    else:
+        rotulo_periodo, meses_periodo, prefixo = (
+            ("Trimestre", 3, "Tri") if visao_dre == "Trimestral" else ("Ano", 12, "Ano")
+        )
+        dre_agregado = agregar_dre(dre_proj, meses_periodo)[0]
+        df_dre_view = pd.DataFrame(dre_agregado, columns=DRE_LINHAS)
+        df_dre_view.insert(0, "Mês", [f"{prefixo} {i}" for i in range(1, len(df_dre_view) + 1)])
+        st.caption(
+            "Fluxos somados no período; PL inicial do primeiro mês e PL final do último; "
+            "retorno da Júnior composto no período."
+        )
 
-    st.dataframe(df_dre_show, use_container_width=True, height=500)
+    formatos_dre = {
+        col: (lambda x: f"{x:,.2f} %") if ("Retorno" in col and "(%)" in col) else format_brl
+        for col in DRE_LINHAS
+    }
+    st.dataframe(
+        df_dre_view.rename(columns={"Mês": rotulo_periodo}).style.format(formatos_dre),
+        use_container_width=True,
+        height=min(500, 38 + 35 * len(df_dre_view)),
+        hide_index=True,
+    )
 
     # ---------------------------
     # GRÁFICO FINAL: COMPOSIÇÃO DETALHADA (CORES CORPORATIVAS/SÓBRIAS)
@@ -2218,7 +3207,7 @@ with tab_dre:
     v_rec_cart, v_rec_caixa, v_rec_outras = [], [], []
     v_pdd, v_taxas, v_senior, v_mezz, v_junior = [], [], [], [], []
 
-    for i, row in df_dre_mensal.iterrows():
+    for i, row in df_dre_view.iterrows():
         rev = row["Receita Total (R$)"]
         
         # Valores Absolutos
@@ -2249,7 +3238,7 @@ with tab_dre:
     
     # 1. Juros Carteira
     fig_dual.add_trace(go.Bar(
-        x=df_dre_mensal["Mês"], y=p_rec_cart, name="Rec. Carteira", offsetgroup=0,
+        x=df_dre_view["Mês"], y=p_rec_cart, name="Rec. Carteira", offsetgroup=0,
         marker_color="#154360", # Azul Marinho
         text=[f"{p:.1%}" if p>0.05 else "" for p in p_rec_cart], textposition="auto", textfont=dict(color="white"),
         hovertemplate="Carteira: %{y:.1%}<br>R$ %{customdata}<extra></extra>", customdata=[format_brl(v) for v in v_rec_cart]
@@ -2257,7 +3246,7 @@ with tab_dre:
     
     # 2. Rendimento Caixa
     fig_dual.add_trace(go.Bar(
-        x=df_dre_mensal["Mês"], y=p_rec_caixa, name="Rec. Caixa", offsetgroup=0, base=p_rec_cart,
+        x=df_dre_view["Mês"], y=p_rec_caixa, name="Rec. Caixa", offsetgroup=0, base=p_rec_cart,
         marker_color="#5DADE2", # Azul Claro
         text=[f"{p:.1%}" if p>0.05 else "" for p in p_rec_caixa], textposition="auto", textfont=dict(color="black"),
         hovertemplate="Caixa: %{y:.1%}<br>R$ %{customdata}<extra></extra>", customdata=[format_brl(v) for v in v_rec_caixa]
@@ -2266,7 +3255,7 @@ with tab_dre:
     # 3. Outras Receitas
     base_outras = [x + y for x, y in zip(p_rec_cart, p_rec_caixa)]
     fig_dual.add_trace(go.Bar(
-        x=df_dre_mensal["Mês"], y=p_rec_outras, name="Outras Rec.", offsetgroup=0, base=base_outras,
+        x=df_dre_view["Mês"], y=p_rec_outras, name="Outras Rec.", offsetgroup=0, base=base_outras,
         marker_color="#D6EAF8", # Azul Bebê
         text=[f"{p:.1%}" if p>0.05 else "" for p in p_rec_outras], textposition="auto", textfont=dict(color="black"),
         hovertemplate="Outras: %{y:.1%}<br>R$ %{customdata}<extra></extra>", customdata=[format_brl(v) for v in v_rec_outras]
@@ -2277,7 +3266,7 @@ with tab_dre:
     
     # 1. PDD (Vermelho Queimado - Destaque de Perda)
     fig_dual.add_trace(go.Bar(
-        x=df_dre_mensal["Mês"], y=p_pdd, name="PDD", offsetgroup=1,
+        x=df_dre_view["Mês"], y=p_pdd, name="PDD", offsetgroup=1,
         marker_color="#B03A2E", # Vermelho Escuro
         text=[f"{p:.1%}" if p>0.03 else "" for p in p_pdd], textposition="auto", textfont=dict(color="white"),
         hovertemplate="PDD: %{y:.1%}<br>R$ %{customdata}<extra></extra>", customdata=[format_brl(v) for v in v_pdd]
@@ -2286,7 +3275,7 @@ with tab_dre:
     # 2. Taxas (Cinza Claro - Operacional)
     base_taxas = p_pdd
     fig_dual.add_trace(go.Bar(
-        x=df_dre_mensal["Mês"], y=p_taxas, name="Taxas/Desp.", offsetgroup=1, base=base_taxas,
+        x=df_dre_view["Mês"], y=p_taxas, name="Taxas/Desp.", offsetgroup=1, base=base_taxas,
         marker_color="#BDC3C7", # Prata
         text=[f"{p:.1%}" if p>0.03 else "" for p in p_taxas], textposition="auto", textfont=dict(color="black"),
         hovertemplate="Taxas: %{y:.1%}<br>R$ %{customdata}<extra></extra>", customdata=[format_brl(v) for v in v_taxas]
@@ -2295,7 +3284,7 @@ with tab_dre:
     # 3. Sênior (Cinza Chumbo - Obrigação Principal)
     base_senior = [x + y for x, y in zip(base_taxas, p_taxas)]
     fig_dual.add_trace(go.Bar(
-        x=df_dre_mensal["Mês"], y=p_senior, name="Sênior", offsetgroup=1, base=base_senior,
+        x=df_dre_view["Mês"], y=p_senior, name="Sênior", offsetgroup=1, base=base_senior,
         marker_color="#566573", # Chumbo
         text=[f"{p:.1%}" if p>0.03 else "" for p in p_senior], textposition="auto", textfont=dict(color="white"),
         hovertemplate="Sênior: %{y:.1%}<br>R$ %{customdata}<extra></extra>", customdata=[format_brl(v) for v in v_senior]
@@ -2304,7 +3293,7 @@ with tab_dre:
     # 4. Mezz (Cinza Médio - Obrigação Secundária)
     base_mezz = [x + y for x, y in zip(base_senior, p_senior)]
     fig_dual.add_trace(go.Bar(
-        x=df_dre_mensal["Mês"], y=p_mezz, name="Mezzanino", offsetgroup=1, base=base_mezz,
+        x=df_dre_view["Mês"], y=p_mezz, name="Mezzanino", offsetgroup=1, base=base_mezz,
         marker_color="#808B96", # Cinza Médio
         text=[f"{p:.1%}" if p>0.03 else "" for p in p_mezz], textposition="auto", textfont=dict(color="white"),
         hovertemplate="Mezz: %{y:.1%}<br>R$ %{customdata}<extra></extra>", customdata=[format_brl(v) for v in v_mezz]
@@ -2313,7 +3302,7 @@ with tab_dre:
     # 5. Júnior (Verde Esmeralda - Lucro)
     base_junior = [x + y for x, y in zip(base_mezz, p_mezz)]
     fig_dual.add_trace(go.Bar(
-        x=df_dre_mensal["Mês"], y=p_junior, name="Lucro Júnior", offsetgroup=1, base=base_junior,
+        x=df_dre_view["Mês"], y=p_junior, name="Lucro Júnior", offsetgroup=1, base=base_junior,
         marker_color="#27AE60", # Verde
         text=[f"{p:.1%}" if p>0.03 else "" for p in p_junior], textposition="inside", textfont=dict(color="white", size=11, family="Arial Black"),
         hovertemplate="Lucro Jr: %{y:.1%}<br>R$ %{customdata}<extra></extra>", customdata=[format_brl(v) for v in v_junior]
@@ -2322,7 +3311,7 @@ with tab_dre:
     fig_dual.update_layout(
         title="Origem da Receita (Esq) vs. Destinação (Dir)",
         height=500,
-        xaxis=dict(title="Mês"),
+        xaxis=dict(title=rotulo_periodo),
         yaxis=dict(
             title="% do Total", 
             tickformat=".0%", 
@@ -2337,6 +3326,22 @@ with tab_dre:
     
     st.plotly_chart(fig_dual, use_container_width=True)
 
+    # ---------------------------
+    # TIR DOS COTISTAS NO HORIZONTE (fluxos com aportes/resgates e PL final)
+    # ---------------------------
+    fluxos_classes = np.vstack([
+        fluxos_cotista(snap, dre_proj, classe, params_dre[f"mov_{classe}"])
+        for classe in ("junior", "mezz", "senior")
+    ])
+    tir_classes = (1 + tir_lote(fluxos_classes)) ** 12 - 1
+    t1, t2, t3 = st.columns(3)
+    for col, nome, tir in zip((t1, t2, t3), ("Júnior", "Mezzanino", "Sênior"), tir_classes):
+        col.metric(
+            f"TIR {nome} no horizonte (% a.a.)",
+            f"{tir*100:.2f}%" if np.isfinite(tir) else "N/A",
+            help="XIRR mensal do cotista: PL inicial e aportes como saídas, resgates e PL final como entradas.",
+        )
+
    # ---------------------------
     # GRÁFICOS RESUMO (APENAS PERFORMANCE)
     # ---------------------------
@@ -2348,7 +3353,7 @@ with tab_dre:
     retorno_acumulado = []
     acc = 1.0 # Fator acumulado inicial
 
-    for i, row in df_dre_mensal.iterrows():
+    for i, row in df_dre_view.iterrows():
         # 1. Impacto PDD %
         base_j = row["PL Final Júnior (R$)"] - row["Resultado Cota Júnior (R$)"]
         if base_j != 0:
@@ -2366,11 +3371,11 @@ with tab_dre:
 
     # Barras: Retorno Mensal (Eixo Y1 - Esquerda)
     fig_ret.add_trace(go.Bar(
-        x=df_dre_mensal["Mês"],
-        y=df_dre_mensal["Retorno Júnior no mês (%)"],
+        x=df_dre_view["Mês"],
+        y=df_dre_view["Retorno Júnior no mês (%)"],
         name="Retorno Mensal",
         marker_color="#2980b9",
-        text=[f"{v:.1f}%" for v in df_dre_mensal["Retorno Júnior no mês (%)"]],
+        text=[f"{v:.1f}%" for v in df_dre_view["Retorno Júnior no mês (%)"]],
         textposition="auto",
         opacity=0.7,
         yaxis="y1"
@@ -2378,7 +3383,7 @@ with tab_dre:
 
     # Linha: Impacto PDD (Eixo Y1 - Esquerda - Comparável ao retorno mensal)
     fig_ret.add_trace(go.Scatter(
-        x=df_dre_mensal["Mês"],
+        x=df_dre_view["Mês"],
         y=pdd_pct_sobre_junior,
         mode="lines+markers",
         name="Impacto PDD / PL Jr",
@@ -2390,7 +3395,7 @@ with tab_dre:
 
     # Linha: Retorno Acumulado (Eixo Y2 - Direita)
     fig_ret.add_trace(go.Scatter(
-        x=df_dre_mensal["Mês"],
+        x=df_dre_view["Mês"],
         y=retorno_acumulado,
         mode="lines+markers",
         name="Retorno Acumulado",
@@ -2403,7 +3408,7 @@ with tab_dre:
     fig_ret.update_layout(
         title="Performance da Cota Júnior (%)",
         height=500, 
-        xaxis=dict(title="Mês"),
+        xaxis=dict(title=rotulo_periodo),
         
         # Eixo Y1 (Mensal)
         yaxis=dict(
@@ -2442,7 +3447,7 @@ with tab_dre:
     subordinacao_real = []
     headroom_list = []
     
-    for i, row in df_dre_mensal.iterrows():
+    for i, row in df_dre_view.iterrows():
         # --- CORREÇÃO DO ERRO AQUI ---
         # O "PL Final (R$)" da tabela já contém (Sênior + Mezz + Júnior).
         # Não devemos somar a Júnior novamente.
@@ -2482,21 +3487,21 @@ with tab_dre:
     text_barras = [human_format(v) for v in headroom_list]
     
     fig_cap.add_trace(go.Bar(
-        x=df_dre_mensal["Mês"],
+        x=df_dre_view["Mês"],
         y=headroom_list,
         name="Espaço Sênior/Mezz",
         marker_color=colors_cap,
         text=text_barras,          
         textposition="auto",       
         textfont=dict(size=11, color="white"), 
-        hovertemplate="Mês: %{x}<br>Espaço: R$ %{y:,.2f}<br><i>(Captação/Resgate Sênior)</i><extra></extra>", 
+        hovertemplate="%{x}<br>Espaço: R$ %{y:,.2f}<br><i>(Captação/Resgate Sênior)</i><extra></extra>", 
         yaxis="y1",
         opacity=0.85
     ))
 
     # Linha: Índice de Subordinação Real
     fig_cap.add_trace(go.Scatter(
-        x=df_dre_mensal["Mês"],
+        x=df_dre_view["Mês"],
         y=subordinacao_real,
         name="Subordinação Real (%)",
         mode="lines+markers+text",
@@ -2505,7 +3510,7 @@ with tab_dre:
         textfont=dict(size=12, color="#2c3e50", family="Arial Black"), 
         line=dict(width=3, color="#2c3e50"),
         marker=dict(size=9, color="white", line=dict(width=2, color="#2c3e50")),
-        hovertemplate="Mês: %{x}<br>Subordinação: %{y:.2f}%<extra></extra>",
+        hovertemplate="%{x}<br>Subordinação: %{y:.2f}%<extra></extra>",
         yaxis="y2"
     ))
 
@@ -2557,7 +3562,7 @@ with tab_dre:
     fig_cap.update_layout(
         title="Headroom de Captação (Sênior/Mezz) e Enquadramento",
         height=480, 
-        xaxis=dict(title="Mês"),
+        xaxis=dict(title=rotulo_periodo),
         yaxis=dict(
             title="Capacidade (R$)", 
             side="left",
@@ -2599,7 +3604,7 @@ with tab_dre:
     # Função lambda para formatar MM (Ex: 4.5MM)
     fmt_mm = lambda x: f"R$ {x/1_000_000:.1f}MM"
 
-    for i, row in df_dre_mensal.iterrows():
+    for i, row in df_dre_view.iterrows():
         pl_tot = row["PL Final (R$)"]
         
         # Valores Absolutos
@@ -2630,7 +3635,7 @@ with tab_dre:
 
     # 1. Júnior (Base - Risco)
     fig_comp.add_trace(go.Bar(
-        x=df_dre_mensal["Mês"],
+        x=df_dre_view["Mês"],
         y=pct_junior,
         name="Júnior",
         marker_color="#EC7063", # Vermelho Suave
@@ -2642,7 +3647,7 @@ with tab_dre:
 
     # 2. Mezzanino (Meio)
     fig_comp.add_trace(go.Bar(
-        x=df_dre_mensal["Mês"],
+        x=df_dre_view["Mês"],
         y=pct_mezz,
         name="Mezzanino",
         marker_color="#F7DC6F", # Amarelo Suave
@@ -2654,7 +3659,7 @@ with tab_dre:
 
     # 3. Sênior (Topo)
     fig_comp.add_trace(go.Bar(
-        x=df_dre_mensal["Mês"],
+        x=df_dre_view["Mês"],
         y=pct_senior,
         name="Sênior",
         marker_color="#7DCEA0", # Verde Suave
@@ -2678,7 +3683,7 @@ with tab_dre:
     fig_comp.update_layout(
         barmode='stack',
         height=500, # Um pouco mais alto para caber as duas linhas de texto
-        xaxis=dict(title="Mês"),
+        xaxis=dict(title=rotulo_periodo),
         yaxis=dict(title="Proporção do PL (%)", range=[0, 100]),
         legend=dict(orientation="h", y=-0.15, x=0.5, xanchor='center'),
         margin=dict(l=50, r=50, t=40, b=40)
@@ -2690,7 +3695,7 @@ with tab_dre:
     # GRÁFICO FINAL: DIAGRAMA DE SANKEY (COM % E LEGIBILIDADE MELHORADA)
     # ---------------------------
     st.markdown("---")
-    st.markdown("#### Fluxo Financeiro: Da Origem ao Resultado (Acumulado 12 Meses)")
+    st.markdown(f"#### Fluxo Financeiro: Da Origem ao Resultado (Acumulado {horizonte_meses} Meses)")
     st.caption(
         "**Esquerda:** Origem da Receita (Composição). | **Centro:** Receita Total (100%). | **Direita:** Para onde foi o dinheiro (Custos e Lucro)."
     )
@@ -2846,14 +3851,7 @@ SPREAD_POR_RATING = {
     }
 
 
-rating_ordem = [
-            "AAA", "AA+", "AA", "AA-",
-            "A+", "A", "A-",
-            "BBB+", "BBB", "BBB-",
-            "BB+", "BB", "BB-",
-            "B+", "B", "B-",
-            "CCC", "CC", "C",
-            ]
+rating_ordem = list(RATING_ORDEM)
 
 
 
@@ -3148,10 +4146,25 @@ with tab_rating:
 
         
 
+        # =============================
+        # EXPOSIÇÃO JÁ EXISTENTE (FITA IMPORTADA)
+        # =============================
+        # Consolidada pela raiz do CNPJ: o limite vale para o grupo do sacado
+        indice_exposicao = (
+            exposicao_fita_compartilhada(st.session_state["fita_chave"], chaves_delta)
+            if st.session_state.get("fita_chave") else None
+        )
+        if indice_exposicao is not None and st.session_state.get("cnpj_sacado"):
+            exposicao_sacado = indice_exposicao.apos_operacao(st.session_state["cnpj_sacado"], valor_operacao)
+            exposicao_atual_sacado = exposicao_sacado["grupo"]
+        else:
+            exposicao_sacado = None
+            exposicao_atual_sacado = 0.0
+
         # =============================
         # DELTA DE CONCENTRAÇÃO POR SACADO
         # =============================
-        pct_pl_total = valor_operacao / pl_total if pl_total > 0 else 0
+        pct_pl_total = (exposicao_atual_sacado + valor_operacao) / pl_total if pl_total > 0 else 0
         excesso_concentracao = pct_pl_total - limite_pct_pl_sacado
 
         if excesso_concentracao > 0:
@@ -3188,7 +4201,6 @@ with tab_rating:
             delta_color = "normal"   # verde
 
 
-        pct_pl_total = valor_operacao / pl_total if pl_total > 0 else 0
         impacto_junior = valor_operacao / valor_junior if valor_junior > 0 else 0
 
 
@@ -3197,7 +4209,15 @@ with tab_rating:
             f"{pct_pl_total*100:.2f}%",
             delta=status_operacao,
             delta_color=delta_color,
-            help=f"Limite máximo permitido por sacado: {limite_pct_pl_sacado*100:.1f}% do PL"
+            help=(
+                f"Limite máximo permitido por sacado: {limite_pct_pl_sacado*100:.1f}% do PL. "
+                + (
+                    f"Inclui a exposição atual do grupo (raiz {exposicao_sacado['raiz']}) na fita: "
+                    f"{format_brl(exposicao_atual_sacado)}."
+                    if exposicao_sacado is not None
+                    else "Sem fita importada (ou sem CNPJ do sacado): considera só esta operação."
+                )
+            ),
         )
 
 
@@ -3213,6 +4233,41 @@ with tab_rating:
             help="Percentual da cota júnior consumido em caso de default total."
         )
 
+        # =============================
+        # CONCENTRAÇÃO DA CARTEIRA (FITA)
+        # =============================
+        if indice_exposicao is not None:
+            with st.expander("🔎 Concentração da carteira por sacado (fita importada)"):
+                if exposicao_sacado is not None:
+                    e1, e2, e3 = st.columns(3)
+                    e1.metric("Exposição atual no sacado", format_brl(exposicao_sacado["sacado"]))
+                    e2.metric("Exposição atual no grupo (raiz CNPJ)", format_brl(exposicao_sacado["grupo"]))
+                    e3.metric("Grupo após a operação", format_brl(exposicao_sacado["grupo_apos"]))
+
+                n_top = st.slider("Maiores exposições", 5, 50, 10, 5, key="conc_top")
+                visao_conc = st.radio("Consolidação", ["Raiz do CNPJ", "Sacado"], horizontal=True, key="conc_visao")
+                conc = indice_exposicao.raiz if visao_conc == "Raiz do CNPJ" else indice_exposicao.sacado
+
+                h1, h2, h3 = st.columns(3)
+                h1.metric("HHI", f"{conc.hhi():.4f}", help="Soma dos quadrados das participações (0 = pulverizada, 1 = um único devedor).")
+                h2.metric("Devedores", f"{len(conc.exposicao):,}".replace(",", "."))
+                h3.metric("Carteira", format_brl(conc.total))
+
+                df_conc = pd.DataFrame(conc.top(n_top), columns=[visao_conc, "Exposição (R$)"])
+                df_conc["% da Carteira"] = df_conc["Exposição (R$)"] / conc.total * 100 if conc.total > 0 else 0.0
+                df_conc["% do PL"] = df_conc["Exposição (R$)"] / pl_total * 100 if pl_total > 0 else 0.0
+                df_conc["Acima do Limite"] = df_conc["% do PL"] > limite_pct_pl_sacado * 100
+                st.dataframe(
+                    df_conc.style.format({
+                        "Exposição (R$)": format_brl,
+                        "% da Carteira": "{:.2f}%",
+                        "% do PL": "{:.2f}%",
+                        "Acima do Limite": lambda v: "⚠️ Sim" if v else "Não",
+                    }),
+                    use_container_width=True,
+                    hide_index=True,
+                )
+
     # -------------------------------------------------------------
         # ESTRUTURA DA OPERAÇÃO — PRÊMIO ESTRUTURAL
         # -------------------------------------------------------------
@@ -3260,16 +4315,18 @@ with tab_rating:
             )
 
         # =============================
-        # MATRIZ DE AJUSTES (bps)
+        # MATRIZ DE AJUSTES (bps) — fidc_enquadramento.PREMIO_ESTRUTURAL_BPS
         # =============================
-        ajustes_bps = {
-            "operacao_confirmada": 0 if operacao_confirmada == "Sim" else 20,
-            "forma_pagamento": 0 if forma_pagamento == "Boleto emitido pelo FIDC" else 25,
-            "recompra_cedente": 0 if recompra_cedente == "Sim" else 40,
-            "trava_domicilio": 0 if trava_domicilio == "Sim" else 30,
-        }
+        operacao_pre_trade = Operacao(
+            sacado=st.session_state.get("cnpj_sacado") or st.session_state.get("nome_sacado") or "",
+            valor=valor_operacao,
+            operacao_confirmada=operacao_confirmada == "Sim",
+            boleto_fidc=forma_pagamento == "Boleto emitido pelo FIDC",
+            recompra_cedente=recompra_cedente == "Sim",
+            trava_domicilio=trava_domicilio == "Sim",
+        )
 
-        premio_estrutural_bps = sum(ajustes_bps.values())
+        premio_estrutural_bps = calcular_premio_estrutural_bps(operacao_pre_trade)
         st.session_state["premio_estrutural_bps"] = premio_estrutural_bps
 
 
@@ -3300,51 +4357,22 @@ with tab_rating:
         with col_r1:
             tempo_relacionamento = st.selectbox(
                 "Tempo de relacionamento com o fundo",
-                [
-                    "Menos de 3 meses",
-                    "Entre 3 e 12 meses",
-                    "Entre 12 e 36 meses",
-                    "Mais de 36 meses"
-                ]
+                list(AJUSTE_RELACIONAMENTO_BPS)
             )
 
         with col_r2:
             restricoes_recentes = st.selectbox(
                 "Restrições recentes (jurídicas / operacionais)",
-                [
-                    "Nenhuma",
-                    "Leve",
-                    "Moderada",
-                    "Grave"
-                ]
+                list(AJUSTE_RESTRICAO_BPS)
             )
 
         # -----------------------------
         # LÓGICA DE AJUSTE EM BPS
         # -----------------------------
-        ajuste_relacionamento_bps = 0
-        ajuste_restricao_bps = 0
-        operacao_elegivel = True
-
-        # Relacionamento
-        if tempo_relacionamento == "Menos de 3 meses":
-            ajuste_relacionamento_bps = 20
-        elif tempo_relacionamento == "Entre 3 e 12 meses":
-            ajuste_relacionamento_bps = 0
-        elif tempo_relacionamento == "Entre 12 e 36 meses":
-            ajuste_relacionamento_bps = -10
-        elif tempo_relacionamento == "Mais de 36 meses":
-            ajuste_relacionamento_bps = -20
-
-        # Restrições
-        if restricoes_recentes == "Nenhuma":
-            ajuste_restricao_bps = 0
-        elif restricoes_recentes == "Leve":
-            ajuste_restricao_bps = 25
-        elif restricoes_recentes == "Moderada":
-            ajuste_restricao_bps = 50
-        elif restricoes_recentes == "Grave":
-            operacao_elegivel = False
+        # Tabelas em fidc_enquadramento (Grave → não elegível)
+        ajuste_relacionamento_bps = AJUSTE_RELACIONAMENTO_BPS[tempo_relacionamento]
+        ajuste_restricao_bps = AJUSTE_RESTRICAO_BPS[restricoes_recentes] or 0
+        operacao_elegivel = AJUSTE_RESTRICAO_BPS[restricoes_recentes] is not None
 
         # Ajuste total do bloco
         ajuste_total_relacionamento_bps = ajuste_relacionamento_bps + ajuste_restricao_bps
@@ -3380,6 +4408,98 @@ with tab_rating:
                 help="Restrições graves inviabilizam a operação."
             )
 
+        # =============================
+        # RESULTADO PRÉ-TRADE (todas as regras juntas)
+        # =============================
+        # Mesma checagem usada fora do dashboard (fidc_enquadramento); aqui só
+        # verifica, sem registrar, então o índice cacheado da fita não muda.
+        # O rating final só é calculado na aba de análise, mais adiante no
+        # script: o veredito é escrito neste espaço depois dele.
+        veredito_pre_trade = st.empty()
+        verificador = VerificadorPreTrade(
+            PoliticaFundo(
+                pl_total=pl_total,
+                valor_junior=valor_junior,
+                limite_pct_pl_sacado=limite_pct_pl_sacado,
+                rating_minimo=rating_minimo,
+            ),
+            caixa_disponivel,
+            indice_exposicao,
+        )
+        operacao_pre_trade = replace(
+            operacao_pre_trade,
+            tempo_relacionamento=tempo_relacionamento,
+            restricoes_recentes=restricoes_recentes,
+        )
+
+        # =============================
+        # ENQUADRAMENTO EM LOTE (FILA DE OPERAÇÕES)
+        # =============================
+        with st.expander("📋 Enquadramento em lote — fila de operações (CSV)"):
+            st.caption(
+                "Colunas: Sacado, CNPJ, Valor, Rating e, opcionalmente, Confirmada, Forma de Pagamento, "
+                "Recompra, Trava (Sim/Não), Relacionamento e Restrições (mesmas opções acima). "
+                "Usa a política informada acima (limite por sacado, caixa e rating mínimo)"
+                + (" e a exposição da fita importada." if indice_exposicao is not None else ".")
+            )
+            arquivo_fila = st.file_uploader("Fila de operações", type=["csv", "txt"], key="fila_arquivo")
+            acumular_fila = st.checkbox(
+                "Avaliar em ordem, somando as aprovadas anteriores da fila",
+                value=True,
+                key="fila_acumular",
+                help="Cada operação consome limite do grupo e caixa das aprovadas antes dela. "
+                     "Desmarcado: cada operação é avaliada sozinha contra a carteira atual.",
+            )
+
+            if arquivo_fila is not None:
+                try:
+                    df_fila = enquadrar_fila(
+                        arquivo_fila.getvalue(),
+                        verificador.politica,
+                        caixa_disponivel,
+                        st.session_state.get("fita_chave"),
+                        acumular_fila,
+                        chaves_delta,
+                    )
+                except ValueError as e:
+                    st.error(f"Não foi possível ler a fila: {e}")
+                    df_fila = None
+
+                if df_fila is not None:
+                    aprovadas = df_fila["aprovada"]
+                    f1, f2, f3, f4 = st.columns(4)
+                    f1.metric("Operações", f"{len(df_fila):,}".replace(",", "."))
+                    f2.metric("Aprovadas", f"{int(aprovadas.sum()):,}".replace(",", "."))
+                    f3.metric("Valor aprovado", format_brl(df_fila.loc[aprovadas, "valor"].sum()))
+                    f4.metric("Valor reprovado", format_brl(df_fila.loc[~aprovadas, "valor"].sum()))
+
+                    df_fila_view = pd.DataFrame({
+                        "Sacado": df_fila["nome_sacado"],
+                        "CNPJ / Chave": df_fila["chave"],
+                        "Valor (R$)": df_fila["valor"],
+                        "Rating": df_fila["rating"],
+                        "Status": np.where(aprovadas, "✅ Aprovada", "⛔ Reprovada"),
+                        "% PL do Grupo": df_fila["pct_pl_grupo"] * 100,
+                        "Prêmio Estrutural (bps)": df_fila["premio_estrutural_bps"],
+                        "Ajuste Relacionamento (bps)": df_fila["ajuste_relacionamento_bps"],
+                        "Motivos": df_fila["motivos"],
+                    })
+                    st.dataframe(
+                        df_fila_view.style.format({
+                            "Valor (R$)": format_brl,
+                            "% PL do Grupo": "{:.2f}%",
+                            "Ajuste Relacionamento (bps)": lambda v: "N/A" if pd.isna(v) else f"{v:+.0f}",
+                        }),
+                        use_container_width=True,
+                        hide_index=True,
+                    )
+                    st.download_button(
+                        "Baixar resultado (CSV)",
+                        data=df_fila.to_csv(sep=";", decimal=",", index=False).encode("utf-8-sig"),
+                        file_name="enquadramento_fila.csv",
+                        mime="text/csv",
+                    )
+
         # -------------------------------------------------
         # CUSTO BASE DO FUNDO (WACC ECONÔMICO)
         # -------------------------------------------------
@@ -4077,6 +5197,13 @@ with tab_rating:
         st.session_state["rating_cod_final"] = rating_cod_final
         rating_label_final = rating_cod_final
 
+        # Veredito pré-trade do cadastro, com o rating desta execução
+        resultado_pre_trade = verificador.verificar(replace(operacao_pre_trade, rating=rating_cod_final))
+        if resultado_pre_trade["aprovada"]:
+            veredito_pre_trade.success("✅ Pré-trade: operação enquadrada em todas as regras do fundo.")
+        else:
+            veredito_pre_trade.error("⛔ Pré-trade: operação reprovada — " + "; ".join(resultado_pre_trade["motivos"]) + ".")
+
         # -------------------------------------------------------------
         # ENQUADRAMENTO vs RATING MÍNIMO
         # -------------------------------------------------------------
@@ -0,0 +1,981 @@
+"""
+Fita de recebíveis (sem dependência do Streamlit).
+
+Lê a fita (CSV ou XLSX, uma linha por título) em blocos de tamanho fixo,
+converte cada bloco para colunas tipadas e compactas e descarta o texto
+original, para a memória não crescer com o tamanho do arquivo: sacado,
+cedente e status viram códigos inteiros (categóricos), datas viram
+datetime64[D] e valores float64.
+
+A partir da fita tipada saem a distribuição por faixa de aging (os pct_* da
+sidebar) e a PDD em R$.
+
+Fitas já lidas ficam num cache em disco (Arrow IPC, uma coluna por campo)
+com a chave do hash do conteúdo: abrir de novo é um memory-map, sem reler o
+CSV e sem copiar as colunas para a memória de cada sessão.
+"""
+import hashlib
+import heapq
+import io
+import os
+import tempfile
+import unicodedata
+from dataclasses import dataclass, replace
+from itertools import compress
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+from fidc_engine import BUCKETS
+
+
+LINHAS_POR_BLOCO = 250_000
+# Linhas lidas no início do arquivo para decidir o formato decimal dos valores
+LINHAS_AMOSTRA_DECIMAL = 100_000
+
+# Cache de fitas lidas (FIDC_CACHE_FITAS muda o diretório)
+DIRETORIO_CACHE = Path(os.environ.get("FIDC_CACHE_FITAS", Path(__file__).resolve().parent / ".cache_fitas"))
+# Entra na chave: mudar a leitura/tipagem invalida as fitas já gravadas
+VERSAO_CACHE = 4
+
+COLUNAS_FITA = ("id_titulo", "sacado", "cedente", "valor_face", "vencimento", "data_aquisicao", "status")
+COLUNAS_OBRIGATORIAS = ("valor_face", "vencimento")
+
+# Cabeçalhos aceitos (já normalizados: minúsculo, sem acento, "_" no lugar de espaço)
+ALIASES_COLUNAS = {
+    "id_titulo": ("id_titulo", "id", "titulo", "numero_titulo", "num_titulo", "nosso_numero", "seu_numero"),
+    "sacado": ("sacado", "cnpj_sacado", "cpf_cnpj_sacado", "documento_sacado", "doc_sacado", "devedor"),
+    "cedente": ("cedente", "cnpj_cedente", "cpf_cnpj_cedente", "documento_cedente", "doc_cedente"),
+    "valor_face": ("valor_face", "valor", "valor_nominal", "valor_titulo", "vl_face", "vl_nominal"),
+    "vencimento": ("vencimento", "data_vencimento", "dt_vencimento", "venc"),
+    "data_aquisicao": ("data_aquisicao", "dt_aquisicao", "aquisicao", "data_cessao", "dt_cessao"),
+    "status": ("status", "situacao"),
+}
+
+# Títulos com estes status saem da carteira (não entram no aging nem na PDD)
+STATUS_FORA_CARTEIRA = ("liquidado", "pago", "recomprado")
+
+# Limite superior (dias de atraso) de cada faixa; a última é aberta
+LIMITES_FAIXAS = (30, 60, 90, 120, 150, 180, 240, 300)   # 9 faixas da sidebar
+LAYOUTS_AGING = {
+    9: LIMITES_FAIXAS,
+    6: (15, 30, 60, 90, 180),
+}
+
+
+@dataclass(frozen=True)
+class Fita:
+    """
+    Fita tipada. Colunas categóricas guardam códigos int32 que indexam
+    `sacados` / `cedentes` / `status_nomes` (-1 = vazio). O identificador
+    do título é guardado só como hash de 64 bits (`chave_titulo`, 0 = sem
+    identificador), suficiente para casar os arquivos delta.
+    """
+    chave_titulo: np.ndarray
+    sacado: np.ndarray
+    cedente: np.ndarray
+    valor_face: np.ndarray
+    vencimento: np.ndarray
+    data_aquisicao: np.ndarray
+    status: np.ndarray
+    sacados: np.ndarray
+    cedentes: np.ndarray
+    status_nomes: np.ndarray
+    linhas_descartadas: int = 0
+
+    @property
+    def n(self) -> int:
+        return self.valor_face.size
+
+    def em_carteira(self) -> np.ndarray:
+        """Máscara dos títulos ainda em carteira (status fora de STATUS_FORA_CARTEIRA)."""
+        fora = np.isin(self.status_nomes, STATUS_FORA_CARTEIRA)
+        if not fora.any():
+            return np.ones(self.n, dtype=bool)
+        # status vazio (-1) não indexa fora[]: título em aberto
+        return np.where(self.status >= 0, ~fora[self.status], True)
+
+
+# ---------------------------------------------------------------------
+# Cabeçalho e tipagem de um bloco
+# ---------------------------------------------------------------------
+def _normalizar_nome(nome) -> str:
+    nome = unicodedata.normalize("NFKD", str(nome)).encode("ascii", "ignore").decode()
+    return "_".join(nome.strip().lower().replace(".", " ").replace("-", " ").split())
+
+
+def mapear_colunas(cabecalho) -> dict:
+    """{coluna da fita: nome original no arquivo}. Erro se faltar obrigatória."""
+    normalizados = {_normalizar_nome(c): c for c in cabecalho}
+    mapa = {}
+    for canonica, aliases in ALIASES_COLUNAS.items():
+        for alias in aliases:
+            if alias in normalizados:
+                mapa[canonica] = normalizados[alias]
+                break
+    faltando = [c for c in COLUNAS_OBRIGATORIAS if c not in mapa]
+    if faltando:
+        raise ValueError(f"Fita sem as colunas obrigatórias: {', '.join(faltando)}")
+    return mapa
+
+
+def _datas(serie: pd.Series) -> np.ndarray:
+    if pd.api.types.is_datetime64_any_dtype(serie):
+        return serie.to_numpy(dtype="datetime64[D]")
+    texto = serie.astype("string").str.strip()
+    amostra = texto.dropna()
+    formato = "%d/%m/%Y" if not amostra.empty and "/" in amostra.iloc[0] else "ISO8601"
+    return pd.to_datetime(texto, format=formato, errors="coerce").to_numpy(dtype="datetime64[D]")
+
+
+def _decimal_virgula(texto: pd.Series, padrao: bool = False) -> bool:
+    """
+    Padrão brasileiro (1.234,56) ou não (1,234.56 / 1234.56), pelos valores
+    de uma amostra do arquivo. Só conta o que prova o formato: com os dois
+    separadores, o último é o decimal; com um só, repetido é milhar e uma
+    vez com casas diferentes de 3 é decimal. "1.500" e "1,500" são ambíguos.
+    Vence a maioria; sem prova (ou empate) fica `padrao`.
+    """
+    texto = texto.dropna().astype("string").str.strip()
+    virgula, ponto = texto.str.rfind(","), texto.str.rfind(".")
+    n_virgula, n_ponto = texto.str.count(","), texto.str.count(r"\.")
+    casas = texto.str.len() - np.maximum(virgula, ponto) - 1
+    ambos = (virgula >= 0) & (ponto >= 0)
+    so_virgula = (virgula >= 0) & (ponto < 0)
+    so_ponto = (ponto >= 0) & (virgula < 0)
+    brasileiro = (ambos & (virgula > ponto)) | (so_virgula & (n_virgula == 1) & (casas != 3)) | (so_ponto & (n_ponto > 1))
+    internacional = (ambos & (ponto > virgula)) | (so_ponto & (n_ponto == 1) & (casas != 3)) | (so_virgula & (n_virgula > 1))
+    brasileiro, internacional = int(brasileiro.sum()), int(internacional.sum())
+    if brasileiro == internacional:
+        return padrao
+    return brasileiro > internacional
+
+
+def _valores(serie: pd.Series, decimal_virgula: bool = None) -> np.ndarray:
+    """Valores numéricos; `decimal_virgula=None` detecta o formato pela própria coluna."""
+    if pd.api.types.is_numeric_dtype(serie):
+        return serie.to_numpy(dtype=float, na_value=np.nan)
+    texto = serie.astype("string").str.strip()
+    if decimal_virgula is None:
+        decimal_virgula = _decimal_virgula(texto)
+    if decimal_virgula:
+        texto = texto.str.replace(".", "", regex=False).str.replace(",", ".", regex=False)
+    else:
+        texto = texto.str.replace(",", "", regex=False)
+    return pd.to_numeric(texto, errors="coerce").to_numpy(dtype=float, na_value=np.nan)
+
+
+def _categoria(serie, minusculo: bool = False) -> pd.Categorical:
+    texto = serie.astype("string").str.strip()
+    if minusculo:
+        texto = texto.str.lower()
+    return pd.Categorical(texto)
+
+
+def hash_ids(ids) -> np.ndarray:
+    """
+    Hash de 64 bits do identificador do título (texto sem espaços nas
+    pontas); vazio vira 0. Colisões são desprezíveis para alguns milhões
+    de títulos.
+    """
+    texto = pd.Series(ids).astype("string").str.strip()
+    vazio = texto.isna() | (texto == "")
+    chaves = pd.util.hash_array(texto.fillna("").to_numpy(dtype=object))
+    chaves[vazio.to_numpy()] = 0
+    return chaves
+
+
+def tipar_bloco(bloco: pd.DataFrame, mapa: dict, decimal_virgula: bool = None) -> dict:
+    """
+    Converte um bloco bruto em colunas tipadas. Linhas sem valor ou sem
+    vencimento válidos são descartadas (contadas em "descartadas"). O
+    formato decimal vem do leitor (um por arquivo); sem ele, sai do bloco.
+    """
+    n = len(bloco)
+    valor = _valores(bloco[mapa["valor_face"]], decimal_virgula)
+    venc = _datas(bloco[mapa["vencimento"]])
+    aquis = _datas(bloco[mapa["data_aquisicao"]]) if "data_aquisicao" in mapa else np.full(n, np.datetime64("NaT"), "datetime64[D]")
+    vazio = pd.Series([""] * n, dtype="string")
+    sacado = _categoria(bloco[mapa["sacado"]] if "sacado" in mapa else vazio)
+    cedente = _categoria(bloco[mapa["cedente"]] if "cedente" in mapa else vazio)
+    status = _categoria(bloco[mapa["status"]] if "status" in mapa else pd.Series(["aberto"] * n), minusculo=True)
+
+    ok = np.isfinite(valor) & ~np.isnat(venc)
+    return {
+        "chave_titulo": hash_ids(bloco[mapa["id_titulo"]])[ok] if "id_titulo" in mapa else np.zeros(ok.sum(), np.uint64),
+        "valor_face": valor[ok],
+        "vencimento": venc[ok],
+        "data_aquisicao": aquis[ok],
+        "sacado": sacado[ok],
+        "cedente": cedente[ok],
+        "status": status[ok],
+        "descartadas": int(n - ok.sum()),
+    }
+
+
+def _montar_fita(blocos: list) -> Fita:
+    if not blocos:
+        raise ValueError("Fita vazia")
+
+    def categorica(nome):
+        cat = union_categoricals([b[nome] for b in blocos], ignore_order=True)
+        return cat.codes.astype(np.int32), np.asarray(cat.categories, dtype=object)
+
+    sacado, sacados = categorica("sacado")
+    cedente, cedentes = categorica("cedente")
+    status, status_nomes = categorica("status")
+    return Fita(
+        chave_titulo=np.concatenate([b["chave_titulo"] for b in blocos]),
+        sacado=sacado,
+        cedente=cedente,
+        valor_face=np.concatenate([b["valor_face"] for b in blocos]),
+        vencimento=np.concatenate([b["vencimento"] for b in blocos]),
+        data_aquisicao=np.concatenate([b["data_aquisicao"] for b in blocos]),
+        status=status,
+        sacados=sacados,
+        cedentes=cedentes,
+        status_nomes=status_nomes,
+        linhas_descartadas=sum(b["descartadas"] for b in blocos),
+    )
+
+
+# ---------------------------------------------------------------------
+# Leitura em blocos
+# ---------------------------------------------------------------------
+def _detectar_formato_csv(inicio: bytes) -> tuple:
+    """(encoding, separador) a partir dos primeiros bytes do arquivo."""
+    try:
+        texto = inicio.decode("utf-8-sig")
+        encoding = "utf-8-sig"
+    except UnicodeDecodeError as e:
+        # bloco cortado no meio de um caractere multibyte ainda é UTF-8
+        if e.start >= len(inicio) - 3:
+            texto, encoding = inicio[:e.start].decode("utf-8-sig"), "utf-8-sig"
+        else:
+            texto, encoding = inicio.decode("latin-1"), "latin-1"
+    primeira = texto.splitlines()[0] if texto else ""
+    sep = max((";", ",", "\t", "|"), key=primeira.count)
+    return encoding, sep
+
+
+def _abrir_binario(fonte):
+    if isinstance(fonte, (bytes, bytearray, memoryview)):
+        return io.BytesIO(fonte), True
+    if hasattr(fonte, "read"):
+        return fonte, False
+    return open(fonte, "rb"), True
+
+
+def _tamanho(arq) -> int:
+    pos = arq.tell()
+    arq.seek(0, io.SEEK_END)
+    total = arq.tell()
+    arq.seek(pos)
+    return total
+
+
+def ler_fita_csv(fonte, linhas_por_bloco: int = LINHAS_POR_BLOCO, progresso=None) -> Fita:
+    """
+    Lê uma fita CSV em blocos de `linhas_por_bloco` linhas. Separador
+    (; , tab |) e encoding (UTF-8 ou Latin-1) são detectados, e o formato
+    decimal dos valores (1.234,56 ou 1,234.56) sai de uma amostra do início
+    do arquivo e vale para todos os blocos.
+    `progresso(fração)` é chamado a cada bloco com a fração de bytes já lida.
+    """
+    arq, fechar = _abrir_binario(fonte)
+    try:
+        total = _tamanho(arq)
+        inicio_pos = arq.tell()
+        encoding, sep = _detectar_formato_csv(arq.read(64 * 1024))
+        arq.seek(inicio_pos)
+
+        cabecalho = pd.read_csv(arq, sep=sep, encoding=encoding, nrows=0).columns
+        arq.seek(inicio_pos)
+        mapa = mapear_colunas(cabecalho)
+
+        # Formato decimal uma vez por arquivo (igual para todos os blocos); sem prova, ';' é padrão brasileiro
+        amostra = pd.read_csv(
+            arq, sep=sep, encoding=encoding, usecols=[mapa["valor_face"]], dtype=str,
+            nrows=LINHAS_AMOSTRA_DECIMAL, keep_default_na=False,
+        )
+        arq.seek(inicio_pos)
+        decimal_virgula = _decimal_virgula(amostra.iloc[:, 0], padrao=sep == ";")
+
+        leitor = pd.read_csv(
+            arq,
+            sep=sep,
+            encoding=encoding,
+            usecols=list(mapa.values()),
+            dtype=str,
+            chunksize=int(linhas_por_bloco),
+            skipinitialspace=True,
+        )
+        blocos = []
+        for bloco in leitor:
+            blocos.append(tipar_bloco(bloco, mapa, decimal_virgula))
+            if progresso is not None and total:
+                progresso(min(arq.tell() / total, 1.0))
+        if progresso is not None:
+            progresso(1.0)
+        return _montar_fita(blocos)
+    finally:
+        if fechar:
+            arq.close()
+
+
+def ler_fita_xlsx(fonte, linhas_por_bloco: int = LINHAS_POR_BLOCO, progresso=None) -> Fita:
+    """
+    Lê a primeira planilha de uma fita XLSX em modo streaming (openpyxl
+    read_only), acumulando `linhas_por_bloco` linhas por vez.
+    """
+    from openpyxl import load_workbook
+
+    arq, fechar = _abrir_binario(fonte)
+    wb = load_workbook(arq, read_only=True, data_only=True)
+    try:
+        ws = wb.worksheets[0]
+        linhas = ws.iter_rows(values_only=True)
+        cabecalho = [c for c in next(linhas, ())]
+        mapa = mapear_colunas([c for c in cabecalho if c is not None])
+        posicoes = [cabecalho.index(mapa[c]) for c in mapa]
+        total = max((ws.max_row or 0) - 1, 0)
+
+        blocos, buffer, lidas = [], [], 0
+        decimal_virgula = None
+
+        def fechar_bloco():
+            nonlocal decimal_virgula
+            bloco = pd.DataFrame(buffer, columns=list(mapa.values()))
+            # Formato decimal dos valores em texto: sai do primeiro bloco e vale para o arquivo todo
+            if decimal_virgula is None:
+                valores = bloco[mapa["valor_face"]]
+                decimal_virgula = _decimal_virgula(valores[valores.map(type) == str])
+            blocos.append(tipar_bloco(bloco, mapa, decimal_virgula))
+            buffer.clear()
+            if progresso is not None and total:
+                progresso(min(lidas / total, 1.0))
+
+        for linha in linhas:
+            buffer.append([linha[i] if i < len(linha) else None for i in posicoes])
+            lidas += 1
+            if len(buffer) >= linhas_por_bloco:
+                fechar_bloco()
+        if buffer:
+            fechar_bloco()
+        if progresso is not None:
+            progresso(1.0)
+        return _montar_fita(blocos)
+    finally:
+        wb.close()
+        if fechar:
+            arq.close()
+
+
+def ler_fita(fonte, nome: str = "", linhas_por_bloco: int = LINHAS_POR_BLOCO, progresso=None) -> Fita:
+    """Despacha para CSV ou XLSX pela extensão de `nome` (ou do caminho)."""
+    if not nome:
+        nome = fonte if isinstance(fonte, str) else getattr(fonte, "name", "")
+    nome = str(nome).lower()
+    if nome.endswith((".xlsx", ".xlsm")):
+        return ler_fita_xlsx(fonte, linhas_por_bloco, progresso)
+    return ler_fita_csv(fonte, linhas_por_bloco, progresso)
+
+
+# ---------------------------------------------------------------------
+# Cache em disco (Arrow IPC, memory-mapped)
+# ---------------------------------------------------------------------
+_COLUNAS_NUMERICAS = {
+    "chave_titulo": np.uint64,
+    "sacado": np.int32,
+    "cedente": np.int32,
+    "status": np.int32,
+    "valor_face": np.float64,
+    "vencimento": np.int64,       # dias desde 1970 (NaT = mínimo int64)
+    "data_aquisicao": np.int64,
+}
+_DICIONARIOS = {"sacado": "sacados", "cedente": "cedentes", "status": "status_nomes"}
+
+
+def hash_conteudo(fonte, tamanho_bloco: int = 8 << 20) -> str:
+    """Hash (BLAKE2b) do conteúdo do arquivo, lido em blocos."""
+    h = hashlib.blake2b(digest_size=20)
+    h.update(f"v{VERSAO_CACHE}".encode())
+    arq, fechar = _abrir_binario(fonte)
+    try:
+        inicio = arq.tell()
+        while bloco := arq.read(tamanho_bloco):
+            h.update(bloco)
+        arq.seek(inicio)
+    finally:
+        if fechar:
+            arq.close()
+    return h.hexdigest()
+
+
+def caminho_cache(chave: str, diretorio=None) -> Path:
+    return Path(diretorio or DIRETORIO_CACHE) / f"fita_{chave}.arrow"
+
+
+def salvar_fita_cache(fita: Fita, chave: str, diretorio=None) -> Path:
+    """
+    Grava a fita em Arrow IPC sem compressão (condição para abrir com
+    memory-map). Categóricos viram colunas de dicionário; a escrita é
+    atômica (arquivo temporário + rename).
+    """
+    import pyarrow as pa
+    import pyarrow.ipc as ipc
+
+    colunas = {}
+    for campo in _COLUNAS_NUMERICAS:
+        valores = getattr(fita, campo)
+        if campo in _DICIONARIOS:
+            colunas[campo] = pa.DictionaryArray.from_arrays(
+                pa.array(valores, type=pa.int32(), mask=valores < 0),
+                pa.array(getattr(fita, _DICIONARIOS[campo]).astype(str), type=pa.string()),
+            )
+        else:
+            colunas[campo] = pa.array(valores.view(_COLUNAS_NUMERICAS[campo]))
+    tabela = pa.table(colunas).replace_schema_metadata({"linhas_descartadas": str(fita.linhas_descartadas)})
+
+    destino = caminho_cache(chave, diretorio)
+    destino.parent.mkdir(parents=True, exist_ok=True)
+    # nome único por escrita: sessões do Streamlit são threads do mesmo processo
+    fd, temporario = tempfile.mkstemp(dir=destino.parent, prefix=f"{destino.stem}.", suffix=".tmp")
+    os.close(fd)
+    try:
+        with pa.OSFile(temporario, "wb") as arq:
+            with ipc.new_file(arq, tabela.schema) as escritor:
+                escritor.write_table(tabela)
+        os.replace(temporario, destino)
+    except BaseException:
+        Path(temporario).unlink(missing_ok=True)
+        raise
+    return destino
+
+
+def _sem_copia(arr, dtype) -> np.ndarray:
+    # Lê direto o buffer de valores (inclusive sob a máscara de nulos, onde
+    # gravamos -1): com o arquivo mapeado não há cópia.
+    dtype = np.dtype(dtype)
+    return np.frombuffer(arr.buffers()[1], dtype=dtype, count=len(arr), offset=arr.offset * dtype.itemsize)
+
+
+def abrir_fita_cache(chave: str, diretorio=None):
+    """
+    Abre uma fita do cache com memory-map (colunas somente leitura,
+    compartilhadas pelo cache de páginas do SO). None se não existir.
+    """
+    import pyarrow as pa
+    import pyarrow.ipc as ipc
+
+    caminho = caminho_cache(chave, diretorio)
+    if not caminho.exists():
+        return None
+    tabela = ipc.open_file(pa.memory_map(str(caminho), "r")).read_all()
+
+    campos = {}
+    for campo, dtype in _COLUNAS_NUMERICAS.items():
+        # gravamos um único lote; combine_chunks copiaria o buffer
+        coluna = tabela.column(campo)
+        coluna = coluna.chunk(0) if coluna.num_chunks == 1 else coluna.combine_chunks()
+        if campo in _DICIONARIOS:
+            campos[_DICIONARIOS[campo]] = np.asarray(coluna.dictionary.to_pylist(), dtype=object)
+            coluna = coluna.indices
+        valores = _sem_copia(coluna, dtype)
+        campos[campo] = valores.view("datetime64[D]") if dtype is np.int64 else valores
+    metadados = tabela.schema.metadata or {}
+    return Fita(**campos, linhas_descartadas=int(metadados.get(b"linhas_descartadas", 0)))
+
+
+def carregar_fita(fonte, nome: str = "", diretorio=None, progresso=None, chave: str = None) -> tuple:
+    """
+    Fita pelo cache: se o conteúdo já foi lido, abre o arquivo mapeado;
+    senão lê (ler_fita), grava no cache e abre o mapeado (a cópia da
+    leitura é descartada). Retorna (fita, chave, veio_do_cache).
+    """
+    chave = chave or hash_conteudo(fonte)
+    fita = abrir_fita_cache(chave, diretorio)
+    if fita is not None:
+        if progresso is not None:
+            progresso(1.0)
+        return fita, chave, True
+    salvar_fita_cache(ler_fita(fonte, nome, progresso=progresso), chave, diretorio)
+    return abrir_fita_cache(chave, diretorio), chave, False
+
+
+# ---------------------------------------------------------------------
+# Aging e PDD
+# ---------------------------------------------------------------------
+def _data_d(data_referencia) -> np.datetime64:
+    return np.datetime64(pd.Timestamp(data_referencia).date(), "D")
+
+
+def rotulos_faixas(limites=LIMITES_FAIXAS) -> list:
+    """Rótulos no padrão do dashboard: (30, 60) -> ["0–30", "31–60", ">60"]."""
+    inicios = [0] + [l + 1 for l in limites]
+    return [f"{i}–{l}" for i, l in zip(inicios, limites)] + [f">{limites[-1]}"]
+
+
+def dias_atraso(fita: Fita, data_referencia) -> np.ndarray:
+    """Dias corridos de atraso na data de referência (0 para títulos a vencer)."""
+    return np.maximum((_data_d(data_referencia) - fita.vencimento).astype(np.int64), 0)
+
+
+def classificar_aging(dias, valor=None, limites=LIMITES_FAIXAS) -> dict:
+    """
+    Classifica cada título pela faixa de atraso (searchsorted nos limites:
+    dias <= limite[0] -> faixa 0, ..., > limite[-1] -> última) e soma por
+    faixa com bincount. Retorna faixa (int8 por título), exposição
+    (ponderada por `valor`) e quantidade por faixa.
+    """
+    limites = np.asarray(limites)
+    n_faixas = limites.size + 1
+    faixa = np.searchsorted(limites, np.asarray(dias), side="left").astype(np.int8)
+    return {
+        "faixa": faixa,
+        "exposicao": np.bincount(faixa, weights=valor, minlength=n_faixas).astype(float),
+        "quantidade": np.bincount(faixa, minlength=n_faixas),
+    }
+
+
+def resumo_aging(exposicao, quantidade, limites=LIMITES_FAIXAS, prov_rates=None) -> dict:
+    """
+    Distribuição (%), totais e rótulos a partir da exposição por faixa.
+    No layout da sidebar (9 faixas) inclui os pct_* prontos para o
+    session_state; com `prov_rates` (fração por faixa) inclui a PDD em R$.
+    """
+    exposicao = np.asarray(exposicao, dtype=float)
+    total = exposicao.sum()
+    pct = exposicao / total if total > 0 else np.zeros(exposicao.size)
+    resultado = {
+        "valor_carteira": float(total),
+        "n_titulos": int(np.sum(quantidade)),
+        "exposicao": exposicao,
+        "quantidade": np.asarray(quantidade),
+        "pct": pct,
+        "rotulos": rotulos_faixas(limites),
+    }
+    if tuple(limites) == LIMITES_FAIXAS:
+        resultado["params"] = {f"pct_{b}": float(p * 100) for b, p in zip(BUCKETS, pct)}
+    if prov_rates is not None:
+        resultado["pdd"] = float(exposicao @ np.asarray(prov_rates, dtype=float))
+    return resultado
+
+
+def aging_fita(fita: Fita, data_referencia, prov_rates=None, limites=LIMITES_FAIXAS) -> dict:
+    """
+    Distribuição por faixa de aging dos títulos em carteira, ponderada pelo
+    valor de face, classificando título a título.
+    """
+    carteira = fita.em_carteira()
+    aging = classificar_aging(dias_atraso(fita, data_referencia)[carteira], fita.valor_face[carteira], limites)
+    return resumo_aging(aging["exposicao"], aging["quantidade"], limites, prov_rates)
+
+
+# ---------------------------------------------------------------------
+# Índice por vencimento (aging em O(faixas · log n))
+# ---------------------------------------------------------------------
+@dataclass(frozen=True)
+class IndiceVencimento:
+    """
+    Vencimentos dos títulos em carteira ordenados, com valor e quantidade
+    acumulados nessa ordem (posição i = soma dos i primeiros).
+    """
+    vencimento: np.ndarray
+    valor_acumulado: np.ndarray
+    quantidade_acumulada: np.ndarray
+
+
+def indexar_vencimentos(fita: Fita) -> IndiceVencimento:
+    """Ordena uma vez por vencimento (O(n log n)); cada aging depois é uma busca."""
+    carteira = fita.em_carteira()
+    vencimento = fita.vencimento[carteira]
+    ordem = np.argsort(vencimento, kind="stable")
+    valor = fita.valor_face[carteira][ordem]
+    return IndiceVencimento(
+        vencimento=vencimento[ordem],
+        valor_acumulado=np.concatenate([[0.0], np.cumsum(valor)]),
+        quantidade_acumulada=np.arange(valor.size + 1),
+    )
+
+
+def aging_indexado(indice: IndiceVencimento, data_referencia, prov_rates=None, limites=LIMITES_FAIXAS) -> dict:
+    """
+    Mesmo resultado de aging_fita, mas em vez de classificar cada título
+    procura os cortes de cada faixa (data_ref - limite) nos vencimentos
+    ordenados: as somas por faixa saem das diferenças dos acumulados.
+    """
+    cortes = _data_d(data_referencia) - np.asarray(limites).astype("timedelta64[D]")
+    # títulos com vencimento >= corte[k] têm atraso <= limite[k]
+    posicoes = np.searchsorted(indice.vencimento, cortes, side="left")
+    fronteiras = np.concatenate([[indice.vencimento.size], posicoes, [0]])
+    exposicao = indice.valor_acumulado[fronteiras[:-1]] - indice.valor_acumulado[fronteiras[1:]]
+    quantidade = indice.quantidade_acumulada[fronteiras[:-1]] - indice.quantidade_acumulada[fronteiras[1:]]
+    return resumo_aging(exposicao, quantidade, limites, prov_rates)
+
+
+# ---------------------------------------------------------------------
+# Atualização incremental (arquivos delta)
+# ---------------------------------------------------------------------
+@dataclass
+class _Registro:
+    """Versão atual de cada título (ordenado pela chave)."""
+    chaves: np.ndarray
+    vencimento: np.ndarray
+    valor: np.ndarray
+    ativo: np.ndarray
+
+    @classmethod
+    def ordenar(cls, chaves, vencimento, valor, ativo):
+        ordem = np.argsort(chaves, kind="stable")
+        return cls(chaves[ordem], vencimento[ordem], np.asarray(valor, dtype=float)[ordem], ativo[ordem])
+
+    @classmethod
+    def vazio(cls):
+        return cls(np.empty(0, np.uint64), np.empty(0, "datetime64[D]"), np.empty(0), np.empty(0, bool))
+
+    def localizar(self, chaves) -> tuple:
+        pos = np.minimum(np.searchsorted(self.chaves, chaves), max(self.chaves.size - 1, 0))
+        achou = self.chaves[pos] == chaves if self.chaves.size else np.zeros(np.shape(chaves), bool)
+        return pos, achou
+
+    def copia(self):
+        return _Registro(self.chaves.copy(), self.vencimento.copy(), self.valor.copy(), self.ativo.copy())
+
+
+@dataclass
+class EstadoAging:
+    """
+    Agregados da carteira numa data: valor e quantidade em carteira por dia
+    de vencimento (histograma diário a partir de `origem`). O aging de
+    qualquer data de referência sai desses histogramas, então avançar o dia
+    não reclassifica nenhum título; um delta só mexe nos dias dos títulos
+    que mudaram.
+
+    Para retirar a versão antiga de um título alterado ou liquidado, o
+    estado guarda vencimento/valor atuais por chave em dois blocos
+    ordenados pela chave: `base` (fita completa, só leitura e compartilhado
+    entre os estados derivados dela) e `alterados` (a versão vinda dos
+    deltas de cada título que entrou ou mudou; tem precedência sobre a base).
+    """
+    data_referencia: np.datetime64
+    origem: np.datetime64
+    valor_por_dia: np.ndarray
+    quantidade_por_dia: np.ndarray
+    base: _Registro
+    alterados: _Registro
+
+    def copia(self) -> "EstadoAging":
+        """Cópia dos histogramas e dos alterados; a base é a mesma (só leitura)."""
+        return EstadoAging(
+            self.data_referencia, self.origem, self.valor_por_dia.copy(), self.quantidade_por_dia.copy(),
+            self.base, self.alterados.copia(),
+        )
+
+
+def _somar_dias(estado: EstadoAging, vencimento, valor, sinal: int):
+    """Soma (+1) ou retira (-1) títulos dos histogramas, estendendo as datas se preciso."""
+    if vencimento.size == 0:
+        return
+    dias = (vencimento - estado.origem).astype(np.int64)
+    antes = max(0, -int(dias.min()))
+    depois = max(0, int(dias.max()) + 1 - estado.valor_por_dia.size)
+    if antes or depois:
+        estado.valor_por_dia = np.pad(estado.valor_por_dia, (antes, depois))
+        estado.quantidade_por_dia = np.pad(estado.quantidade_por_dia, (antes, depois))
+        estado.origem = estado.origem - np.timedelta64(antes, "D")
+        dias = dias + antes
+    np.add.at(estado.valor_por_dia, dias, sinal * np.asarray(valor, dtype=float))
+    np.add.at(estado.quantidade_por_dia, dias, sinal)
+
+
+def estado_aging(fita: Fita, data_referencia=None) -> EstadoAging:
+    """
+    Estado inicial a partir da fita completa (O(n log n), uma vez). A data
+    só fica registrada: aging_estado aceita qualquer data de referência.
+    """
+    data_referencia = pd.Timestamp.today() if data_referencia is None else data_referencia
+    if (fita.chave_titulo == 0).any():
+        raise ValueError("A fita base precisa da coluna de identificação do título (ex.: nosso número) para receber deltas")
+    base = _Registro.ordenar(fita.chave_titulo, fita.vencimento, fita.valor_face, fita.em_carteira())
+    if (base.chaves[1:] == base.chaves[:-1]).any():
+        raise ValueError("Identificadores de título repetidos na fita base")
+    for coluna in (base.chaves, base.vencimento, base.valor, base.ativo):
+        coluna.flags.writeable = False
+
+    origem = fita.vencimento.min() if fita.n else _data_d(data_referencia)
+    estado = EstadoAging(_data_d(data_referencia), origem, np.zeros(1), np.zeros(1, np.int64), base, _Registro.vazio())
+    _somar_dias(estado, base.vencimento[base.ativo], base.valor[base.ativo], +1)
+    return estado
+
+
+def aplicar_delta(estado: EstadoAging, delta: Fita, data_referencia=None, inplace: bool = False) -> tuple:
+    """
+    Aplica um arquivo delta (mesmas colunas da fita, com o identificador):
+    cada linha é a versão nova do título. Título desconhecido entra na
+    carteira; conhecido tem a versão antiga retirada e a nova somada;
+    status liquidado/pago/recomprado tira o título da carteira. Se o
+    título se repete no delta, vale a última linha.
+
+    A base nunca é copiada nem alterada: a versão nova vai para o bloco
+    `alterados`. Custo O(delta · log n) nas buscas, mais O(dias + m) na
+    cópia dos histogramas e na inserção em `alterados` (m = títulos já
+    alterados pelos deltas, m ≪ n). Sem `inplace` o estado anterior é
+    preservado, útil quando ele está num cache compartilhado.
+    Retorna (estado, {"novos", "alterados", "baixados"}).
+    """
+    if (delta.chave_titulo == 0).any():
+        raise ValueError("O arquivo delta precisa da coluna de identificação do título")
+    estado = estado if inplace else estado.copia()
+
+    # np.unique ordena: `chaves` sai em ordem crescente
+    _, ultimas = np.unique(delta.chave_titulo[::-1], return_index=True)
+    idx = delta.n - 1 - ultimas
+    chaves = delta.chave_titulo[idx]
+    vencimento = delta.vencimento[idx]
+    valor = delta.valor_face[idx].astype(float)
+    ativo = delta.em_carteira()[idx]
+
+    # versão atual de cada título: a dos alterados, se houver, senão a da base
+    alterados = estado.alterados
+    pos_alt, em_alterados = alterados.localizar(chaves)
+    pos_base, na_base = estado.base.localizar(chaves)
+    na_base &= ~em_alterados
+    for registro, pos, achou in ((estado.base, pos_base, na_base), (alterados, pos_alt, em_alterados)):
+        p = pos[achou]
+        antigo = registro.ativo[p]
+        _somar_dias(estado, registro.vencimento[p][antigo], registro.valor[p][antigo], -1)
+
+    p = pos_alt[em_alterados]
+    alterados.vencimento[p] = vencimento[em_alterados]
+    alterados.valor[p] = valor[em_alterados]
+    alterados.ativo[p] = ativo[em_alterados]
+    inserir = ~em_alterados
+    if inserir.any():
+        # chaves já ordenadas: inserção direta na ordem dos alterados, O(m + delta)
+        pos = np.searchsorted(alterados.chaves, chaves[inserir])
+        estado.alterados = _Registro(
+            np.insert(alterados.chaves, pos, chaves[inserir]),
+            np.insert(alterados.vencimento, pos, vencimento[inserir]),
+            np.insert(alterados.valor, pos, valor[inserir]),
+            np.insert(alterados.ativo, pos, ativo[inserir]),
+        )
+    _somar_dias(estado, vencimento[ativo], valor[ativo], +1)
+    if data_referencia is not None:
+        estado.data_referencia = _data_d(data_referencia)
+
+    conhecido = na_base | em_alterados
+    return estado, {
+        "novos": int((~conhecido & ativo).sum()),
+        "alterados": int((conhecido & ativo).sum()),
+        "baixados": int((conhecido & ~ativo).sum()),
+    }
+
+
+def aging_estado(estado: EstadoAging, data_referencia=None, prov_rates=None, limites=LIMITES_FAIXAS) -> dict:
+    """
+    Aging a partir dos histogramas por vencimento (O(dias), independe do
+    número de títulos). Sem data usa a do estado.
+    """
+    ref = estado.data_referencia if data_referencia is None else _data_d(data_referencia)
+    n_dias = estado.valor_por_dia.size
+    cortes = ref - np.asarray(limites).astype("timedelta64[D]")
+    posicoes = np.clip((cortes - estado.origem).astype(np.int64), 0, n_dias)
+    fronteiras = np.concatenate([[n_dias], posicoes, [0]])
+
+    valor_acum = np.concatenate([[0.0], np.cumsum(estado.valor_por_dia)])
+    qtd_acum = np.concatenate([[0], np.cumsum(estado.quantidade_por_dia)])
+    quantidade = qtd_acum[fronteiras[:-1]] - qtd_acum[fronteiras[1:]]
+    exposicao = valor_acum[fronteiras[:-1]] - valor_acum[fronteiras[1:]]
+    # resíduo de ponto flutuante de somas e retiradas em faixas já vazias
+    exposicao = np.where(quantidade > 0, exposicao, 0.0)
+    return resumo_aging(exposicao, quantidade, limites, prov_rates)
+
+
+# ---------------------------------------------------------------------
+# Exposição por sacado e por raiz de CNPJ
+# ---------------------------------------------------------------------
+def chave_documento(documento) -> str:
+    """
+    Chave de um sacado: só os dígitos se for CPF/CNPJ (11 ou 14 dígitos),
+    senão o texto em maiúsculas sem espaços extras.
+    """
+    texto = "" if documento is None else str(documento).strip()
+    digitos = "".join(c for c in texto if c.isdigit())
+    return digitos if len(digitos) in (11, 14) else " ".join(texto.upper().split())
+
+
+def raiz_documento(chave: str) -> str:
+    """Raiz do CNPJ (8 primeiros dígitos); CPF e nomes ficam como estão."""
+    return chave[:8] if len(chave) == 14 and chave.isdigit() else chave
+
+
+def chaves_documentos(documentos) -> tuple:
+    """chave_documento e raiz_documento vetorizados (pandas str)."""
+    texto = pd.Series(documentos, dtype="string").fillna("").str.strip()
+    digitos = texto.str.replace(r"\D", "", regex=True)
+    tamanho = digitos.str.len()
+    nome = texto.str.upper().str.replace(r"\s+", " ", regex=True)
+    chave = digitos.where(tamanho.isin([11, 14]), nome)
+    raiz = chave.where(tamanho != 14, digitos.str.slice(0, 8))
+    return chave.to_numpy(dtype=object), raiz.to_numpy(dtype=object)
+
+
+def _somar_por_chave(chaves, valores) -> dict:
+    codigos, unicas = pd.factorize(chaves)
+    somas = np.bincount(codigos, weights=valores, minlength=len(unicas))
+    return dict(zip(unicas.tolist(), somas.tolist()))
+
+
+class _Concentracao:
+    """Exposição por chave com soma dos quadrados mantida (HHI em O(1))."""
+
+    def __init__(self, exposicoes: dict):
+        self.exposicao = exposicoes
+        self.total = float(sum(exposicoes.values()))
+        self._soma_quadrados = float(sum(v * v for v in exposicoes.values()))
+
+    def somar(self, chave: str, valor: float):
+        antes = self.exposicao.get(chave, 0.0)
+        depois = antes + valor
+        if abs(depois) <= 1e-9 * abs(antes):    # zerou (liquidação): sem resíduo de arredondamento
+            depois = 0.0
+            self.exposicao.pop(chave, None)
+        else:
+            self.exposicao[chave] = depois
+        self.total += depois - antes
+        self._soma_quadrados += depois * depois - antes * antes
+
+    def hhi(self) -> float:
+        """Índice Herfindahl-Hirschman (0 a 1) das participações na carteira."""
+        return self._soma_quadrados / self.total ** 2 if self.total > 0 else 0.0
+
+    def top(self, n: int = 10) -> list:
+        return heapq.nlargest(n, self.exposicao.items(), key=lambda kv: kv[1])
+
+
+class IndiceExposicao:
+    """
+    Exposição em carteira por sacado e por raiz de CNPJ (grupo), com
+    consulta em O(1) e atualização em O(1) quando uma operação é
+    registrada. Os totais e o HHI acompanham cada registro.
+    """
+
+    def __init__(self, por_sacado: dict, por_raiz: dict):
+        self.sacado = _Concentracao(por_sacado)
+        self.raiz = _Concentracao(por_raiz)
+
+    def exposicao(self, documento) -> dict:
+        chave = chave_documento(documento)
+        raiz = raiz_documento(chave)
+        return {
+            "chave": chave,
+            "raiz": raiz,
+            "sacado": self.sacado.exposicao.get(chave, 0.0),
+            "grupo": self.raiz.exposicao.get(raiz, 0.0),
+        }
+
+    def apos_operacao(self, documento, valor: float) -> dict:
+        """Exposição atual e após uma operação de `valor` (sem registrar)."""
+        atual = self.exposicao(documento)
+        return atual | {"sacado_apos": atual["sacado"] + valor, "grupo_apos": atual["grupo"] + valor}
+
+    def registrar(self, documento, valor: float):
+        """Soma uma operação aprovada (valor negativo para liquidação)."""
+        chave = chave_documento(documento)
+        self.sacado.somar(chave, valor)
+        self.raiz.somar(raiz_documento(chave), valor)
+
+    def copia(self) -> "IndiceExposicao":
+        return IndiceExposicao(dict(self.sacado.exposicao), dict(self.raiz.exposicao))
+
+
+def indexar_exposicao(fita: Fita) -> IndiceExposicao:
+    """
+    Soma o valor de face em carteira por sacado (bincount nos códigos) e
+    consolida por raiz de CNPJ. O(n) uma vez; O(sacados) em dicionários.
+    """
+    carteira = fita.em_carteira() & (fita.sacado >= 0)
+    por_codigo = np.bincount(fita.sacado[carteira], weights=fita.valor_face[carteira], minlength=fita.sacados.size)
+    chaves, raizes = chaves_documentos(fita.sacados)
+
+    com_saldo = por_codigo != 0
+    return IndiceExposicao(
+        _somar_por_chave(chaves[com_saldo], por_codigo[com_saldo]),
+        _somar_por_chave(raizes[com_saldo], por_codigo[com_saldo]),
+    )
+
+
+@dataclass
+class EstadoExposicao:
+    """
+    IndiceExposicao da carteira após os deltas e a versão atual de cada
+    título, para retirar a antiga quando ele muda: a fita base numa visão
+    ordenada pela chave do título (só leitura e compartilhada entre os
+    estados derivados dela) e, para os títulos que vieram dos deltas,
+    `alterados` = {chave: (documento do sacado, valor)}, com documento
+    None fora da carteira; tem precedência sobre a base.
+    """
+    indice: IndiceExposicao
+    chaves_base: np.ndarray
+    sacado_base: np.ndarray     # código em `sacados_base`; -1 = fora da carteira ou sem sacado
+    valor_base: np.ndarray
+    sacados_base: np.ndarray
+    alterados: dict
+
+
+def estado_exposicao(fita: Fita) -> EstadoExposicao:
+    """Índice de exposição da fita base e a visão ordenada pela chave (O(n log n), uma vez)."""
+    ordem = np.argsort(fita.chave_titulo, kind="stable")
+    carteira = fita.em_carteira()[ordem]
+    sacado = np.where(carteira, fita.sacado[ordem], -1)
+    visao = (fita.chave_titulo[ordem], sacado, fita.valor_face[ordem].astype(float))
+    for coluna in visao:
+        coluna.flags.writeable = False
+    return EstadoExposicao(indexar_exposicao(fita), *visao, fita.sacados, {})
+
+
+def aplicar_delta_exposicao(estado: EstadoExposicao, delta: Fita) -> EstadoExposicao:
+    """
+    Atualiza a exposição com um arquivo delta, na mesma regra de
+    aplicar_delta: a versão atual de cada título (a dos deltas anteriores
+    ou, se não houver, a da base) sai da exposição e a nova entra se
+    estiver em carteira. Título repetido no delta vale a última linha.
+
+    A base não é reordenada: busca binária na visão ordenada, O(delta ·
+    log n), mais a cópia do índice e dos `alterados`. As atualizações usam
+    IndiceExposicao.registrar, O(1) por título do delta. Retorna um estado
+    novo; `estado` não é alterado.
+    """
+    if (delta.chave_titulo == 0).any():
+        raise ValueError("O arquivo delta precisa da coluna de identificação do título")
+    indice = estado.indice.copia()
+    alterados = dict(estado.alterados)
+
+    _, ultimas = np.unique(delta.chave_titulo[::-1], return_index=True)
+    idx = delta.n - 1 - ultimas
+    chaves = delta.chave_titulo[idx]
+
+    # versão anterior: a dos deltas já aplicados ou a da base
+    lista = chaves.tolist()
+    na_base = np.fromiter((k not in alterados for k in lista), dtype=bool, count=len(lista))
+    for k in compress(lista, ~na_base):
+        documento, valor = alterados[k]
+        if documento is not None:
+            indice.registrar(documento, -valor)
+    if estado.chaves_base.size and na_base.any():
+        pos = np.searchsorted(estado.chaves_base, chaves[na_base], side="right") - 1
+        pos = pos[(pos >= 0) & (estado.chaves_base[np.maximum(pos, 0)] == chaves[na_base])]
+        pos = pos[estado.sacado_base[pos] >= 0]
+        for documento, valor in zip(estado.sacados_base[estado.sacado_base[pos]], estado.valor_base[pos].tolist()):
+            indice.registrar(documento, -valor)
+
+    carteira = delta.em_carteira()[idx] & (delta.sacado[idx] >= 0)
+    documentos = np.where(carteira, delta.sacados[np.maximum(delta.sacado[idx], 0)], None) if delta.sacados.size else [None] * idx.size
+    for k, documento, valor in zip(lista, documentos, delta.valor_face[idx].astype(float).tolist()):
+        alterados[k] = (documento, valor)
+        if documento is not None:
+            indice.registrar(documento, valor)
+    return replace(estado, indice=indice, alterados=alterados)
@@ -0,0 +1,934 @@
+"""
+Motor de cálculo do FIDC (sem dependência do Streamlit).
+
+Concentra as contas do "cenário atual" do dashboard (alocação, receitas,
+custos das cotas, PDD, resultado da Cota Júnior e subordinação) como funções
+puras sobre o mesmo dicionário de parâmetros que é salvo em fidcs.json.
+
+As fórmulas são escritas com operações NumPy, de forma que aceitam tanto
+escalares quanto arrays (um valor por fundo/cenário).
+"""
+import hashlib
+import json
+from dataclasses import dataclass
+from functools import lru_cache
+
+import numpy as np
+
+
+DIAS_UTEIS_ANO = 252
+MESES_ANO = 12
+DIAS_UTEIS_MES = DIAS_UTEIS_ANO / MESES_ANO  # ~21 dias úteis/mês
+
+# Faixas de atraso da sidebar (sufixo das chaves pct_* / prov_*)
+BUCKETS = [
+    "0_30", "31_60", "61_90", "91_120", "121_150",
+    "151_180", "181_240", "241_300", "300p",
+]
+BUCKET_LABELS = ["0–30", "31–60", "61–90", "91–120", "121–150", "151–180", "181–240", "241–300", ">300"]
+
+# Valores iniciais da sidebar (mesma política interna do dashboard)
+_PCT_DEFAULT = [95.0, 0.5, 0.5, 0.5, 0.5, 0.5, 0.5, 0.5, 1.5]
+_PROV_DEFAULT = [0.0, 5.0, 15.0, 20.0, 40.0, 50.0, 70.0, 85.0, 100.0]
+
+PARAM_DEFAULTS = {
+    "valor_junior": 10_000_000.0,
+    "valor_mezz": 10_000_000.0,
+    "valor_senior": 10_000_000.0,
+    "sub_min_pct": 20.0,
+    "cdi_aa_pct": 15.0,
+    "taxa_carteira_am_pct": 2.35,
+    "pct_recebiveis_pct": 80.0,
+    "spread_senior_aa_pct": 5.0,
+    "spread_mezz_aa_pct": 6.5,
+    "taxa_adm_aa_pct": 0.3,
+    "taxa_gestao_aa_pct": 0.5,
+    "outros_custos_mensais": 100_000.0,
+    "outros_receitas_mensais": 150_000.0,
+}
+for _b, _pct, _prov in zip(BUCKETS, _PCT_DEFAULT, _PROV_DEFAULT):
+    PARAM_DEFAULTS[f"pct_{_b}"] = _pct
+    PARAM_DEFAULTS[f"prov_{_b}"] = _prov
+PARAM_DEFAULTS["incluir_pdd"] = True
+
+# Ordem das colunas na representação matricial (uma linha por fundo)
+PARAM_FIELDS = list(PARAM_DEFAULTS.keys())
+PARAM_INDEX = {nome: j for j, nome in enumerate(PARAM_FIELDS)}
+
+# Rótulos curtos para relatórios
+PARAM_LABELS = {
+    "valor_junior": "Cota Júnior (R$)",
+    "valor_mezz": "Cota Mezzanino (R$)",
+    "valor_senior": "Cota Sênior (R$)",
+    "sub_min_pct": "Subordinação mínima (%)",
+    "cdi_aa_pct": "CDI (% a.a.)",
+    "taxa_carteira_am_pct": "Taxa da carteira (% a.m.)",
+    "pct_recebiveis_pct": "% do PL em recebíveis",
+    "spread_senior_aa_pct": "Spread Sênior (% a.a.)",
+    "spread_mezz_aa_pct": "Spread Mezz (% a.a.)",
+    "taxa_adm_aa_pct": "Taxa de administração (% a.a.)",
+    "taxa_gestao_aa_pct": "Taxa de gestão (% a.a.)",
+    "outros_custos_mensais": "Outros custos (R$/mês)",
+    "outros_receitas_mensais": "Outras receitas (R$/mês)",
+    "incluir_pdd": "Incluir PDD no resultado",
+}
+for _b, _label in zip(BUCKETS, BUCKET_LABELS):
+    PARAM_LABELS[f"pct_{_b}"] = f"Carteira {_label} dias (%)"
+    PARAM_LABELS[f"prov_{_b}"] = f"Provisão {_label} dias (%)"
+
+
+# -------------------------------------------------------------------
+# CONVERSÕES DE TAXA
+# -------------------------------------------------------------------
+def anual_to_diario(rate_aa, dias_uteis=DIAS_UTEIS_ANO):
+    return (1 + rate_aa) ** (1 / dias_uteis) - 1
+
+
+def mensal_to_diario(rate_am, dias_uteis_ano=DIAS_UTEIS_ANO):
+    rate_aa = (1 + rate_am) ** 12 - 1
+    return anual_to_diario(rate_aa, dias_uteis=dias_uteis_ano)
+
+
+def _div(num, den, padrao=0.0):
+    """Divisão elemento a elemento que devolve `padrao` onde den == 0."""
+    num, den = np.broadcast_arrays(np.asarray(num, dtype=float), np.asarray(den, dtype=float))
+    out = np.full(num.shape, padrao, dtype=float)
+    np.divide(num, den, out=out, where=den != 0)
+    return out
+
+
+# -------------------------------------------------------------------
+# PARÂMETROS
+# -------------------------------------------------------------------
+def normalizar_params(params: dict) -> dict:
+    """Completa com os defaults da sidebar e converte os tipos (float/bool)."""
+    out = {}
+    for key, default in PARAM_DEFAULTS.items():
+        val = params.get(key, default) if params else default
+        if val is None:
+            val = default
+        out[key] = bool(val) if isinstance(default, bool) else float(val)
+    return out
+
+
+def _params_json(params: dict) -> str:
+    return json.dumps(normalizar_params(params), sort_keys=True)
+
+
+def params_hash(params: dict) -> str:
+    """Hash estável do conjunto de parâmetros (chave de cache)."""
+    return hashlib.sha1(_params_json(params).encode("utf-8")).hexdigest()
+
+
+# -------------------------------------------------------------------
+# CÁLCULOS PRINCIPAIS (ESCALAR OU VETORIAL)
+# -------------------------------------------------------------------
+def calcular_metricas(p: dict) -> dict:
+    """
+    Calcula as métricas do cenário atual a partir de parâmetros normalizados.
+
+    Cada valor de `p` pode ser um escalar ou um array (um elemento por
+    fundo); os resultados seguem o mesmo formato. As faixas de aging são
+    combinadas no último eixo (..., 9).
+    """
+    valor_junior = np.asarray(p["valor_junior"], dtype=float)
+    valor_mezz = np.asarray(p["valor_mezz"], dtype=float)
+    valor_senior = np.asarray(p["valor_senior"], dtype=float)
+    pl_total = valor_junior + valor_mezz + valor_senior
+
+    sub_min = np.asarray(p["sub_min_pct"], dtype=float) / 100.0
+
+    cdi_aa = np.asarray(p["cdi_aa_pct"], dtype=float) / 100.0
+    cdi_diario = anual_to_diario(cdi_aa)
+    cdi_am = (1 + cdi_aa) ** (1 / 12) - 1
+
+    taxa_carteira_am = np.asarray(p["taxa_carteira_am_pct"], dtype=float) / 100.0
+    taxa_carteira_diaria = mensal_to_diario(taxa_carteira_am)
+    pct_recebiveis = np.asarray(p["pct_recebiveis_pct"], dtype=float) / 100.0
+
+    # Sênior/Mezz: rateio linear do anual (juros simples sobre saldo da cota)
+    taxa_senior_aa = cdi_aa + np.asarray(p["spread_senior_aa_pct"], dtype=float) / 100.0
+    taxa_mezz_aa = cdi_aa + np.asarray(p["spread_mezz_aa_pct"], dtype=float) / 100.0
+    taxa_senior_diaria = taxa_senior_aa / DIAS_UTEIS_ANO
+    taxa_mezz_diaria = taxa_mezz_aa / DIAS_UTEIS_ANO
+
+    taxa_adm_diaria = anual_to_diario(np.asarray(p["taxa_adm_aa_pct"], dtype=float) / 100.0)
+    taxa_gestao_diaria = anual_to_diario(np.asarray(p["taxa_gestao_aa_pct"], dtype=float) / 100.0)
+
+    # Aproximação: 12 meses ~ 252 dias úteis
+    custo_outros_dia = np.asarray(p["outros_custos_mensais"], dtype=float) * 12.0 / DIAS_UTEIS_ANO
+    receita_outros_dia = np.asarray(p["outros_receitas_mensais"], dtype=float) * 12.0 / DIAS_UTEIS_ANO
+
+    # --- Faixas de aging: pesos reescalados para 100% ---
+    buckets_raw = np.stack([np.asarray(p[f"pct_{b}"], dtype=float) for b in BUCKETS], axis=-1)
+    provs_raw = np.stack([np.asarray(p[f"prov_{b}"], dtype=float) for b in BUCKETS], axis=-1)
+    total_raw = buckets_raw.sum(axis=-1, keepdims=True)
+    buckets_pct_norm = _div(buckets_raw, total_raw)
+    prov_rates = provs_raw / 100.0
+
+    pdd_ponderada_view = np.sum(buckets_pct_norm * provs_raw, axis=-1)
+    taxa_perda_esperada = np.sum(buckets_pct_norm * prov_rates, axis=-1)
+
+    # Alocação em recebíveis e caixa
+    valor_recebiveis = pl_total * pct_recebiveis
+    valor_caixa = pl_total - valor_recebiveis
+
+    # Receitas
+    receita_carteira_dia = valor_recebiveis * taxa_carteira_diaria
+    receita_caixa_dia = valor_caixa * cdi_diario
+    receita_financeira_dia = receita_carteira_dia + receita_caixa_dia
+    receita_total_dia = receita_financeira_dia + receita_outros_dia
+
+    # Custos das cotas e taxas
+    custo_senior_dia = valor_senior * taxa_senior_diaria
+    custo_mezz_dia = valor_mezz * taxa_mezz_diaria
+    custo_adm_dia = pl_total * taxa_adm_diaria
+    custo_gestao_dia = pl_total * taxa_gestao_diaria
+
+    # PDD "econômica" anual (sempre existe, para risco) e a que entra no P&L
+    pdd_base = valor_recebiveis * taxa_perda_esperada
+    incluir_pdd = np.asarray(p["incluir_pdd"], dtype=bool)
+    pdd_dia = np.where(incluir_pdd, pdd_base, 0.0) / DIAS_UTEIS_ANO
+
+    resultado_junior_dia = (
+        receita_total_dia
+        - custo_senior_dia
+        - custo_mezz_dia
+        - custo_adm_dia
+        - custo_gestao_dia
+        - pdd_dia
+        - custo_outros_dia
+    )
+    resultado_junior_mes = resultado_junior_dia * DIAS_UTEIS_MES
+    resultado_junior_ano = resultado_junior_dia * DIAS_UTEIS_ANO
+
+    # Subordinação: perda limite mantendo Júnior / PL ≥ sub_min
+    # L = (J - s*P) / (1 - s)
+    sub_atual = _div(valor_junior, pl_total)
+    perda_lim_sub = np.where(
+        (pl_total > 0) & (sub_min < 1) & (sub_atual > sub_min),
+        _div(valor_junior - sub_min * pl_total, 1 - sub_min),
+        0.0,
+    )
+
+    # KPIs de risco (aba de Gestão de Risco)
+    folga_limite = perda_lim_sub - pdd_base
+    pl_pos_pdd = np.maximum(0.0, pl_total - pdd_base)
+    jr_pos_pdd = np.maximum(0.0, valor_junior - pdd_base)
+    sub_atual_pos = _div(jr_pos_pdd, pl_pos_pdd)
+    aporte_necessario = np.where(
+        (sub_atual_pos < sub_min) & (sub_min != 1),
+        np.maximum(0.0, _div(sub_min * pl_pos_pdd - jr_pos_pdd, 1 - sub_min)),
+        0.0,
+    )
+
+    return {
+        "valor_junior": valor_junior,
+        "valor_mezz": valor_mezz,
+        "valor_senior": valor_senior,
+        "pl_total": pl_total,
+        "sub_min": sub_min,
+        "sub_atual": sub_atual,
+        "cdi_aa": cdi_aa,
+        "cdi_diario": cdi_diario,
+        "cdi_am": cdi_am,
+        "taxa_carteira_am": taxa_carteira_am,
+        "taxa_carteira_diaria": taxa_carteira_diaria,
+        "pct_recebiveis": pct_recebiveis,
+        "taxa_senior_aa": taxa_senior_aa,
+        "taxa_mezz_aa": taxa_mezz_aa,
+        "taxa_senior_diaria": taxa_senior_diaria,
+        "taxa_mezz_diaria": taxa_mezz_diaria,
+        "taxa_adm_diaria": taxa_adm_diaria,
+        "taxa_gestao_diaria": taxa_gestao_diaria,
+        "custo_outros_dia": custo_outros_dia,
+        "receita_outros_dia": receita_outros_dia,
+        "buckets_pct_norm": buckets_pct_norm,
+        "prov_rates": prov_rates,
+        "pdd_ponderada_view": pdd_ponderada_view,
+        "taxa_perda_esperada": taxa_perda_esperada,
+        "valor_recebiveis": valor_recebiveis,
+        "valor_caixa": valor_caixa,
+        "receita_carteira_dia": receita_carteira_dia,
+        "receita_caixa_dia": receita_caixa_dia,
+        "receita_financeira_dia": receita_financeira_dia,
+        "receita_total_dia": receita_total_dia,
+        "custo_senior_dia": custo_senior_dia,
+        "custo_mezz_dia": custo_mezz_dia,
+        "custo_adm_dia": custo_adm_dia,
+        "custo_gestao_dia": custo_gestao_dia,
+        "incluir_pdd": incluir_pdd,
+        "pdd_base": pdd_base,
+        "pdd_dia": pdd_dia,
+        "resultado_junior_dia": resultado_junior_dia,
+        "resultado_junior_mes": resultado_junior_mes,
+        "resultado_junior_ano": resultado_junior_ano,
+        "retorno_diario_junior": _div(resultado_junior_dia, valor_junior),
+        "retorno_mensal_junior": _div(resultado_junior_mes, valor_junior),
+        "retorno_anualizado_junior": _div(resultado_junior_ano, valor_junior),
+        "perda_lim_sub": perda_lim_sub,
+        "perda_lim_sub_pct_recebiveis": _div(perda_lim_sub, valor_recebiveis),
+        "folga_limite": folga_limite,
+        "folga_pct": _div(folga_limite * 100, perda_lim_sub),
+        "cobertura_jr_x": _div(valor_junior, pdd_base, padrao=np.inf),
+        "sub_atual_pos_pdd": sub_atual_pos,
+        "aporte_necessario": aporte_necessario,
+    }
+
+
+# -------------------------------------------------------------------
+# SNAPSHOT IMUTÁVEL DE UM FUNDO
+# -------------------------------------------------------------------
+@dataclass(frozen=True)
+class FundSnapshot:
+    params_hash: str
+    valor_junior: float
+    valor_mezz: float
+    valor_senior: float
+    pl_total: float
+    sub_min: float
+    sub_atual: float
+    cdi_aa: float
+    cdi_diario: float
+    cdi_am: float
+    taxa_carteira_am: float
+    taxa_carteira_diaria: float
+    pct_recebiveis: float
+    taxa_senior_aa: float
+    taxa_mezz_aa: float
+    taxa_senior_diaria: float
+    taxa_mezz_diaria: float
+    taxa_adm_diaria: float
+    taxa_gestao_diaria: float
+    custo_outros_dia: float
+    receita_outros_dia: float
+    buckets_pct_norm: tuple
+    prov_rates: tuple
+    pdd_ponderada_view: float
+    taxa_perda_esperada: float
+    valor_recebiveis: float
+    valor_caixa: float
+    receita_carteira_dia: float
+    receita_caixa_dia: float
+    receita_financeira_dia: float
+    receita_total_dia: float
+    custo_senior_dia: float
+    custo_mezz_dia: float
+    custo_adm_dia: float
+    custo_gestao_dia: float
+    incluir_pdd: bool
+    pdd_base: float
+    pdd_dia: float
+    resultado_junior_dia: float
+    resultado_junior_mes: float
+    resultado_junior_ano: float
+    retorno_diario_junior: float
+    retorno_mensal_junior: float
+    retorno_anualizado_junior: float
+    perda_lim_sub: float
+    perda_lim_sub_pct_recebiveis: float
+    folga_limite: float
+    folga_pct: float
+    cobertura_jr_x: float
+    sub_atual_pos_pdd: float
+    aporte_necessario: float
+
+
+def calcular_snapshot(params: dict) -> FundSnapshot:
+    """
+    Snapshot imutável do cenário atual de um fundo.
+
+    Memoizado pelo hash dos parâmetros: chamadas com o mesmo `current_params`
+    (troca de aba, edição de textos do comitê, etc.) devolvem o objeto já
+    calculado, compartilhado entre as sessões do servidor.
+    """
+    return _snapshot_de_json(_params_json(params))
+
+
+@lru_cache(maxsize=512)
+def _snapshot_de_json(params_json: str) -> FundSnapshot:
+    p = json.loads(params_json)
+    m = calcular_metricas(p)
+    campos = {}
+    for nome, val in m.items():
+        if nome in ("buckets_pct_norm", "prov_rates"):
+            campos[nome] = tuple(float(v) for v in val)
+        elif nome == "incluir_pdd":
+            campos[nome] = bool(val)
+        else:
+            campos[nome] = float(val)
+    campos["params_hash"] = hashlib.sha1(params_json.encode("utf-8")).hexdigest()
+    return FundSnapshot(**campos)
+
+
+# -------------------------------------------------------------------
+# TAXA DA CARTEIRA NECESSÁRIA PARA UM ROE ALVO (FORMA FECHADA)
+# -------------------------------------------------------------------
+def taxa_carteira_necessaria(snap: FundSnapshot, roe_alvo_pct_aa, pdd_mult=1.0, pct_recebiveis_pct=None) -> dict:
+    """
+    Taxa DIÁRIA e MENSAL necessária nos RECEBÍVEIS para que a Cota Júnior
+    tenha ROE alvo `roe_alvo_pct_aa` (% a.a.), usando retorno linear.
+
+    Equação base (por dia), para alocação a e multiplicador de PDD m:
+
+        Resultado_Júnior_dia(r) = R * r + K
+
+        R = PL * a
+        K = receita_caixa_dia(a) + receita_outros_dia
+            - custos_fixos_dia - pdd_dia(a, m)
+
+    Onde custos_fixos_dia = senior + mezz + adm + gestão + outros (não
+    dependem de r nem de a) e pdd_dia = R * perda_esperada * m / 252.
+    Logo r = (ROE * J / 252 - K) / R, limitado a zero.
+
+    roe_alvo_pct_aa, pdd_mult e pct_recebiveis_pct (% do PL) aceitam arrays
+    e seguem o broadcasting do NumPy (ex.: ROE (N,) × PDD (M, 1) -> (M, N)).
+    """
+    roe_alvo = np.asarray(roe_alvo_pct_aa, dtype=float) / 100.0
+    pdd_mult = np.asarray(pdd_mult, dtype=float)
+    if pct_recebiveis_pct is None:
+        pct_rec = np.asarray(snap.pct_recebiveis, dtype=float)
+    else:
+        pct_rec = np.asarray(pct_recebiveis_pct, dtype=float) / 100.0
+
+    valor_recebiveis = snap.pl_total * pct_rec
+    receita_caixa_dia = (snap.pl_total - valor_recebiveis) * snap.cdi_diario
+
+    # Custos fixos por dia (não dependem da taxa da carteira nem da alocação)
+    custos_fixos_dia = (
+        snap.custo_senior_dia
+        + snap.custo_mezz_dia
+        + snap.custo_adm_dia
+        + snap.custo_gestao_dia
+        + snap.custo_outros_dia
+    )
+
+    if snap.incluir_pdd:
+        pdd_dia = valor_recebiveis * snap.taxa_perda_esperada * pdd_mult / DIAS_UTEIS_ANO
+    else:
+        pdd_dia = np.zeros_like(pdd_mult)
+
+    K = receita_caixa_dia + snap.receita_outros_dia - custos_fixos_dia - pdd_dia
+    resultado_jr_dia_alvo = roe_alvo * snap.valor_junior / DIAS_UTEIS_ANO
+
+    r_dia = _div(resultado_jr_dia_alvo - K, valor_recebiveis)
+    # Sem recebíveis/Júnior ou meta muito baixa (r negativo): força 0%
+    r_dia = np.where((valor_recebiveis > 0) & (snap.valor_junior > 0), np.maximum(0.0, r_dia), 0.0)
+
+    return {
+        "taxa_dia": r_dia,
+        "taxa_am": (1 + r_dia) ** DIAS_UTEIS_MES - 1,
+    }
+
+
+# -------------------------------------------------------------------
+# SIMULADOR DE CENÁRIOS (PERTURBAÇÕES SOBRE O CENÁRIO ATUAL)
+# -------------------------------------------------------------------
+# Variáveis do simulador: nome -> (rótulo, escala do valor exibido para fração)
+CENARIO_VARIAVEIS = {
+    "pct_recebiveis": ("% do PL em Recebíveis", 0.01),
+    "taxa_carteira_am": ("Taxa Carteira (% a.m.)", 0.01),
+    "taxa_caixa_aa": ("Taxa Caixa (% a.a.)", 0.01),
+    "spread_senior_aa": ("Spread Sênior (% a.a.)", 0.01),
+    "spread_mezz_aa": ("Spread Mezz (% a.a.)", 0.01),
+    "var_outros_custos": ("Var. Custos Fixos (%)", 0.01),
+    "var_outras_receitas": ("Var. Outras Receitas (%)", 0.01),
+    "pdd_mult": ("Multiplicador de PDD (x)", 1.0),
+}
+
+
+def simular_cenario(
+    snap: FundSnapshot,
+    pct_recebiveis=None,
+    taxa_carteira_am=None,
+    taxa_caixa_aa=None,
+    spread_senior_aa=None,
+    spread_mezz_aa=None,
+    var_outros_custos=0.0,
+    var_outras_receitas=0.0,
+    pdd_mult=1.0,
+) -> dict:
+    """
+    Resultado diário da Cota Júnior com as variáveis do Simulador de
+    Cenários alteradas (em fração; None = valor do snapshot). A estrutura
+    de cotas fica fixa e os custos das cotas seguem o CDI do fundo; a PDD
+    escala com o volume de recebíveis e com o multiplicador.
+
+    Todas as variáveis aceitam arrays e seguem o broadcasting do NumPy:
+    uma grade (G1, 1) × (1, G2) devolve superfícies (G1, G2) numa única
+    avaliação.
+    """
+    def _valor(x, atual):
+        return np.asarray(atual if x is None else x, dtype=float)
+
+    pct_rec = _valor(pct_recebiveis, snap.pct_recebiveis)
+    taxa_cart = _valor(taxa_carteira_am, snap.taxa_carteira_am)
+    taxa_caixa = _valor(taxa_caixa_aa, snap.cdi_aa)
+    spread_sr = _valor(spread_senior_aa, snap.taxa_senior_aa - snap.cdi_aa)
+    spread_mz = _valor(spread_mezz_aa, snap.taxa_mezz_aa - snap.cdi_aa)
+    var_custos = np.asarray(var_outros_custos, dtype=float)
+    var_receitas = np.asarray(var_outras_receitas, dtype=float)
+    pdd_mult = np.asarray(pdd_mult, dtype=float)
+
+    valor_recebiveis = snap.pl_total * pct_rec
+    valor_caixa = snap.pl_total * (1 - pct_rec)
+
+    receita_carteira_dia = valor_recebiveis * mensal_to_diario(taxa_cart)
+    receita_caixa_dia = valor_caixa * anual_to_diario(taxa_caixa)
+    receita_outros_dia = snap.receita_outros_dia * (1 + var_receitas)
+    receita_total_dia = receita_carteira_dia + receita_caixa_dia + receita_outros_dia
+
+    # Juros lineares /252, como no cenário base
+    custo_senior_dia = snap.valor_senior * (snap.cdi_aa + spread_sr) / DIAS_UTEIS_ANO
+    custo_mezz_dia = snap.valor_mezz * (snap.cdi_aa + spread_mz) / DIAS_UTEIS_ANO
+    custos_fixos_dia = snap.custo_adm_dia + snap.custo_gestao_dia + snap.custo_outros_dia * (1 + var_custos)
+
+    pdd_estoque = valor_recebiveis * snap.taxa_perda_esperada * pdd_mult
+    pdd_dia = pdd_estoque / DIAS_UTEIS_ANO
+
+    resultado_junior_dia = receita_total_dia - custo_senior_dia - custo_mezz_dia - custos_fixos_dia - pdd_dia
+
+    jr_pos_pdd = np.maximum(0.0, snap.valor_junior - pdd_estoque)
+    pl_pos_pdd = np.maximum(0.0, snap.pl_total - pdd_estoque)
+
+    return {
+        "valor_recebiveis": valor_recebiveis,
+        "valor_caixa": valor_caixa,
+        "receita_carteira_dia": receita_carteira_dia,
+        "receita_caixa_dia": receita_caixa_dia,
+        "receita_outros_dia": receita_outros_dia,
+        "receita_total_dia": receita_total_dia,
+        "custo_senior_dia": custo_senior_dia,
+        "custo_mezz_dia": custo_mezz_dia,
+        "custos_fixos_dia": custos_fixos_dia,
+        "pdd_dia": pdd_dia,
+        "resultado_junior_dia": resultado_junior_dia,
+        "retorno_anualizado_junior": _div(resultado_junior_dia * DIAS_UTEIS_ANO, snap.valor_junior),
+        "sub_pos_pdd": _div(jr_pos_pdd, pl_pos_pdd),
+    }
+
+
+# -------------------------------------------------------------------
+# AVALIAÇÃO EM LOTE (VÁRIOS FUNDOS / CÓPIAS DE CENÁRIO)
+# -------------------------------------------------------------------
+def params_para_matriz(store: dict):
+    """
+    Converte o cadastro {nome: params} em (nomes, X), com X de shape
+    (n_fundos, len(PARAM_FIELDS)). incluir_pdd vira 0/1.
+    """
+    nomes = list(store.keys())
+    X = np.empty((len(nomes), len(PARAM_FIELDS)), dtype=float)
+    for i, nome in enumerate(nomes):
+        norm = normalizar_params(store[nome])
+        X[i] = [float(norm[k]) for k in PARAM_FIELDS]
+    return nomes, X
+
+
+def matriz_para_params(X: np.ndarray) -> dict:
+    """Visão por coluna de X no formato aceito por calcular_metricas."""
+    X = np.asarray(X, dtype=float)
+    cols = {nome: X[..., j] for nome, j in PARAM_INDEX.items()}
+    cols["incluir_pdd"] = cols["incluir_pdd"] != 0
+    return cols
+
+
+def avaliar_fundos(X: np.ndarray) -> dict:
+    """
+    Avalia todas as linhas de X numa única passada vetorizada.
+
+    Retorna o mesmo dicionário de calcular_metricas, com um elemento por
+    linha (PDD, folga de subordinação, ROE Júnior, aporte necessário...).
+    """
+    return calcular_metricas(matriz_para_params(X))
+
+
+def avaliar_store(store: dict):
+    """Atalho: (nomes, métricas) para todos os fundos do cadastro."""
+    nomes, X = params_para_matriz(store)
+    return nomes, avaliar_fundos(X)
+
+
+# -------------------------------------------------------------------
+# SENSIBILIDADE POR PARÂMETRO (TORNADO)
+# -------------------------------------------------------------------
+# Campos em % que não fazem sentido acima de 100
+_PARAM_TETO_100 = ["sub_min_pct", "pct_recebiveis_pct"] + [f"prov_{b}" for b in BUCKETS]
+
+METRICAS_TORNADO = ("retorno_anualizado_junior", "folga_limite", "aporte_necessario")
+
+
+def sensibilidade_parametros(params: dict, choque_rel: float = 0.10, metricas=METRICAS_TORNADO) -> dict:
+    """
+    Perturba cada parâmetro numérico em -choque_rel e +choque_rel (relativo
+    ao valor atual) e avalia tudo numa única passada em lote: X tem 2N+1
+    linhas (base, N para baixo, N para cima). Campos zerados não se movem.
+
+    Retorna os campos, seus valores (base/baixo/alto) e, para cada métrica,
+    o valor base e os vetores (N,) dos choques para baixo e para cima.
+    """
+    _, X0 = params_para_matriz({"base": params})
+    campos = [f for f in PARAM_FIELDS if f != "incluir_pdd"]
+    idx = np.array([PARAM_INDEX[f] for f in campos])
+    n = len(campos)
+    linhas = np.arange(n)
+
+    X = np.repeat(X0, 2 * n + 1, axis=0)
+    X[1 + linhas, idx] *= 1 - choque_rel
+    X[1 + n + linhas, idx] *= 1 + choque_rel
+    X = np.maximum(X, 0.0)
+    teto = [PARAM_INDEX[f] for f in _PARAM_TETO_100]
+    X[:, teto] = np.minimum(X[:, teto], 100.0)
+
+    m = avaliar_fundos(X)
+    return {
+        "campos": campos,
+        "valor_base": X[0, idx],
+        "valor_baixo": X[1 + linhas, idx],
+        "valor_alto": X[1 + n + linhas, idx],
+        "metricas": {
+            nome: {
+                "base": float(m[nome][0]),
+                "baixo": m[nome][1:1 + n],
+                "alto": m[nome][1 + n:],
+            }
+            for nome in metricas
+        },
+    }
+
+
+# -------------------------------------------------------------------
+# GOAL-SEEK VETORIZADO (BISSEÇÃO EM LOTE)
+# -------------------------------------------------------------------
+def _alavanca_pdd_mult(X: np.ndarray, x: np.ndarray) -> np.ndarray:
+    """Multiplica todas as provisões por x (limitadas a 100%)."""
+    cols = [PARAM_INDEX[f"prov_{b}"] for b in BUCKETS]
+    X[:, cols] = np.minimum(X[:, cols] * x[:, None], 100.0)
+    return X
+
+
+# Alavancas além das colunas de PARAM_FIELDS: nome -> f(X, x) que aplica x em X
+ALAVANCAS_ESPECIAIS = {
+    "pdd_mult": _alavanca_pdd_mult,
+}
+
+
+def aplicar_alavanca(X: np.ndarray, alavanca: str, x) -> np.ndarray:
+    """Cópia de X (K, P) com a alavanca ajustada para x (K,)."""
+    X = np.array(X, dtype=float, copy=True)
+    x = np.broadcast_to(np.asarray(x, dtype=float), (X.shape[0],))
+    if alavanca in ALAVANCAS_ESPECIAIS:
+        return ALAVANCAS_ESPECIAIS[alavanca](X, x)
+    if alavanca not in PARAM_INDEX:
+        raise KeyError(f"alavanca desconhecida: {alavanca}")
+    X[:, PARAM_INDEX[alavanca]] = x
+    return X
+
+
+def buscar_meta(
+    X_base,
+    alavanca: str,
+    metrica: str,
+    alvo,
+    lo,
+    hi,
+    xtol: float = 1e-6,
+    max_iter: int = 100,
+) -> dict:
+    """
+    Resolve metrica(alavanca = x) = alvo para K problemas de uma vez, por
+    bisseção no intervalo [lo, hi]. Cada linha de X_base (K, P) é um fundo
+    ou cenário; alvo, lo e hi aceitam escalares ou vetores (K,). A cada
+    iteração só as linhas ainda abertas passam pelo motor (avaliar_fundos).
+
+    - alavanca: coluna de PARAM_FIELDS (ex.: "pct_recebiveis_pct",
+      "valor_senior") ou uma de ALAVANCAS_ESPECIAIS (ex.: "pdd_mult");
+    - metrica: chave de calcular_metricas (ex.: "retorno_anualizado_junior").
+
+    Retorna x (nan onde [lo, hi] não contém raiz), o valor da métrica em x,
+    a máscara `encontrado` e o número de iterações usadas.
+    """
+    X_base = np.atleast_2d(np.asarray(X_base, dtype=float))
+    k = X_base.shape[0]
+    alvo = np.broadcast_to(np.asarray(alvo, dtype=float), (k,))
+    lo = np.array(np.broadcast_to(np.asarray(lo, dtype=float), (k,)))
+    hi = np.array(np.broadcast_to(np.asarray(hi, dtype=float), (k,)))
+
+    def f(linhas, x):
+        return avaliar_fundos(aplicar_alavanca(X_base[linhas], alavanca, x))[metrica] - alvo[linhas]
+
+    todas = np.arange(k)
+    f_lo = f(todas, lo)
+    f_hi = f(todas, hi)
+    encontrado = np.isfinite(f_lo) & np.isfinite(f_hi) & (np.sign(f_lo) * np.sign(f_hi) <= 0)
+
+    # Raiz exatamente num extremo: fecha o intervalo nela
+    lo = np.where(encontrado & (f_hi == 0), hi, lo)
+    hi = np.where(encontrado & (f_lo == 0), lo, hi)
+
+    iteracoes = 0
+    abertas = todas[encontrado & (np.abs(hi - lo) > xtol)]
+    while abertas.size and iteracoes < max_iter:
+        iteracoes += 1
+        meio = (lo[abertas] + hi[abertas]) / 2
+        f_meio = f(abertas, meio)
+        mesmo_lado = np.sign(f_meio) == np.sign(f_lo[abertas])
+        lo[abertas] = np.where(mesmo_lado, meio, lo[abertas])
+        f_lo[abertas] = np.where(mesmo_lado, f_meio, f_lo[abertas])
+        hi[abertas] = np.where(mesmo_lado, hi[abertas], meio)
+        abertas = abertas[np.abs(hi[abertas] - lo[abertas]) > xtol]
+
+    x = np.where(encontrado, (lo + hi) / 2, np.nan)
+    valor = np.full(k, np.nan)
+    if encontrado.any():
+        linhas = todas[encontrado]
+        valor[linhas] = f(linhas, x[linhas]) + alvo[linhas]
+    return {
+        "x": x,
+        "valor_metrica": valor,
+        "encontrado": encontrado,
+        "iteracoes": iteracoes,
+    }
+
+
+# -------------------------------------------------------------------
+# STRESS TEST DE SUBORDINAÇÃO (CURVA VETORIZADA)
+# -------------------------------------------------------------------
+def ponto_ruptura(valor_junior, pl_total, sub_min):
+    """
+    Perda máxima L tal que (Jr - L) / (PL - L) = sub_min, limitada a [0, Jr].
+
+        L = (Jr - sub_min * PL) / (1 - sub_min)
+    """
+    valor_junior = np.asarray(valor_junior, dtype=float)
+    pl_total = np.asarray(pl_total, dtype=float)
+    sub_min = np.asarray(sub_min, dtype=float)
+    ruptura = np.maximum(0.0, _div(valor_junior - sub_min * pl_total, 1 - sub_min))
+    ruptura = np.minimum(ruptura, valor_junior)
+    return np.where(sub_min >= 1.0, 0.0, ruptura)
+
+
+def curva_stress(perdas, valor_junior, pl_total, sub_min) -> dict:
+    """
+    Subordinação, PL, PL Júnior e aporte após uma perda (R$), elemento a
+    elemento. Segue o broadcasting do NumPy: para F fundos × G pontos de
+    grade, passe os parâmetros do fundo com shape (F, 1) e as perdas com
+    shape (G,) ou (F, G).
+    """
+    perdas = np.asarray(perdas, dtype=float)
+    valor_junior = np.asarray(valor_junior, dtype=float)
+    pl_total = np.asarray(pl_total, dtype=float)
+    sub_min = np.asarray(sub_min, dtype=float)
+
+    pl_s = np.maximum(pl_total - perdas, 1e-9)  # evita div/0
+    jr_s = np.maximum(valor_junior - perdas, 0.0)
+    sub_pct = jr_s / pl_s * 100
+
+    aporte = np.where(
+        sub_pct < sub_min * 100,
+        np.maximum(0.0, _div(sub_min * pl_s - jr_s, 1 - sub_min)),
+        0.0,
+    )
+    return {
+        "subordinacao_pct": sub_pct,
+        "pl": pl_s,
+        "pl_junior": jr_s,
+        "aporte": aporte,
+    }
+
+
+def curva_stress_fundos(metricas: dict, x_grid, modo: str = "multiplicador") -> dict:
+    """
+    Curvas de stress para vários fundos de uma vez (saída de avaliar_fundos).
+
+    modo="multiplicador": x_grid multiplica a PDD base de cada fundo;
+    modo="valor": x_grid já é a perda em R$. Retorna arrays (F, G) e a
+    perda de ruptura (F,).
+    """
+    x_grid = np.asarray(x_grid, dtype=float)
+    pdd_base = np.atleast_1d(metricas["pdd_base"])[:, None]
+    valor_junior = np.atleast_1d(metricas["valor_junior"])[:, None]
+    pl_total = np.atleast_1d(metricas["pl_total"])[:, None]
+    sub_min = np.atleast_1d(metricas["sub_min"])[:, None]
+
+    if modo == "multiplicador":
+        perdas = pdd_base * x_grid
+    else:
+        perdas = np.broadcast_to(x_grid, (pl_total.shape[0], x_grid.size))
+    curva = curva_stress(perdas, valor_junior, pl_total, sub_min)
+    curva["perdas"] = perdas
+    curva["ruptura"] = ponto_ruptura(valor_junior[:, 0], pl_total[:, 0], sub_min[:, 0])
+    return curva
+
+
+# -------------------------------------------------------------------
+# ESTRUTURA ÓTIMA DE CAPITAL (BUSCA EM GRADE, GROSSA -> FINA)
+# -------------------------------------------------------------------
+# Métricas guardadas de cada candidato entre os níveis de refinamento
+METRICAS_OTIMIZACAO = ("retorno_anualizado_junior", "sub_atual", "folga_limite", "aporte_necessario")
+
+
+def prob_ruptura(taxas_perda_ordenadas, limiar) -> np.ndarray:
+    """
+    Fração dos caminhos com perda (fração da carteira) acima do limiar,
+    pela CDF empírica de uma amostra já ordenada. Vetorizado no limiar.
+    """
+    amostra = np.asarray(taxas_perda_ordenadas, dtype=float)
+    if amostra.size == 0:
+        return np.zeros(np.shape(limiar))
+    return 1.0 - np.searchsorted(amostra, limiar, side="right") / amostra.size
+
+
+def _avaliar_estruturas(X0, j, m, rec, enh_sr0, enh_mz0, premio_sr, premio_mz, amostra):
+    """Monta e avalia uma linha de parâmetros por candidato (j, m, rec)."""
+    pl = X0[PARAM_INDEX["valor_junior"]] + X0[PARAM_INDEX["valor_mezz"]] + X0[PARAM_INDEX["valor_senior"]]
+    X = np.repeat(X0[None, :], j.size, axis=0)
+    X[:, PARAM_INDEX["valor_junior"]] = pl * j
+    X[:, PARAM_INDEX["valor_mezz"]] = pl * m
+    X[:, PARAM_INDEX["valor_senior"]] = pl * (1 - j - m)
+    X[:, PARAM_INDEX["pct_recebiveis_pct"]] = rec
+
+    # Spread reprecificado pelo reforço de crédito (subordinação abaixo da classe)
+    X[:, PARAM_INDEX["spread_senior_aa_pct"]] += premio_sr * (enh_sr0 - (j + m)) * 100
+    X[:, PARAM_INDEX["spread_mezz_aa_pct"]] += premio_mz * (enh_mz0 - j) * 100
+    X[:, [PARAM_INDEX["spread_senior_aa_pct"], PARAM_INDEX["spread_mezz_aa_pct"]]] = np.maximum(
+        X[:, [PARAM_INDEX["spread_senior_aa_pct"], PARAM_INDEX["spread_mezz_aa_pct"]]], 0.0
+    )
+
+    met = avaliar_fundos(X)
+    limiar = _div(ponto_ruptura(met["valor_junior"], met["pl_total"], met["sub_min"]), met["valor_recebiveis"], np.inf)
+    prob = prob_ruptura(amostra, limiar) if amostra is not None else np.zeros(j.size)
+    return X, met, prob
+
+
+def _selecionar(cand: dict, idx) -> dict:
+    sel = {k: v[idx] for k, v in cand.items() if k != "met"}
+    sel["met"] = {k: cand["met"][k][idx] for k in METRICAS_OTIMIZACAO}
+    return sel
+
+
+def _juntar_candidatos(a: dict, b: dict) -> dict:
+    junto = {k: np.concatenate([a[k], b[k]]) for k in a if k != "met"}
+    junto["met"] = {k: np.concatenate([a["met"][k], b["met"][k]]) for k in METRICAS_OTIMIZACAO}
+    return junto
+
+
+def otimizar_estrutura(
+    params: dict,
+    taxas_perda_simuladas=None,
+    prob_max_ruptura: float = 0.01,
+    pct_recebiveis_min: float = 67.0,
+    premio_spread_senior: float = 0.0,
+    premio_spread_mezz: float = 0.0,
+    n_grade: int = 40,
+    n_grade_recebiveis: int = 16,
+    niveis: int = 4,
+    top: int = 5,
+    n_local: int = 9,
+) -> dict:
+    """
+    Divisão Júnior/Mezz/Sênior (frações do PL atual) e % em recebíveis que
+    maximiza o ROE Júnior, sujeita a:
+
+    - subordinação (antes e depois da PDD) >= sub_min_pct;
+    - recebíveis >= pct_recebiveis_min do PL (regra dos 67%);
+    - probabilidade de ruptura <= prob_max_ruptura, medida na amostra
+      `taxas_perda_simuladas` (perda como fração da carteira, p.ex. de
+      fidc_simulacao.simular_taxa_perda). Sem amostra, não há restrição.
+
+    Os spreads Sênior/Mezz sobem `premio_spread_*` p.p. por p.p. de reforço
+    de crédito perdido em relação à estrutura atual (0 = spread fixo).
+
+    A primeira passada avalia a grade inteira (n_grade² × n_grade_recebiveis
+    candidatos) em lote; cada nível seguinte refina uma grade local
+    (n_local³) em volta dos `top` melhores candidatos viáveis.
+    """
+    _, X0 = params_para_matriz({"base": params})
+    X0 = X0[0]
+    pl = X0[PARAM_INDEX["valor_junior"]] + X0[PARAM_INDEX["valor_mezz"]] + X0[PARAM_INDEX["valor_senior"]]
+    if pl <= 0:
+        raise ValueError("PL total precisa ser maior que zero")
+    sub_min = X0[PARAM_INDEX["sub_min_pct"]] / 100.0
+    enh_sr0 = (X0[PARAM_INDEX["valor_junior"]] + X0[PARAM_INDEX["valor_mezz"]]) / pl
+    enh_mz0 = X0[PARAM_INDEX["valor_junior"]] / pl
+    amostra = None if taxas_perda_simuladas is None else np.sort(np.asarray(taxas_perda_simuladas, dtype=float))
+
+    def avaliar(j, m, rec):
+        j = np.clip(j, sub_min, 1.0)
+        m = np.clip(m, 0.0, 1.0 - j)
+        rec = np.clip(rec, pct_recebiveis_min, 100.0)
+        X, met, prob = _avaliar_estruturas(
+            X0, j, m, rec, enh_sr0, enh_mz0, premio_spread_senior, premio_spread_mezz, amostra
+        )
+        viavel = (
+            (met["sub_atual"] >= sub_min - 1e-12)
+            & (met["aporte_necessario"] <= 0)
+            & (prob <= prob_max_ruptura)
+        )
+        roe = np.where(viavel, met["retorno_anualizado_junior"], -np.inf)
+        return {"j": j, "m": m, "rec": rec, "X": X, "met": met, "prob": prob, "viavel": viavel, "roe": roe}
+
+    # --- Nível 0: grade grossa completa ---
+    gj, gm, gr = np.meshgrid(
+        np.linspace(sub_min, 1.0, n_grade),
+        np.linspace(0.0, 1.0 - sub_min, n_grade),
+        np.linspace(pct_recebiveis_min, 100.0, n_grade_recebiveis),
+        indexing="ij",
+    )
+    dentro = gj + gm <= 1.0 + 1e-12
+    grossa = avaliar(gj[dentro], gm[dentro], gr[dentro])
+    n_avaliados = grossa["j"].size
+
+    passo = np.array([
+        (1.0 - sub_min) / max(n_grade - 1, 1),
+        (1.0 - sub_min) / max(n_grade - 1, 1),
+        (100.0 - pct_recebiveis_min) / max(n_grade_recebiveis - 1, 1),
+    ])
+    atual = grossa
+
+    # --- Níveis seguintes: grades locais em volta dos melhores ---
+    desloc = np.linspace(-1.0, 1.0, n_local)
+    dj, dm, dr = (d.ravel() for d in np.meshgrid(desloc, desloc, desloc, indexing="ij"))
+    for _ in range(niveis):
+        melhores = np.argsort(-atual["roe"])[:top]
+        melhores = melhores[np.isfinite(atual["roe"][melhores])]
+        if melhores.size == 0:
+            break
+        j = (atual["j"][melhores, None] + dj * passo[0]).ravel()
+        m = (atual["m"][melhores, None] + dm * passo[1]).ravel()
+        rec = (atual["rec"][melhores, None] + dr * passo[2]).ravel()
+        local = avaliar(j, m, rec)
+        n_avaliados += local["j"].size
+        # mantém os melhores anteriores no conjunto (não piora entre níveis)
+        atual = _juntar_candidatos(_selecionar(atual, melhores), local)
+        passo = passo * 2 / (n_local - 1)
+
+    # o recorte nos limites gera candidatos repetidos
+    _, unicos = np.unique(np.round(np.column_stack([atual["j"], atual["m"], atual["rec"]]), 9), axis=0, return_index=True)
+    atual = _selecionar(atual, unicos)
+    ordem = np.argsort(-atual["roe"])[:top]
+    ordem = ordem[np.isfinite(atual["roe"][ordem])]
+    candidatos = {
+        "valor_junior": atual["X"][ordem, PARAM_INDEX["valor_junior"]],
+        "valor_mezz": atual["X"][ordem, PARAM_INDEX["valor_mezz"]],
+        "valor_senior": atual["X"][ordem, PARAM_INDEX["valor_senior"]],
+        "pct_recebiveis_pct": atual["X"][ordem, PARAM_INDEX["pct_recebiveis_pct"]],
+        "spread_senior_aa_pct": atual["X"][ordem, PARAM_INDEX["spread_senior_aa_pct"]],
+        "spread_mezz_aa_pct": atual["X"][ordem, PARAM_INDEX["spread_mezz_aa_pct"]],
+        "retorno_anualizado_junior": atual["met"]["retorno_anualizado_junior"][ordem],
+        "sub_atual": atual["met"]["sub_atual"][ordem],
+        "folga_limite": atual["met"]["folga_limite"][ordem],
+        "prob_ruptura": atual["prob"][ordem],
+    }
+    return {
+        "encontrado": ordem.size > 0,
+        "candidatos": candidatos,
+        "n_avaliados": int(n_avaliados),
+        "grade": {
+            "junior": grossa["j"],
+            "mezz": grossa["m"],
+            "recebiveis": grossa["rec"],
+            "roe": grossa["met"]["retorno_anualizado_junior"],
+            "prob_ruptura": grossa["prob"],
+            "viavel": grossa["viavel"],
+        },
+    }
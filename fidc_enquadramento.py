@@ -0,0 +1,400 @@
+"""
+Enquadramento pré-trade de operações (sem dependência do Streamlit).
+
+Mesmas regras do bloco "Enquadramento da Operação no Fundo" do dashboard:
+concentração do grupo do sacado contra o limite em % do PL, uso do caixa
+disponível, rating mínimo do fundo e elegibilidade por restrições recentes,
+além do prêmio estrutural e do ajuste de relacionamento (bps).
+
+O VerificadorPreTrade mantém os agregados da carteira (IndiceExposicao da
+fita e caixa) e avalia cada operação com consultas em dicionário, sem
+recalcular nada da carteira: dezenas de microssegundos por operação.
+enquadrar_lote aplica as mesmas regras a uma fila inteira (CSV do dia):
+regras vetorizadas e uma única varredura da fila para limite e caixa.
+"""
+import math
+from dataclasses import dataclass, fields
+
+import numpy as np
+import pandas as pd
+
+from fidc_carteira import (
+    IndiceExposicao,
+    _abrir_binario,
+    _detectar_formato_csv,
+    _decimal_virgula,
+    _normalizar_nome,
+    _valores,
+    chaves_documentos,
+)
+
+
+RATING_ORDEM = (
+    "AAA", "AA+", "AA", "AA-",
+    "A+", "A", "A-",
+    "BBB+", "BBB", "BBB-",
+    "BB+", "BB", "BB-",
+    "B+", "B", "B-",
+    "CCC", "CC", "C",
+)
+_POSICAO_RATING = {rating: i for i, rating in enumerate(RATING_ORDEM)}
+
+# Prêmio estrutural (bps) quando a proteção NÃO existe
+PREMIO_ESTRUTURAL_BPS = {
+    "operacao_confirmada": 20,
+    "boleto_fidc": 25,          # pagamento via comissária (conta do cedente)
+    "recompra_cedente": 40,
+    "trava_domicilio": 30,
+}
+
+AJUSTE_RELACIONAMENTO_BPS = {
+    "Menos de 3 meses": 20,
+    "Entre 3 e 12 meses": 0,
+    "Entre 12 e 36 meses": -10,
+    "Mais de 36 meses": -20,
+}
+
+# "Grave" torna a operação não elegível
+AJUSTE_RESTRICAO_BPS = {"Nenhuma": 0, "Leve": 25, "Moderada": 50, "Grave": None}
+
+
+@dataclass(frozen=True)
+class PoliticaFundo:
+    pl_total: float
+    valor_junior: float
+    limite_pct_pl_sacado: float = 0.10      # fração do PL por grupo econômico
+    rating_minimo: str = "BBB"
+
+
+@dataclass(frozen=True)
+class Operacao:
+    sacado: str                             # CNPJ/CPF (ou nome) do sacado
+    valor: float
+    rating: str = None
+    operacao_confirmada: bool = True
+    boleto_fidc: bool = True
+    recompra_cedente: bool = True
+    trava_domicilio: bool = True
+    tempo_relacionamento: str = "Entre 3 e 12 meses"
+    restricoes_recentes: str = "Nenhuma"
+
+
+def posicao_rating(rating: str) -> int:
+    """Posição na escala (0 = AAA); ValueError para códigos desconhecidos."""
+    try:
+        return _POSICAO_RATING[rating]
+    except KeyError:
+        raise ValueError(f"rating desconhecido: {rating!r}") from None
+
+
+def premio_estrutural_bps(op: Operacao) -> int:
+    return sum(bps for campo, bps in PREMIO_ESTRUTURAL_BPS.items() if not getattr(op, campo))
+
+
+def ajuste_relacionamento_bps(op: Operacao) -> tuple:
+    """(ajuste por relacionamento, ajuste por restrições ou None se não elegível)."""
+    if op.tempo_relacionamento not in AJUSTE_RELACIONAMENTO_BPS:
+        raise ValueError(f"tempo_relacionamento deve ser um de {tuple(AJUSTE_RELACIONAMENTO_BPS)}")
+    if op.restricoes_recentes not in AJUSTE_RESTRICAO_BPS:
+        raise ValueError(f"restricoes_recentes deve ser uma de {tuple(AJUSTE_RESTRICAO_BPS)}")
+    return AJUSTE_RELACIONAMENTO_BPS[op.tempo_relacionamento], AJUSTE_RESTRICAO_BPS[op.restricoes_recentes]
+
+
+class VerificadorPreTrade:
+    """
+    Checagem pré-trade contra agregados mantidos: exposição por sacado /
+    raiz de CNPJ (IndiceExposicao) e caixa disponível. `verificar` só lê;
+    `registrar` atualiza os agregados com uma operação fechada.
+
+    O índice é alterado por `registrar`: passe uma cópia se ele for
+    compartilhado (ex.: cache do dashboard).
+    """
+
+    def __init__(self, politica: PoliticaFundo, caixa_disponivel: float, indice: IndiceExposicao = None):
+        self.politica = politica
+        self.caixa_disponivel = float(caixa_disponivel)
+        self.indice = indice if indice is not None else IndiceExposicao({}, {})
+        self._posicao_minima = posicao_rating(politica.rating_minimo)
+
+    def verificar(self, op: Operacao) -> dict:
+        """Regras e motivos (texto e ordem) iguais aos de enquadrar_lote."""
+        pol = self.politica
+        exp = self.indice.apos_operacao(op.sacado, op.valor)
+
+        # sem CNPJ nem nome não há grupo econômico para checar o limite
+        sacado_informado = not (op.sacado is None or pd.isna(op.sacado)) and exp["chave"] != ""
+        valor_valido = math.isfinite(op.valor) and op.valor > 0
+        pct_pl_grupo = exp["grupo_apos"] / pol.pl_total if pol.pl_total > 0 else math.inf
+        if math.isnan(pct_pl_grupo):
+            pct_pl_grupo = math.inf
+        enquadrado_concentracao = sacado_informado and pct_pl_grupo <= pol.limite_pct_pl_sacado
+        enquadrado_caixa = op.valor <= self.caixa_disponivel
+        # vazio/NaN (ex.: linha de DataFrame) conta como sem rating, como em ler_operacoes
+        rating = None if op.rating is None or pd.isna(op.rating) or op.rating == "" else op.rating
+        posicao = _POSICAO_RATING.get(rating) if rating is not None else None
+        enquadrado_rating = posicao is not None and posicao <= self._posicao_minima
+        ajuste_rel, ajuste_restr = ajuste_relacionamento_bps(op)
+        elegivel = ajuste_restr is not None
+
+        motivos = []
+        if not sacado_informado:
+            motivos.append("sacado não informado")
+        if not valor_valido:
+            motivos.append("valor inválido")
+        else:
+            if sacado_informado and not enquadrado_concentracao:
+                motivos.append(
+                    f"concentração do grupo {exp['raiz']} em {pct_pl_grupo * 100:.2f}% do PL "
+                    f"(limite {pol.limite_pct_pl_sacado * 100:.2f}%)"
+                )
+            if not enquadrado_caixa:
+                motivos.append("valor acima do caixa disponível")
+        if rating is None:
+            motivos.append("operação sem rating")
+        elif posicao is None:
+            motivos.append(f"rating {rating} desconhecido")
+        elif not enquadrado_rating:
+            motivos.append(f"rating {rating} abaixo do mínimo {pol.rating_minimo}")
+        if not elegivel:
+            motivos.append("restrições recentes graves")
+
+        return {
+            "aprovada": not motivos,
+            "motivos": motivos,
+            "enquadrado_concentracao": enquadrado_concentracao,
+            "enquadrado_caixa": enquadrado_caixa,
+            "enquadrado_rating": enquadrado_rating,
+            "elegivel": elegivel,
+            "chave": exp["chave"],
+            "raiz": exp["raiz"],
+            "exposicao_grupo": exp["grupo"],
+            "exposicao_grupo_apos": exp["grupo_apos"],
+            "pct_pl_grupo": pct_pl_grupo,
+            "excesso_concentracao": pct_pl_grupo - pol.limite_pct_pl_sacado,
+            "pct_caixa": op.valor / self.caixa_disponivel if self.caixa_disponivel > 0 else float("inf"),
+            "impacto_junior": op.valor / pol.valor_junior if pol.valor_junior > 0 else 0.0,
+            "premio_estrutural_bps": premio_estrutural_bps(op),
+            "ajuste_relacionamento_bps": ajuste_rel + (ajuste_restr or 0) if elegivel else None,
+        }
+
+    def registrar(self, op: Operacao):
+        """Inclui a operação na exposição e consome o caixa."""
+        self.indice.registrar(op.sacado, op.valor)
+        self.caixa_disponivel -= op.valor
+
+    def verificar_e_registrar(self, op: Operacao) -> dict:
+        """Verifica e, se aprovada, já registra (para filas de operações do dia)."""
+        resultado = self.verificar(op)
+        if resultado["aprovada"]:
+            self.registrar(op)
+        return resultado
+
+
+# ---------------------------------------------------------------------
+# Fila de operações (lote)
+# ---------------------------------------------------------------------
+ALIASES_OPERACOES = {
+    "nome_sacado": ("sacado", "nome_sacado", "nome", "razao_social"),
+    "cnpj": ("cnpj", "cnpj_sacado", "cpf_cnpj", "documento", "doc_sacado"),
+    "valor": ("valor", "valor_operacao", "valor_da_operacao", "montante"),
+    "rating": ("rating", "rating_sacado", "rating_final"),
+    "operacao_confirmada": ("confirmada", "operacao_confirmada"),
+    "boleto_fidc": ("forma_pagamento", "forma_de_pagamento", "boleto_fidc"),
+    "recompra_cedente": ("recompra", "recompra_cedente"),
+    "trava_domicilio": ("trava", "trava_domicilio", "trava_de_domicilio"),
+    "tempo_relacionamento": ("tempo_relacionamento", "relacionamento"),
+    "restricoes_recentes": ("restricoes", "restricoes_recentes", "restricao"),
+}
+_PADROES_OPERACAO = {f.name: f.default for f in fields(Operacao) if f.name not in ("sacado", "valor", "rating")}
+
+_SIM = {"sim", "s", "true", "verdadeiro", "1", "x", "yes", "y"}
+_NAO = {"nao", "n", "false", "falso", "0", "no"}
+
+
+def _flag(serie: pd.Series, padrao: bool, coluna: str) -> np.ndarray:
+    texto = serie.astype("string").map(_normalizar_nome, na_action="ignore").fillna("")
+    if coluna == "boleto_fidc":
+        # aceita a própria opção do dashboard: "Boleto emitido pelo FIDC" / "Comissária ..."
+        texto = texto.mask(texto.str.startswith("boleto"), "sim").mask(texto.str.startswith("comissaria"), "nao")
+    invalido = ~(texto.isin(_SIM | _NAO) | (texto == ""))
+    if invalido.any():
+        raise ValueError(f"Valores inválidos em {coluna}: {', '.join(sorted(set(serie[invalido].astype(str))))}")
+    return np.where(texto == "", padrao, texto.isin(_SIM)).astype(bool)
+
+
+def _opcao(serie: pd.Series, opcoes, padrao: str, coluna: str) -> np.ndarray:
+    por_nome = {_normalizar_nome(o): o for o in opcoes}
+    texto = serie.astype("string").map(_normalizar_nome, na_action="ignore").fillna("")
+    valores = texto.map(por_nome).where(texto != "", padrao)
+    if valores.isna().any():
+        raise ValueError(f"{coluna} deve ser uma de {tuple(opcoes)}")
+    return valores.to_numpy(dtype=object)
+
+
+def ler_operacoes(fonte) -> pd.DataFrame:
+    """
+    Lê a fila de operações (CSV; separador e encoding detectados). Exige
+    valor e CNPJ ou nome do sacado; as colunas de estrutura, relacionamento
+    e restrições são opcionais (padrões de Operacao). Flags aceitam Sim/Não,
+    S/N, 1/0, true/false. Linha sem CNPJ e sem nome fica com sacado "" e é
+    reprovada ("sacado não informado").
+    """
+    arq, fechar = _abrir_binario(fonte)
+    try:
+        encoding, sep = _detectar_formato_csv(arq.read(64 << 10))
+        arq.seek(0)
+        bruto = pd.read_csv(arq, sep=sep, dtype=str, encoding=encoding, keep_default_na=False)
+    finally:
+        if fechar:
+            arq.close()
+
+    normalizados = {_normalizar_nome(c): c for c in bruto.columns}
+    mapa = {}
+    for canonica, aliases in ALIASES_OPERACOES.items():
+        original = next((normalizados[a] for a in aliases if a in normalizados), None)
+        if original is not None:
+            mapa[canonica] = original
+    if "valor" not in mapa or not ({"cnpj", "nome_sacado"} & mapa.keys()):
+        raise ValueError("Fila sem as colunas obrigatórias: valor e CNPJ (ou nome) do sacado")
+
+    vazio = pd.Series("", index=bruto.index)
+    nome = bruto.get(mapa.get("nome_sacado"), vazio).str.strip()
+    cnpj = bruto.get(mapa.get("cnpj"), vazio).str.strip()
+    rating = bruto.get(mapa.get("rating"), vazio).str.strip().str.upper()
+
+    ops = pd.DataFrame({
+        "nome_sacado": nome,
+        "sacado": cnpj.where(cnpj != "", nome),
+        # sem valor que prove o formato, ';' é padrão brasileiro ("1.500" = mil e quinhentos)
+        "valor": _valores(bruto[mapa["valor"]], _decimal_virgula(bruto[mapa["valor"]], padrao=sep == ";")),
+        "rating": rating.where(rating != "", None),
+    })
+    for coluna, padrao in _PADROES_OPERACAO.items():
+        serie = bruto.get(mapa.get(coluna), vazio)
+        if isinstance(padrao, bool):
+            ops[coluna] = _flag(serie, padrao, coluna)
+        else:
+            opcoes = AJUSTE_RELACIONAMENTO_BPS if coluna == "tempo_relacionamento" else AJUSTE_RESTRICAO_BPS
+            ops[coluna] = _opcao(serie, opcoes, padrao, coluna)
+    return ops
+
+
+def _varrer_fila(codigos_grupo, valor, candidata, exposicao_base, caixa, pl, limite) -> tuple:
+    """
+    Exposição do grupo e caixa antes de cada operação, em ordem. Uma
+    reprovação libera limite e caixa para as seguintes, então a fila é uma
+    varredura sequencial: O(n), com floats e listas do Python (sem numpy
+    por elemento). Mesmas contas de VerificadorPreTrade.verificar.
+    """
+    n = len(valor)
+    grupo = {}
+    exposicao_antes = [0.0] * n
+    caixa_antes = [0.0] * n
+    linhas = zip(codigos_grupo.tolist(), valor.tolist(), candidata.tolist(), exposicao_base.tolist())
+    for i, (codigo, v, cand, base) in enumerate(linhas):
+        exposicao = grupo.get(codigo, base)
+        exposicao_antes[i] = exposicao
+        caixa_antes[i] = caixa
+        if cand and (exposicao + v) / pl <= limite and v <= caixa:
+            grupo[codigo] = exposicao + v
+            caixa -= v
+    return np.array(exposicao_antes), np.array(caixa_antes)
+
+
+def enquadrar_lote(
+    ops: pd.DataFrame,
+    politica: PoliticaFundo,
+    caixa_disponivel: float,
+    indice: IndiceExposicao = None,
+    acumular: bool = True,
+) -> pd.DataFrame:
+    """
+    Aplica as regras de VerificadorPreTrade.verificar a todas as operações
+    de `ops` (colunas de Operacao; ver ler_operacoes) de uma vez.
+
+    Com acumular=True a fila é avaliada em ordem: cada operação enxerga as
+    aprovadas antes dela (exposição do grupo e caixa consumido), como uma
+    sequência de verificar_e_registrar. As regras que não dependem da ordem
+    (rating, elegibilidade, valor) são vetorizadas; concentração e caixa
+    saem de uma única varredura O(n) da fila (_varrer_fila). Com
+    acumular=False cada operação é avaliada sozinha contra a carteira
+    atual. O índice não é alterado.
+    """
+    indice = indice if indice is not None else IndiceExposicao({}, {})
+    n = len(ops)
+    valor = ops["valor"].to_numpy(dtype=float)
+    chaves, raizes = chaves_documentos(ops["sacado"].to_numpy(dtype=object))
+    codigos_grupo, _ = pd.factorize(raizes)
+    exposicao_base = pd.Series(raizes).map(indice.raiz.exposicao).fillna(0.0).to_numpy(dtype=float)
+
+    # Regras independentes da ordem
+    rating = ops["rating"].astype(object).where(ops["rating"].notna(), None)
+    posicao = rating.map(_POSICAO_RATING)
+    rating_desconhecido = (rating.notna() & posicao.isna()).to_numpy()
+    enquadrado_rating = (posicao <= posicao_rating(politica.rating_minimo)).to_numpy()
+    ajuste_restricao = ops["restricoes_recentes"].map(AJUSTE_RESTRICAO_BPS)
+    elegivel = ajuste_restricao.notna().to_numpy()
+    ajuste_rel = ops["tempo_relacionamento"].map(AJUSTE_RELACIONAMENTO_BPS).to_numpy(dtype=float)
+    premio = sum(
+        np.where(ops[campo].to_numpy(dtype=bool), 0, bps) for campo, bps in PREMIO_ESTRUTURAL_BPS.items()
+    )
+    valor_valido = np.isfinite(valor) & (valor > 0)
+    sacado_informado = raizes != ""
+
+    # Concentração e caixa (acumulados sobre as aprovadas anteriores)
+    candidata = sacado_informado & enquadrado_rating & elegivel & valor_valido
+    pl = politica.pl_total if politica.pl_total > 0 else np.nan
+    if acumular:
+        exposicao_antes, caixa_antes = _varrer_fila(
+            codigos_grupo, valor, candidata, exposicao_base, caixa_disponivel, pl, politica.limite_pct_pl_sacado
+        )
+    else:
+        exposicao_antes, caixa_antes = exposicao_base, np.full(n, float(caixa_disponivel))
+    pct_pl_grupo = (exposicao_antes + valor) / pl
+    enquadrado_concentracao = sacado_informado & (pct_pl_grupo <= politica.limite_pct_pl_sacado)
+    enquadrado_caixa = valor <= caixa_antes
+
+    aprovada = enquadrado_rating & elegivel & valor_valido & enquadrado_concentracao & enquadrado_caixa
+    pct_pl_grupo = np.nan_to_num(pct_pl_grupo, nan=np.inf)
+
+    # Motivos na mesma ordem/texto de VerificadorPreTrade.verificar
+    limite_txt = f"{politica.limite_pct_pl_sacado * 100:.2f}%"
+    com_rating = rating.notna().to_numpy()
+    regras = [
+        (~sacado_informado, "sacado não informado"),
+        (~valor_valido, "valor inválido"),
+        (
+            sacado_informado & valor_valido & ~enquadrado_concentracao,
+            [f"concentração do grupo {r} em {p * 100:.2f}% do PL (limite {limite_txt})" for r, p in zip(raizes, pct_pl_grupo)],
+        ),
+        (valor_valido & ~enquadrado_caixa, "valor acima do caixa disponível"),
+        (~com_rating, "operação sem rating"),
+        (rating_desconhecido, [f"rating {r} desconhecido" for r in rating]),
+        (
+            com_rating & ~rating_desconhecido & ~enquadrado_rating,
+            [f"rating {r} abaixo do mínimo {politica.rating_minimo}" for r in rating],
+        ),
+        (~elegivel, "restrições recentes graves"),
+    ]
+    partes = [np.where(mascara, np.asarray(texto, dtype=object), "") for mascara, texto in regras]
+    motivos = ["; ".join(filter(None, linha)) for linha in zip(*partes)]
+
+    return pd.DataFrame({
+        "nome_sacado": ops["nome_sacado"].to_numpy() if "nome_sacado" in ops else ops["sacado"].to_numpy(),
+        "chave": chaves,
+        "raiz": raizes,
+        "valor": valor,
+        "rating": rating.to_numpy(),
+        "aprovada": aprovada,
+        "motivos": motivos,
+        "enquadrado_concentracao": enquadrado_concentracao,
+        "enquadrado_caixa": enquadrado_caixa,
+        "enquadrado_rating": enquadrado_rating,
+        "elegivel": elegivel,
+        "exposicao_grupo": exposicao_antes,
+        "exposicao_grupo_apos": exposicao_antes + valor,
+        "pct_pl_grupo": pct_pl_grupo,
+        "caixa_antes": caixa_antes,
+        "premio_estrutural_bps": premio,
+        "ajuste_relacionamento_bps": np.where(elegivel, ajuste_rel + ajuste_restricao.fillna(0).to_numpy(dtype=float), np.nan),
+    })
@@ -0,0 +1,336 @@
+"""
+Execução em lotes num pool de processos (sem dependência do Streamlit).
+
+As entradas e saídas grandes ficam em blocos de memória compartilhada
+(multiprocessing.shared_memory): os workers recebem só os descritores
+(nome, shape, dtype) e escrevem o resultado direto na fatia do seu lote, sem
+serializar DataFrames nem arrays.
+
+Determinismo: a divisão em lotes depende só do tamanho do problema e do
+tamanho do lote (nunca do número de workers), e cada lote do Monte Carlo tem
+a semente fixa de lotes_caminhos. Com isso o resultado é bit a bit igual com
+1 worker (execução local) ou com N processos.
+"""
+import atexit
+import os
+import sys
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass
+from multiprocessing import get_all_start_methods, get_context, process, shared_memory
+
+import numpy as np
+
+from fidc_engine import FundSnapshot, curva_stress, ponto_ruptura
+from fidc_projecao import DRE_COLUNAS_PARAM, DRE_LINHAS, projetar_dre
+from fidc_simulacao import TAMANHO_LOTE, lotes_caminhos, perdas_lote
+
+
+FUNDOS_POR_LOTE = 2_000
+CENARIOS_POR_LOTE = 500
+
+# Parâmetros mensais de projetar_dre (tabela editável + perda esperada)
+_DRE_ARGS = list(DRE_COLUNAS_PARAM) + ["taxa_perda_esperada"]
+
+
+def workers_padrao() -> int:
+    """Número de processos: variável FIDC_WORKERS ou o total de CPUs."""
+    try:
+        return max(1, int(os.environ.get("FIDC_WORKERS", "")))
+    except ValueError:
+        return os.cpu_count() or 1
+
+
+# ---------------------------------------------------------------------
+# Memória compartilhada
+# ---------------------------------------------------------------------
+@dataclass(frozen=True)
+class DescritorArray:
+    nome: str
+    shape: tuple
+    dtype: str
+
+
+class ArraysCompartilhados:
+    """
+    Copia `entradas` para memória compartilhada e aloca `saidas`
+    ({nome: (shape, dtype)}) zeradas. Use como context manager: ao sair os
+    blocos são liberados, então copie o que precisar de `arrays` antes.
+    """
+
+    def __init__(self, entradas: dict, saidas: dict = None):
+        self._blocos = []
+        self.arrays = {}
+        self.descritores = {}
+        try:
+            for nome, valor in entradas.items():
+                valor = np.ascontiguousarray(valor)
+                self._alocar(nome, valor.shape, valor.dtype)[...] = valor
+            for nome, (shape, dtype) in (saidas or {}).items():
+                self._alocar(nome, shape, np.dtype(dtype))[...] = 0
+        except Exception:
+            self.liberar()
+            raise
+
+    def _alocar(self, nome, shape, dtype) -> np.ndarray:
+        nbytes = max(int(np.prod(shape, dtype=np.int64)) * dtype.itemsize, 1)
+        bloco = shared_memory.SharedMemory(create=True, size=nbytes)
+        self._blocos.append(bloco)
+        self.descritores[nome] = DescritorArray(bloco.name, tuple(shape), dtype.str)
+        self.arrays[nome] = np.ndarray(shape, dtype=dtype, buffer=bloco.buf)
+        return self.arrays[nome]
+
+    def liberar(self):
+        self.arrays.clear()
+        for bloco in self._blocos:
+            _fechar(bloco)
+            bloco.unlink()
+        self._blocos.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.liberar()
+
+
+def _fechar(bloco: shared_memory.SharedMemory):
+    # Uma view ainda viva (ex.: no traceback de uma exceção) impede o close;
+    # o mapeamento é solto quando ela for coletada.
+    try:
+        bloco.close()
+    except BufferError:
+        pass
+
+
+def _executar_tarefa(funcao, descritores: dict, args: tuple):
+    """Roda no worker: anexa os blocos, chama funcao(arrays, *args) e solta."""
+    blocos = [shared_memory.SharedMemory(name=d.nome) for d in descritores.values()]
+    arrays = {
+        nome: np.ndarray(d.shape, dtype=np.dtype(d.dtype), buffer=bloco.buf)
+        for (nome, d), bloco in zip(descritores.items(), blocos)
+    }
+    try:
+        return funcao(arrays, *args)
+    finally:
+        arrays.clear()
+        for bloco in blocos:
+            _fechar(bloco)
+
+
+# Caminho do script principal (o dashboard), repassado ao forkserver
+_ENV_MAIN = "FIDC_PARALELO_MAIN"
+
+
+def _preparar_forkserver():
+    """
+    Roda no forkserver, que importa este módulo no preload. O Streamlit
+    registra o app como __main__; cada worker recebe esse caminho e, se o
+    __main__ herdado do forkserver não tiver o mesmo __file__, reimporta (e
+    executa) o dashboard inteiro. Gravando o caminho no __main__ do
+    forkserver, os workers nascem com ele e não importam nada.
+    """
+    caminho = os.environ.get(_ENV_MAIN)
+    main = sys.modules.get("__main__")
+    if caminho and main is not None and not getattr(main, "__file__", None):
+        main.__file__ = caminho
+
+
+_preparar_forkserver()
+
+
+def _caminho_main():
+    # Mesma normalização de multiprocessing.spawn.get_preparation_data
+    caminho = getattr(sys.modules.get("__main__"), "__file__", None)
+    if caminho is None:
+        return None
+    if not os.path.isabs(caminho) and process.ORIGINAL_DIR is not None:
+        caminho = os.path.join(process.ORIGINAL_DIR, caminho)
+    return os.path.normpath(caminho)
+
+
+_POOL = None
+_TRAVA_POOL = threading.Lock()
+
+
+def _executor() -> ProcessPoolExecutor:
+    """
+    Pool único do processo, com workers_padrao() processos, criado no
+    primeiro uso. forkserver evita fork() de um processo com threads
+    (servidor do Streamlit) e é configurado uma vez, aqui.
+    """
+    global _POOL
+    with _TRAVA_POOL:
+        if _POOL is None:
+            # O forkserver herda o ambiente: caminho do app e, para o preload
+            # achar este módulo (o sys.path do pai não é repassado), o diretório
+            caminho = _caminho_main()
+            if caminho:
+                os.environ[_ENV_MAIN] = caminho
+            diretorio = os.path.dirname(os.path.abspath(__file__))
+            pythonpath = [c for c in os.environ.get("PYTHONPATH", "").split(os.pathsep) if c]
+            if diretorio not in pythonpath:
+                os.environ["PYTHONPATH"] = os.pathsep.join([diretorio] + pythonpath)
+            contexto = get_context("forkserver")
+            contexto.set_forkserver_preload([__name__])
+            _POOL = ProcessPoolExecutor(max_workers=workers_padrao(), mp_context=contexto)
+        return _POOL
+
+
+def _descartar_executor(executor: ProcessPoolExecutor):
+    """Tira do ar um pool quebrado; o próximo uso cria outro."""
+    global _POOL
+    with _TRAVA_POOL:
+        if _POOL is executor:
+            _POOL = None
+    executor.shutdown(wait=False, cancel_futures=True)
+
+
+@atexit.register
+def _encerrar_executor():
+    if _POOL is not None:
+        _POOL.shutdown(wait=False, cancel_futures=True)
+
+
+def executar_lotes(funcao, compartilhados: ArraysCompartilhados, tarefas: list, n_workers: int = None) -> list:
+    """
+    Executa funcao(arrays, *tarefa) para cada tarefa e devolve os retornos
+    na ordem das tarefas. `funcao` precisa ser de nível de módulo (picklable)
+    e deve escrever seus resultados nas saídas compartilhadas.
+
+    Com 1 worker, 1 tarefa ou sem forkserver (Windows) roda no próprio
+    processo; senão usa o pool compartilhado (workers_padrao() processos).
+    Se um worker morrer o pool é descartado e recriado na chamada seguinte.
+    """
+    n_workers = workers_padrao() if n_workers is None else max(1, int(n_workers))
+    if n_workers == 1 or len(tarefas) <= 1 or "forkserver" not in get_all_start_methods():
+        return [funcao(compartilhados.arrays, *tarefa) for tarefa in tarefas]
+
+    executor = _executor()
+    descritores = compartilhados.descritores
+    try:
+        futuros = [executor.submit(_executar_tarefa, funcao, descritores, tarefa) for tarefa in tarefas]
+        return [f.result() for f in futuros]
+    except BrokenProcessPool:
+        _descartar_executor(executor)
+        raise
+
+
+def _fatias(n: int, tamanho: int) -> list:
+    return [(i, min(i + tamanho, n)) for i in range(0, n, tamanho)]
+
+
+# ---------------------------------------------------------------------
+# Monte Carlo de perdas
+# ---------------------------------------------------------------------
+def _lote_perdas(arrays, inicio, n, semente, snap, distribuicao, cv_faixa, vol_sistemica):
+    arrays["perdas"][inicio:inicio + n] = perdas_lote(snap, n, semente, distribuicao, cv_faixa, vol_sistemica)
+
+
+def simular_perdas_paralelo(
+    snap: FundSnapshot,
+    n_caminhos: int = 100_000,
+    distribuicao: str = "beta",
+    cv_faixa: float = 0.5,
+    vol_sistemica: float = 0.3,
+    seed: int = 0,
+    tamanho_lote: int = TAMANHO_LOTE,
+    n_workers: int = None,
+) -> np.ndarray:
+    """Mesmo resultado de fidc_simulacao.simular_perdas, com os lotes no pool."""
+    tarefas = [
+        (inicio, n, semente, snap, distribuicao, cv_faixa, vol_sistemica)
+        for inicio, n, semente in lotes_caminhos(n_caminhos, seed, tamanho_lote)
+    ]
+    with ArraysCompartilhados({}, {"perdas": ((int(n_caminhos),), float)}) as sh:
+        executar_lotes(_lote_perdas, sh, tarefas, n_workers)
+        return sh.arrays["perdas"].copy()
+
+
+# ---------------------------------------------------------------------
+# Stress test de vários fundos
+# ---------------------------------------------------------------------
+_STRESS_SAIDAS = ["subordinacao_pct", "pl", "pl_junior", "aporte", "perdas"]
+
+
+def _lote_stress(arrays, ini, fim, modo):
+    x_grid = arrays["x_grid"]
+    valor_junior = arrays["valor_junior"][ini:fim, None]
+    pl_total = arrays["pl_total"][ini:fim, None]
+    sub_min = arrays["sub_min"][ini:fim, None]
+
+    if modo == "multiplicador":
+        perdas = arrays["pdd_base"][ini:fim, None] * x_grid
+    else:
+        perdas = np.broadcast_to(x_grid, (fim - ini, x_grid.size))
+    curva = curva_stress(perdas, valor_junior, pl_total, sub_min)
+    curva["perdas"] = perdas
+    for nome in _STRESS_SAIDAS:
+        arrays[nome][ini:fim] = curva[nome]
+
+
+def curva_stress_fundos_paralelo(
+    metricas: dict,
+    x_grid,
+    modo: str = "multiplicador",
+    fundos_por_lote: int = FUNDOS_POR_LOTE,
+    n_workers: int = None,
+) -> dict:
+    """Mesmo resultado de fidc_engine.curva_stress_fundos, com lotes de fundos no pool."""
+    x_grid = np.asarray(x_grid, dtype=float)
+    entradas = {
+        nome: np.atleast_1d(np.asarray(metricas[nome], dtype=float))
+        for nome in ("pdd_base", "valor_junior", "pl_total", "sub_min")
+    }
+    n_fundos = entradas["pl_total"].shape[0]
+    entradas["x_grid"] = x_grid
+    saidas = {nome: ((n_fundos, x_grid.size), float) for nome in _STRESS_SAIDAS}
+
+    tarefas = [(ini, fim, modo) for ini, fim in _fatias(n_fundos, fundos_por_lote)]
+    with ArraysCompartilhados(entradas, saidas) as sh:
+        executar_lotes(_lote_stress, sh, tarefas, n_workers)
+        curva = {nome: sh.arrays[nome].copy() for nome in _STRESS_SAIDAS}
+    curva["ruptura"] = ponto_ruptura(entradas["valor_junior"], entradas["pl_total"], entradas["sub_min"])
+    return curva
+
+
+# ---------------------------------------------------------------------
+# DRE de muitos cenários
+# ---------------------------------------------------------------------
+def _lote_dre(arrays, ini, fim, snap):
+    arrays["dre"][ini:fim] = projetar_dre(snap, **{nome: arrays[nome][ini:fim] for nome in _DRE_ARGS})
+
+
+def projetar_dre_paralelo(
+    snap: FundSnapshot,
+    taxa_carteira_am_pct,
+    pct_recebiveis_pct,
+    outras_receitas_mes,
+    outros_custos_mes,
+    pdd_manual_mes=0.0,
+    mov_junior=0.0,
+    mov_mezz=0.0,
+    mov_senior=0.0,
+    meses=None,
+    taxa_perda_esperada=None,
+    cenarios_por_lote: int = CENARIOS_POR_LOTE,
+    n_workers: int = None,
+) -> np.ndarray:
+    """Mesmo resultado de fidc_projecao.projetar_dre, com lotes de cenários no pool."""
+    valores = [
+        np.asarray(x, dtype=float)
+        for x in (
+            taxa_carteira_am_pct, pct_recebiveis_pct, outras_receitas_mes, outros_custos_mes,
+            pdd_manual_mes, mov_junior, mov_mezz, mov_senior,
+            snap.taxa_perda_esperada if taxa_perda_esperada is None else taxa_perda_esperada,
+        )
+    ]
+    n_cen, n_meses = np.broadcast_shapes(*(x.shape for x in valores), (1, meses or 1))
+    entradas = {nome: np.broadcast_to(x, (n_cen, n_meses)) for nome, x in zip(_DRE_ARGS, valores)}
+    saidas = {"dre": ((n_cen, n_meses, len(DRE_LINHAS)), float)}
+
+    tarefas = [(ini, fim, snap) for ini, fim in _fatias(n_cen, cenarios_por_lote)]
+    with ArraysCompartilhados(entradas, saidas) as sh:
+        executar_lotes(_lote_dre, sh, tarefas, n_workers)
+        return sh.arrays["dre"].copy()
@@ -0,0 +1,368 @@
+"""
+Precificação de títulos descontados (sem dependência do Streamlit).
+
+Mesmas contas do "Simulador de Taxa (Unitário)" do dashboard — deságio pela
+taxa sobre o valor de face, desembolso líquido da TAC, mora/multa no atraso,
+TIR bruta/líquida de PDD e impacto da TAC — escritas com operações NumPy:
+cada entrada pode ser escalar ou array (um valor por título), e todas são
+combinadas por broadcasting. Um borderô de 100 mil títulos sai numa chamada.
+
+precificar_bordero trata o borderô como uma operação: cada duplicata tem o
+seu vencimento, e a TIR consolidada é a XIRR do fluxo irregular (desembolso
+na data da operação, valores de face nos vencimentos).
+"""
+import io
+
+import numpy as np
+import pandas as pd
+
+from fidc_carteira import _abrir_binario, _datas, _decimal_virgula, _detectar_formato_csv, _normalizar_nome, _valores
+from fidc_tir import tir_lote
+
+
+DIAS_MES = 30
+DIAS_ANO = 365
+
+# Colunas de precificar_tabela (saídas de precificar_titulos), na ordem da exportação
+PRECIFICACAO_LABELS = {
+    "valor_face": "Valor de Face (R$)",
+    "taxa_am_pct": "Taxa (% a.m.)",
+    "prazo_dias": "Prazo (dias)",
+    "tac": "Outras Taxas (R$)",
+    "desagio_valor": "Deságio (R$)",
+    "desagio_pct": "Deságio (%)",
+    "preco_compra": "Preço de Compra (R$)",
+    "desembolso_liquido": "Desembolso Líquido (R$)",
+    "multa_valor": "Multa (R$)",
+    "mora_valor": "Mora (R$)",
+    "recebimento_final": "Recebimento Final (R$)",
+    "irr_valida": "TIR Válida",
+    "irr_m_bruto": "TIR Mensal Bruta",
+    "irr_a_bruto": "TIR Anual Bruta",
+    "irr_m_liquido": "TIR Mensal Líquida",
+    "irr_a_liquido": "TIR Anual Líquida",
+    "retorno_periodo_liquido": "Retorno Período Líquido",
+    "receita_total_bruta": "Receita Bruta (R$)",
+    "pdd_esperada_valor": "PDD Esperada (R$)",
+    "receita_total_liquida": "Receita Líquida (R$)",
+    "impacto_tac_pp": "Impacto TAC (p.p.)",
+}
+
+
+def precificar_titulos(
+    valor_face,
+    taxa_am,
+    prazo_dias,
+    tac=0.0,
+    mora_am=0.0,
+    multa=0.0,
+    prob_default=0.0,
+    dias_atraso=0.0,
+) -> dict:
+    """
+    Precifica títulos em lote. Taxas em fração (0.02 = 2% a.m.; multa flat;
+    prob_default de 0 a 1). Devolve um dicionário de arrays no shape do
+    broadcasting das entradas.
+
+    Quando recebimento ou desembolso não são positivos a TIR não existe:
+    irr_valida = False e as TIRs/retornos ficam 0, como no simulador.
+    """
+    face, taxa, prazo, tac, mora_am, multa, pd_, atraso = np.broadcast_arrays(
+        *(np.asarray(x, dtype=float) for x in (valor_face, taxa_am, prazo_dias, tac, mora_am, multa, prob_default, dias_atraso))
+    )
+
+    desagio_valor = face * taxa * (prazo / DIAS_MES)
+    desagio_pct = np.divide(desagio_valor * 100, face, out=np.zeros_like(face), where=face > 0)
+    preco_compra = face - desagio_valor
+    desembolso_liquido = preco_compra - tac
+
+    multa_valor = np.where(atraso > 0, face * multa, 0.0)
+    mora_valor = face * (mora_am / DIAS_MES) * atraso
+    penalidade_total = multa_valor + mora_valor
+    recebimento_final = face + penalidade_total
+
+    n_dias = np.maximum(1, prazo)
+
+    def _tir_mensal(recebido, pago):
+        valida = (recebido > 0) & (pago > 0)
+        razao = np.divide(recebido, pago, out=np.ones_like(recebido), where=valida)   # 1 → TIR 0
+        irr_d = razao ** (1 / n_dias) - 1
+        return valida, razao, irr_d
+
+    irr_valida, razao, irr_d_bruto = _tir_mensal(recebimento_final, desembolso_liquido)
+    irr_m_bruto = (1 + irr_d_bruto) ** DIAS_MES - 1
+    irr_a_bruto = (1 + irr_d_bruto) ** DIAS_ANO - 1
+    retorno_periodo_bruto = razao - 1
+
+    irr_m_liquido = irr_m_bruto * (1 - pd_)
+    irr_a_liquido = np.where(irr_valida, (1 + irr_m_liquido) ** 12 - 1, 0.0)
+    retorno_periodo_liquido = retorno_periodo_bruto * (1 - pd_)
+
+    receita_total_bruta = recebimento_final - desembolso_liquido
+    pdd_esperada_valor = receita_total_bruta * pd_
+    receita_total_liquida = receita_total_bruta - pdd_esperada_valor
+
+    # Impacto da TAC: TIR contra o preço de compra (sem descontar a TAC)
+    sem_tac_valida, _, irr_d_sem_tac = _tir_mensal(recebimento_final, preco_compra)
+    irr_m_sem_tac = (1 + irr_d_sem_tac) ** DIAS_MES - 1
+    irr_m_sem_tac_liq = np.where(sem_tac_valida, irr_m_sem_tac * (1 - pd_), np.nan)
+    impacto_tac_pp = np.where(sem_tac_valida, (irr_m_bruto - irr_m_sem_tac) * 100, 0.0)
+
+    return {
+        "valor_face": face,
+        "taxa_am": taxa,
+        "prazo_dias": prazo,
+        "tac": tac,
+        "desagio_valor": desagio_valor,
+        "desagio_pct": desagio_pct,
+        "preco_compra": preco_compra,
+        "desembolso_liquido": desembolso_liquido,
+        "multa_valor": multa_valor,
+        "mora_valor": mora_valor,
+        "penalidade_total": penalidade_total,
+        "recebimento_final": recebimento_final,
+        "irr_valida": irr_valida,
+        "irr_d_bruto": irr_d_bruto,
+        "irr_m_bruto": irr_m_bruto,
+        "irr_a_bruto": irr_a_bruto,
+        "retorno_periodo_bruto": retorno_periodo_bruto,
+        "irr_m_liquido": irr_m_liquido,
+        "irr_a_liquido": irr_a_liquido,
+        "retorno_periodo_liquido": retorno_periodo_liquido,
+        "receita_total_bruta": receita_total_bruta,
+        "pdd_esperada_valor": pdd_esperada_valor,
+        "receita_total_liquida": receita_total_liquida,
+        "irr_m_sem_tac_liq": irr_m_sem_tac_liq,
+        "impacto_tac_pp": impacto_tac_pp,
+    }
+
+
+def cenarios_pagamento(
+    valor_face,
+    taxa_am,
+    prazo_dias,
+    dias_atraso,
+    provisao,
+    tac=0.0,
+    mora_am=0.0,
+    multa=0.0,
+    atraso_no_prazo: bool = False,
+) -> dict:
+    """
+    Comparação de cenários de pagamento do simulador: o título é pago com
+    `dias_atraso` dias de atraso (mora e multa) e o recebimento é reduzido
+    pela provisão da faixa (`provisao`, fração do face). As entradas são
+    combinadas por broadcasting, então uma chamada com eixos
+    prazo[:, None, None] × atraso[None, :, None] × provisão[None, None, :]
+    gera a superfície inteira.
+
+    Como no simulador, a TIR usa o prazo contratado; com
+    atraso_no_prazo=True o recebimento acontece em prazo + atraso.
+    """
+    face, taxa, prazo, atraso, prov, tac, mora_am, multa = np.broadcast_arrays(
+        *(np.asarray(x, dtype=float) for x in (valor_face, taxa_am, prazo_dias, dias_atraso, provisao, tac, mora_am, multa))
+    )
+    desembolso_liquido = face - face * taxa * (prazo / DIAS_MES) - tac
+    penalidade = np.where(atraso > 0, face * multa, 0.0) + face * (mora_am / DIAS_MES) * atraso
+    pdd_valor = face * prov
+    recebimento_ajustado = face + penalidade - pdd_valor
+
+    valida = (recebimento_ajustado > 0) & (desembolso_liquido > 0)
+    razao = np.divide(recebimento_ajustado, desembolso_liquido, out=np.ones_like(face), where=valida)
+    n_dias = np.maximum(1, prazo + atraso if atraso_no_prazo else prazo)
+    irr_m = (razao ** (DIAS_MES / n_dias) - 1) * valida
+    return {
+        "desembolso_liquido": desembolso_liquido,
+        "penalidade": penalidade,
+        "pdd_valor": pdd_valor,
+        "irr_valida": valida,
+        "irr_m": irr_m,
+        "irr_a": ((1 + irr_m) ** 12 - 1) * valida,
+        "receita_liquida": np.where(valida, recebimento_ajustado - desembolso_liquido, 0.0),
+    }
+
+
+# ---------------------------------------------------------------------
+# Arquivo de títulos e exportação
+# ---------------------------------------------------------------------
+# Colunas de entrada (percentuais como no simulador: % a.m., % flat, %)
+ALIASES_TITULOS = {
+    "id_titulo": ("id_titulo", "id", "titulo", "numero", "documento", "nosso_numero"),
+    "valor_face": ("valor_face", "valor", "face", "valor_nominal"),
+    "taxa_am_pct": ("taxa_am_pct", "taxa", "taxa_am", "taxa_juros", "taxa_de_juros"),
+    "prazo_dias": ("prazo_dias", "prazo"),
+    "tac": ("tac", "outras_taxas", "taxas"),
+    "mora_am_pct": ("mora_am_pct", "mora", "mora_am"),
+    "multa_pct": ("multa_pct", "multa"),
+    "pd_pct": ("pd_pct", "pd", "pdd", "prob_default"),
+    "dias_atraso": ("dias_atraso", "atraso"),
+}
+COLUNAS_OBRIGATORIAS_TITULOS = ("valor_face",)
+ALIASES_VENCIMENTO = ("vencimento", "data_vencimento", "dt_vencimento", "vcto")
+
+
+def ler_titulos(fonte, padroes: dict = None) -> pd.DataFrame:
+    """
+    Lê um CSV de títulos para precificar_titulos. Só o valor de face é
+    obrigatório; colunas ausentes (ou células vazias) usam `padroes`
+    ({coluna: valor}, mesmas chaves de ALIASES_TITULOS). Se houver coluna de
+    vencimento ela vem como "vencimento" (datetime64[D]) para o borderô.
+    """
+    padroes = padroes or {}
+    arq, fechar = _abrir_binario(fonte)
+    try:
+        encoding, sep = _detectar_formato_csv(arq.read(64 << 10))
+        arq.seek(0)
+        bruto = pd.read_csv(arq, sep=sep, dtype=str, encoding=encoding, keep_default_na=False)
+    finally:
+        if fechar:
+            arq.close()
+
+    normalizados = {_normalizar_nome(c): c for c in bruto.columns}
+    originais = {
+        canonica: next((normalizados[a] for a in aliases if a in normalizados), None)
+        for canonica, aliases in ALIASES_TITULOS.items()
+    }
+    # Formato decimal uma vez para o arquivo, com todas as colunas numéricas; sem prova, ';' é padrão brasileiro
+    numericas = [bruto[c] for k, c in originais.items() if c is not None and k != "id_titulo"]
+    decimal_virgula = _decimal_virgula(pd.concat(numericas) if numericas else pd.Series([], dtype=str), padrao=sep == ";")
+
+    titulos = pd.DataFrame(index=bruto.index)
+    for canonica, original in originais.items():
+        if canonica == "id_titulo":
+            titulos[canonica] = bruto[original].str.strip() if original is not None else (bruto.index + 1).astype(str)
+            continue
+        if original is None:
+            if canonica in COLUNAS_OBRIGATORIAS_TITULOS or canonica not in padroes:
+                raise ValueError(f"Arquivo sem a coluna {canonica}")
+            titulos[canonica] = float(padroes[canonica])
+            continue
+        valores = _valores(bruto[original], decimal_virgula)
+        if canonica in padroes:
+            valores = np.where(np.isnan(valores), float(padroes[canonica]), valores)
+        titulos[canonica] = valores
+
+    coluna_venc = next((normalizados[a] for a in ALIASES_VENCIMENTO if a in normalizados), None)
+    if coluna_venc is not None:
+        titulos["vencimento"] = _datas(bruto[coluna_venc])
+    return titulos
+
+
+def precificar_tabela(titulos: pd.DataFrame) -> pd.DataFrame:
+    """precificar_titulos sobre as colunas de ler_titulos; uma linha por título."""
+    res = precificar_titulos(
+        titulos["valor_face"].to_numpy(dtype=float),
+        titulos["taxa_am_pct"].to_numpy(dtype=float) / 100,
+        titulos["prazo_dias"].to_numpy(dtype=float),
+        titulos["tac"].to_numpy(dtype=float),
+        titulos["mora_am_pct"].to_numpy(dtype=float) / 100,
+        titulos["multa_pct"].to_numpy(dtype=float) / 100,
+        titulos["pd_pct"].to_numpy(dtype=float) / 100,
+        titulos["dias_atraso"].to_numpy(dtype=float),
+    )
+    res["taxa_am_pct"] = res["taxa_am"] * 100
+    tabela = pd.DataFrame({nome: res[nome] for nome in PRECIFICACAO_LABELS})
+    tabela.insert(0, "id_titulo", titulos["id_titulo"].to_numpy())
+    return tabela
+
+
+def exportar_precificacao(tabela: pd.DataFrame, formato: str = "csv") -> bytes:
+    """CSV (padrão brasileiro: ';' e vírgula decimal) ou Parquet."""
+    if formato == "parquet":
+        buffer = io.BytesIO()
+        tabela.to_parquet(buffer, index=False)
+        return buffer.getvalue()
+    if formato == "csv":
+        return tabela.to_csv(sep=";", decimal=",", index=False).encode("utf-8-sig")
+    raise ValueError("formato deve ser 'csv' ou 'parquet'")
+
+
+# ---------------------------------------------------------------------
+# Borderô (vários títulos, vencimentos diferentes)
+# ---------------------------------------------------------------------
+def precificar_bordero(
+    valor_face,
+    vencimento,
+    data_operacao,
+    taxa_am,
+    tac: float = 0.0,
+    prob_default=0.0,
+) -> dict:
+    """
+    Precifica um borderô: deságio de cada título pelo seu prazo (mesma conta
+    do simulador unitário) e TIR consolidada da operação pela XIRR do fluxo
+    (−desembolso líquido na data da operação, +valor de face em cada
+    vencimento). A TAC (R$) é da operação; taxa_am e prob_default podem ser
+    por título.
+
+    Três fluxos são resolvidos juntos (fidc_tir.tir_lote): com TAC (TIR bruta),
+    sem TAC (para o impacto da TAC) e com as entradas × (1 − PD) (TIR
+    esperada). A "TIR líquida" segue a convenção do simulador: bruta ×
+    (1 − PD médio ponderado pelo face).
+
+    Devolve {"titulos": arrays por título, "operacao": consolidado}.
+    """
+    face = np.asarray(valor_face, dtype=float)
+    vencimento = np.asarray(vencimento, dtype="datetime64[D]")
+    prazo = (vencimento - np.datetime64(data_operacao, "D")).astype(float)
+    if np.isnan(face).any() or np.isnat(vencimento).any():
+        raise ValueError("Borderô com títulos sem valor de face ou vencimento válidos")
+    if (prazo < 1).any():
+        raise ValueError(f"{int((prazo < 1).sum())} título(s) vencem até a data da operação")
+
+    taxa, pd_ = np.broadcast_arrays(np.asarray(taxa_am, dtype=float), np.asarray(prob_default, dtype=float))
+    taxa = np.broadcast_to(taxa, face.shape)
+    pd_ = np.broadcast_to(pd_, face.shape)
+    titulos = precificar_titulos(face, taxa, prazo, prob_default=pd_)
+
+    valor_face_total = face.sum()
+    preco_total = titulos["preco_compra"].sum()
+    desembolso_liquido = preco_total - tac
+    pd_medio = (pd_ * face).sum() / valor_face_total if valor_face_total > 0 else 0.0
+
+    # Fluxos (3, n+1): coluna 0 = data da operação
+    dias = np.r_[0.0, prazo]
+    entradas = np.stack([face, face, face * (1 - pd_)])
+    desembolsos = np.array([desembolso_liquido, preco_total, desembolso_liquido])
+    fluxos = np.column_stack([-desembolsos, entradas])
+    irr_d_bruto, irr_d_sem_tac, irr_d_esperada = tir_lote(fluxos, dias)
+
+    mensal = lambda d: (1 + d) ** DIAS_MES - 1
+    irr_m_bruto = mensal(irr_d_bruto)
+    irr_m_liquido = irr_m_bruto * (1 - pd_medio)
+    receita_total_bruta = valor_face_total - desembolso_liquido
+
+    operacao = {
+        "n_titulos": int(face.size),
+        "valor_face_total": float(valor_face_total),
+        "desagio_total": float(titulos["desagio_valor"].sum()),
+        "preco_compra": float(preco_total),
+        "tac": float(tac),
+        "desembolso_liquido": float(desembolso_liquido),
+        "prazo_medio_dias": float((prazo * face).sum() / valor_face_total) if valor_face_total > 0 else 0.0,
+        "prazo_max_dias": float(prazo.max()) if prazo.size else 0.0,
+        "pd_medio": float(pd_medio),
+        "irr_valida": bool(np.isfinite(irr_d_bruto)),
+        "irr_d_bruto": float(irr_d_bruto),
+        "irr_m_bruto": float(irr_m_bruto),
+        "irr_a_bruto": float((1 + irr_d_bruto) ** DIAS_ANO - 1),
+        "irr_m_liquido": float(irr_m_liquido),
+        "irr_a_liquido": float((1 + irr_m_liquido) ** 12 - 1),
+        "irr_m_esperada": float(mensal(irr_d_esperada)),
+        "impacto_tac_pp": float((irr_m_bruto - mensal(irr_d_sem_tac)) * 100),
+        "receita_total_bruta": float(receita_total_bruta),
+        "pdd_esperada_valor": float(receita_total_bruta * pd_medio),
+        "receita_total_liquida": float(receita_total_bruta * (1 - pd_medio)),
+    }
+    titulos = {
+        "vencimento": vencimento,
+        "prazo_dias": prazo,
+        "valor_face": face,
+        "taxa_am_pct": taxa * 100,
+        "desagio_valor": titulos["desagio_valor"],
+        "desagio_pct": titulos["desagio_pct"],
+        "preco_compra": titulos["preco_compra"],
+        "irr_m_bruto": titulos["irr_m_bruto"],     # do título sozinho, sem TAC
+        "participacao_pct": face / valor_face_total * 100 if valor_face_total > 0 else np.zeros_like(face),
+    }
+    return {"titulos": titulos, "operacao": operacao}
@@ -0,0 +1,333 @@
+"""
+Projeção da DRE mês a mês (sem dependência do Streamlit).
+
+Evolui o PL das classes Júnior, Mezzanino e Sênior para vários cenários ao
+mesmo tempo. A recorrência entre meses é sequencial por natureza, então o
+laço é sobre os meses e cada passo opera sobre todos os cenários (arrays).
+
+Inclui o modelo de roll-rate (cadeia de Markov sobre as faixas de aging),
+que projeta a distribuição da carteira mês a mês e alimenta a PDD da DRE.
+"""
+import numpy as np
+
+from fidc_engine import BUCKETS, DIAS_UTEIS_MES, MESES_ANO, FundSnapshot, mensal_to_diario
+
+
+# Parâmetros mensais de projetar_dre e as colunas da tabela editável (aba DRE Projetado)
+DRE_COLUNAS_PARAM = {
+    "taxa_carteira_am_pct": "Taxa carteira (% a.m.)",
+    "pct_recebiveis_pct": "% PL em recebíveis",
+    "outras_receitas_mes": "Outras receitas (R$/mês)",
+    "outros_custos_mes": "Outros custos (R$/mês)",
+    "pdd_manual_mes": "PDD manual (R$/mês)",
+    "mov_junior": "Movimento Júnior (R$/mês)",
+    "mov_mezz": "Movimento Mezz (R$/mês)",
+    "mov_senior": "Movimento Sênior (R$/mês)",
+}
+
+# Linhas da DRE (último eixo do array de saída)
+DRE_LINHAS = [
+    "PL Inicial (R$)",
+    "PL Após Movimentos (R$)",
+    "Receita Carteira (R$)",
+    "Receita Caixa (R$)",
+    "Outras Receitas (R$)",
+    "Receita Total (R$)",
+    "Custo Sênior (R$)",
+    "Custo Mezz (R$)",
+    "Taxa Adm (R$)",
+    "Taxa Gestão (R$)",
+    "PDD (R$)",
+    "Outros Custos (R$)",
+    "Resultado Cota Júnior (R$)",
+    "PL Final (R$)",
+    "PL Final Sênior (R$)",
+    "PL Final Mezz (R$)",
+    "PL Final Júnior (R$)",
+    "Retorno Júnior no mês (%)",
+]
+DRE_IDX = {nome: i for i, nome in enumerate(DRE_LINHAS)}
+
+
+def projetar_dre(
+    snap: FundSnapshot,
+    taxa_carteira_am_pct,
+    pct_recebiveis_pct,
+    outras_receitas_mes,
+    outros_custos_mes,
+    pdd_manual_mes=0.0,
+    mov_junior=0.0,
+    mov_mezz=0.0,
+    mov_senior=0.0,
+    meses=None,
+    taxa_perda_esperada=None,
+) -> np.ndarray:
+    """
+    Projeta a DRE mensal para S cenários × M meses.
+
+    Os parâmetros mensais aceitam escalares, vetores (M,) ou matrizes
+    (S, M), com broadcasting para (S, M). O PL inicial de cada classe vem
+    do snapshot do fundo; CDI, spreads, taxas e perda esperada também.
+    `taxa_perda_esperada` (fração, por mês) substitui a perda constante do
+    snapshot, p.ex. com a projeção do roll-rate (taxa_perda_aging).
+
+    Retorna um array (S, M, len(DRE_LINHAS)); use DRE_IDX para indexar
+    as linhas (ex.: dre[..., DRE_IDX["PL Final Júnior (R$)"]]).
+    """
+    entradas = [
+        np.asarray(x, dtype=float)
+        for x in (
+            taxa_carteira_am_pct, pct_recebiveis_pct, outras_receitas_mes, outros_custos_mes,
+            pdd_manual_mes, mov_junior, mov_mezz, mov_senior,
+            snap.taxa_perda_esperada if taxa_perda_esperada is None else taxa_perda_esperada,
+        )
+    ]
+    n_cen, n_meses = np.broadcast_shapes(*(x.shape for x in entradas), (1, meses or 1))
+    (taxa_cart, pct_rec, outras_rec, outros_cust, pdd_manual, mov_j, mov_m, mov_s, taxa_perda) = (
+        np.broadcast_to(x, (n_cen, n_meses)) for x in entradas
+    )
+
+    taxa_cart_dia = mensal_to_diario(taxa_cart / 100.0)
+    pct_rec = pct_rec / 100.0
+    perda_mensal = taxa_perda / MESES_ANO if snap.incluir_pdd else np.zeros((n_cen, n_meses))
+
+    dre = np.empty((n_cen, n_meses, len(DRE_LINHAS)), dtype=float)
+
+    # PL inicial por classe (mês 1)
+    pl_junior = np.full(n_cen, snap.valor_junior)
+    pl_mezz = np.full(n_cen, snap.valor_mezz)
+    pl_senior = np.full(n_cen, snap.valor_senior)
+
+    for t in range(n_meses):
+        pl_inicial_total = pl_junior + pl_mezz + pl_senior
+
+        # ----- MOVIMENTOS (aporte/resgate líquido) -----
+        pl_junior_mov = pl_junior + mov_j[:, t]
+        pl_mezz_mov = pl_mezz + mov_m[:, t]
+        pl_senior_mov = pl_senior + mov_s[:, t]
+        pl_total_mov = pl_junior_mov + pl_mezz_mov + pl_senior_mov
+
+        # ----- ALOCAÇÃO E RECEITAS -----
+        valor_recebiveis_mes = pl_total_mov * pct_rec[:, t]
+        valor_caixa_mes = pl_total_mov - valor_recebiveis_mes
+
+        receita_carteira = valor_recebiveis_mes * taxa_cart_dia[:, t] * DIAS_UTEIS_MES
+        receita_caixa = valor_caixa_mes * snap.cdi_diario * DIAS_UTEIS_MES
+        receita_total = receita_carteira + receita_caixa + outras_rec[:, t]
+
+        # ----- CUSTOS -----
+        custo_senior = pl_senior_mov * snap.taxa_senior_diaria * DIAS_UTEIS_MES
+        custo_mezz = pl_mezz_mov * snap.taxa_mezz_diaria * DIAS_UTEIS_MES
+        custo_adm = pl_total_mov * snap.taxa_adm_diaria * DIAS_UTEIS_MES
+        custo_gestao = pl_total_mov * snap.taxa_gestao_diaria * DIAS_UTEIS_MES
+        pdd = pdd_manual[:, t] + valor_recebiveis_mes * perda_mensal[:, t]
+
+        resultado_junior = (
+            receita_total
+            - custo_senior
+            - custo_mezz
+            - custo_adm
+            - custo_gestao
+            - pdd
+            - outros_cust[:, t]
+        )
+
+        # ----- PL FINAL DO MÊS -----
+        pl_mezz = pl_mezz_mov + custo_mezz
+        pl_senior = pl_senior_mov + custo_senior
+        pl_junior = pl_junior_mov + resultado_junior
+
+        base_retorno_jr = np.where(pl_junior_mov != 0, pl_junior_mov, 1.0)
+
+        linhas_mes = {
+            "PL Inicial (R$)": pl_inicial_total,
+            "PL Após Movimentos (R$)": pl_total_mov,
+            "Receita Carteira (R$)": receita_carteira,
+            "Receita Caixa (R$)": receita_caixa,
+            "Outras Receitas (R$)": outras_rec[:, t],
+            "Receita Total (R$)": receita_total,
+            "Custo Sênior (R$)": custo_senior,
+            "Custo Mezz (R$)": custo_mezz,
+            "Taxa Adm (R$)": custo_adm,
+            "Taxa Gestão (R$)": custo_gestao,
+            "PDD (R$)": pdd,
+            "Outros Custos (R$)": outros_cust[:, t],
+            "Resultado Cota Júnior (R$)": resultado_junior,
+            "PL Final (R$)": pl_mezz + pl_senior + pl_junior,
+            "PL Final Sênior (R$)": pl_senior,
+            "PL Final Mezz (R$)": pl_mezz,
+            "PL Final Júnior (R$)": pl_junior,
+            "Retorno Júnior no mês (%)": resultado_junior / base_retorno_jr * 100,
+        }
+        for nome, valor in linhas_mes.items():
+            dre[:, t, DRE_IDX[nome]] = valor
+
+    return dre
+
+
+_PL_CLASSE = {
+    "junior": ("valor_junior", "PL Final Júnior (R$)"),
+    "mezz": ("valor_mezz", "PL Final Mezz (R$)"),
+    "senior": ("valor_senior", "PL Final Sênior (R$)"),
+}
+
+
+def fluxos_cotista(snap: FundSnapshot, dre: np.ndarray, classe: str = "junior", movimentos=0.0) -> np.ndarray:
+    """
+    Fluxo de caixa do cotista de uma classe em cada cenário da DRE, (S, M+1)
+    com períodos mensais: no início do mês t (período t-1) ele paga o aporte
+    (movimento > 0) ou recebe o resgate; o período 0 inclui o PL inicial e
+    o período M é o PL final da classe (marcação no fim do horizonte).
+    Pronto para fidc_tir.tir_lote (taxa mensal).
+    """
+    if classe not in _PL_CLASSE:
+        raise ValueError(f"classe deve ser uma de {tuple(_PL_CLASSE)}")
+    campo_inicial, linha_final = _PL_CLASSE[classe]
+    n_cen, n_meses = dre.shape[:2]
+
+    fluxos = np.zeros((n_cen, n_meses + 1))
+    fluxos[:, :n_meses] = -np.broadcast_to(np.asarray(movimentos, dtype=float), (n_cen, n_meses))
+    fluxos[:, 0] -= getattr(snap, campo_inicial)
+    fluxos[:, n_meses] += dre[:, -1, DRE_IDX[linha_final]]
+    return fluxos
+
+
+# Linhas de saldo (não somam no período): inicial pega o 1º mês, final o último
+_DRE_SALDO_INICIAL = ["PL Inicial (R$)", "PL Após Movimentos (R$)"]
+_DRE_SALDO_FINAL = ["PL Final (R$)", "PL Final Sênior (R$)", "PL Final Mezz (R$)", "PL Final Júnior (R$)"]
+
+
+def agregar_dre(dre: np.ndarray, meses_por_periodo: int) -> np.ndarray:
+    """
+    Agrega a DRE (S, M, L) em períodos de `meses_por_periodo` meses
+    (3 = trimestre, 12 = ano). Fluxos são somados, saldos iniciais vêm do
+    primeiro mês e finais do último; o retorno da Júnior é composto. Um
+    último período incompleto é mantido.
+    """
+    n_meses = dre.shape[1]
+    inicio = np.arange(0, n_meses, meses_por_periodo)
+    fim = np.minimum(inicio + meses_por_periodo, n_meses) - 1
+
+    agregado = np.add.reduceat(dre, inicio, axis=1)
+    for nome in _DRE_SALDO_INICIAL:
+        agregado[:, :, DRE_IDX[nome]] = dre[:, inicio, DRE_IDX[nome]]
+    for nome in _DRE_SALDO_FINAL:
+        agregado[:, :, DRE_IDX[nome]] = dre[:, fim, DRE_IDX[nome]]
+
+    idx_ret = DRE_IDX["Retorno Júnior no mês (%)"]
+    fator = np.multiply.reduceat(1 + dre[:, :, idx_ret] / 100, inicio, axis=1)
+    agregado[:, :, idx_ret] = (fator - 1) * 100
+    return agregado
+
+
+# ---------------------------------------------------------------------
+# ROLL-RATE (MARKOV) DAS FAIXAS DE AGING
+# ---------------------------------------------------------------------
+# Estados: as 9 faixas + liquidado (pago) + baixado (write-off), absorventes
+N_FAIXAS = len(BUCKETS)
+IDX_LIQUIDADO = N_FAIXAS
+IDX_BAIXADO = N_FAIXAS + 1
+
+
+def aging_estacionario(buckets_pct) -> np.ndarray:
+    """
+    Se `buckets_pct` (..., 9) pode ser a distribuição estacionária da
+    carteira revolvente. Sem permanência nas faixas 0..7, o que chega à
+    faixa seguinte é uma fração do que estava na anterior: a distribuição
+    precisa ser não crescente até a faixa 240–300 (a >300 acumula).
+    """
+    pct = np.asarray(buckets_pct, dtype=float)
+    return np.all(pct[..., 1:-1] <= pct[..., :-2], axis=-1)
+
+
+def rolagem_estacionaria(buckets_pct) -> np.ndarray:
+    """
+    Taxas de rolagem (..., 9) que tornam `buckets_pct` a distribuição
+    estacionária da carteira revolvente: r_i = π_(i+1) / π_i para as faixas
+    0..7 e, na >300, a baixa mensal w = π_7·r_7 / π_8. Com elas a projeção
+    reproduz a PDD constante do cenário atual quando aging_estacionario é
+    verdadeiro; senão alguma razão passa de 100%, é limitada a [0, 1] e a
+    projeção se afasta do aging atual.
+    """
+    pct = np.asarray(buckets_pct, dtype=float)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        rolagem = np.clip(np.where(pct[..., :-1] > 0, pct[..., 1:] / pct[..., :-1], 0.0), 0.0, 1.0)
+        baixa = np.where(pct[..., -1] > 0, pct[..., -2] * rolagem[..., -1] / pct[..., -1], 1.0)
+    return np.concatenate([rolagem, np.clip(baixa, 0.0, 1.0)[..., None]], axis=-1)
+
+
+def matriz_roll_rate(rolagem) -> np.ndarray:
+    """
+    Matriz de transição mensal (..., 11, 11) a partir das taxas de rolagem
+    por faixa (..., 9), em fração:
+
+    - faixas 0..7: rolagem_i vai para a faixa seguinte, o restante liquida;
+    - faixa >300: rolagem_8 é baixada, o restante permanece na faixa;
+    - liquidado e baixado são absorventes.
+
+    Aceita um lote de cenários (K, 9) e devolve (K, 11, 11).
+    """
+    rolagem = np.clip(np.asarray(rolagem, dtype=float), 0.0, 1.0)
+    lote = rolagem.shape[:-1]
+    P = np.zeros(lote + (N_FAIXAS + 2, N_FAIXAS + 2))
+
+    i = np.arange(N_FAIXAS - 1)
+    P[..., i, i + 1] = rolagem[..., :-1]
+    P[..., i, IDX_LIQUIDADO] = 1 - rolagem[..., :-1]
+    P[..., N_FAIXAS - 1, N_FAIXAS - 1] = 1 - rolagem[..., -1]
+    P[..., N_FAIXAS - 1, IDX_BAIXADO] = rolagem[..., -1]
+    P[..., IDX_LIQUIDADO, IDX_LIQUIDADO] = 1.0
+    P[..., IDX_BAIXADO, IDX_BAIXADO] = 1.0
+    return P
+
+
+def matriz_revolvente(P) -> np.ndarray:
+    """
+    Carteira revolvente: o que liquida ou é baixado é reposto com títulos
+    novos (faixa 0–30). Dobra os estados absorventes na primeira faixa e
+    devolve (..., 9, 9).
+    """
+    P = np.asarray(P, dtype=float)
+    Q = P[..., :N_FAIXAS, :N_FAIXAS].copy()
+    Q[..., :, 0] += P[..., :N_FAIXAS, IDX_LIQUIDADO] + P[..., :N_FAIXAS, IDX_BAIXADO]
+    return Q
+
+
+def projetar_aging(dist_inicial, P, meses: int, revolvente: bool = True) -> np.ndarray:
+    """
+    Distribuição da carteira ao fim de cada mês, d_t = d_0 · P^t, para K
+    matrizes de transição de uma vez (produto matricial em lote).
+
+    - dist_inicial: (9,) ou (K, 9), em fração (normalizada aqui);
+    - P: (11, 11) ou (K, 11, 11), de matriz_roll_rate;
+    - revolvente=True projeta a carteira reposta (9 estados, soma 1);
+      False acompanha a safra em run-off (11 estados, com liquidado/baixado).
+
+    Retorna (K, meses, n_estados).
+    """
+    P = np.asarray(P, dtype=float)
+    if revolvente:
+        P = matriz_revolvente(P)
+    n_estados = P.shape[-1]
+
+    d0 = np.asarray(dist_inicial, dtype=float)
+    total = d0.sum(axis=-1, keepdims=True)
+    d0 = np.where(total > 0, d0 / np.where(total > 0, total, 1.0), 0.0)
+    if d0.shape[-1] < n_estados:
+        d0 = np.concatenate([d0, np.zeros(d0.shape[:-1] + (n_estados - d0.shape[-1],))], axis=-1)
+
+    n_cen = np.broadcast_shapes(d0.shape[:-1], P.shape[:-2], (1,))[0]
+    dist = np.empty((n_cen, int(meses), n_estados))
+    d = np.broadcast_to(d0, (n_cen, n_estados))
+    for t in range(int(meses)):
+        d = np.einsum("ki,kij->kj", d, np.broadcast_to(P, (n_cen, n_estados, n_estados)))
+        dist[:, t] = d
+    return dist
+
+
+def taxa_perda_aging(dist, prov_rates) -> np.ndarray:
+    """
+    Perda esperada (fração da carteira) de cada distribuição projetada:
+    Σ faixa × provisão, igual à taxa_perda_esperada do snapshot.
+    """
+    return np.asarray(dist, dtype=float)[..., :N_FAIXAS] @ np.asarray(prov_rates, dtype=float)
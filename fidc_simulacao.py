@@ -0,0 +1,159 @@
+"""
+Simulação Monte Carlo de perdas de crédito (sem dependência do Streamlit).
+
+A PDD do dashboard é determinística: perda esperada = Σ pct_faixa × prov_faixa.
+Aqui a taxa de perda de cada faixa de aging é sorteada em torno da provisão
+(beta ou lognormal), com um fator sistêmico comum a todas as faixas, e a
+perda resultante passa pela mesma conta de subordinação do stress test.
+
+Os caminhos são gerados em lotes de tamanho fixo, cada um com sua semente
+derivada de np.random.SeedSequence: o resultado depende só da semente e do
+tamanho do lote.
+"""
+from dataclasses import replace
+
+import numpy as np
+
+from fidc_engine import FundSnapshot, curva_stress
+
+
+DISTRIBUICOES = ("beta", "lognormal")
+QUANTIS_PADRAO = (0.50, 0.90, 0.95, 0.99, 0.999)
+TAMANHO_LOTE = 50_000
+
+_EPS = 1e-9
+
+
+def sortear_taxas_perda(
+    rng: np.random.Generator,
+    n: int,
+    prov_rates,
+    distribuicao: str = "beta",
+    cv_faixa: float = 0.5,
+    vol_sistemica: float = 0.3,
+) -> np.ndarray:
+    """
+    Sorteia (n, B) taxas de perda por faixa, com média igual à provisão.
+
+    - cv_faixa: coeficiente de variação da taxa de perda de cada faixa.
+    - vol_sistemica: volatilidade do fator lognormal comum (média 1) que
+      multiplica todas as faixas do mesmo caminho; 0 = faixas independentes.
+
+    Faixas com provisão 0% ou 100% são determinísticas. As taxas são
+    limitadas a [0, 1], o que puxa levemente a média para baixo quando a
+    dispersão é alta.
+    """
+    if distribuicao not in DISTRIBUICOES:
+        raise ValueError(f"distribuicao deve ser uma de {DISTRIBUICOES}")
+
+    mu = np.clip(np.asarray(prov_rates, dtype=float), 0.0, 1.0)
+    mu_int = np.clip(mu, _EPS, 1 - _EPS)
+
+    if distribuicao == "beta":
+        # Var = (cv·μ)², limitada ao máximo possível da beta (μ(1-μ))
+        var = np.minimum((cv_faixa * mu_int) ** 2, mu_int * (1 - mu_int) * (1 - 1e-6))
+        kappa = np.maximum(mu_int * (1 - mu_int) / np.maximum(var, _EPS) - 1, _EPS)
+        taxas = rng.beta(mu_int * kappa, (1 - mu_int) * kappa, size=(n, mu.size))
+    else:
+        sigma = np.sqrt(np.log1p(cv_faixa ** 2))
+        z = rng.standard_normal((n, mu.size))
+        taxas = mu_int * np.exp(sigma * z - sigma ** 2 / 2)
+
+    if vol_sistemica > 0:
+        z_s = rng.standard_normal((n, 1))
+        taxas = taxas * np.exp(vol_sistemica * z_s - vol_sistemica ** 2 / 2)
+
+    taxas = np.clip(taxas, 0.0, 1.0)
+    return np.where(mu <= 0, 0.0, np.where(mu >= 1, 1.0, taxas))
+
+
+def lotes_caminhos(n_caminhos: int, seed: int = 0, tamanho_lote: int = TAMANHO_LOTE) -> list:
+    """
+    Divide os caminhos em lotes (inicio, n, semente). As sementes vêm de
+    SeedSequence(seed).spawn: cada lote sorteia sempre os mesmos números,
+    não importa quem o execute (ver fidc_paralelo).
+    """
+    n_cheios, resto = divmod(int(n_caminhos), int(tamanho_lote))
+    tamanhos = [int(tamanho_lote)] * n_cheios + ([resto] if resto else [])
+    sementes = np.random.SeedSequence(seed).spawn(len(tamanhos))
+    inicios = np.cumsum([0] + tamanhos[:-1])
+    return [(int(i), n, sem) for i, n, sem in zip(inicios, tamanhos, sementes)]
+
+
+def perdas_lote(
+    snap: FundSnapshot,
+    n: int,
+    semente: np.random.SeedSequence,
+    distribuicao: str = "beta",
+    cv_faixa: float = 0.5,
+    vol_sistemica: float = 0.3,
+) -> np.ndarray:
+    """Perdas (R$) de um lote de n caminhos com a semente do lote."""
+    rng = np.random.default_rng(semente)
+    taxas = sortear_taxas_perda(rng, n, snap.prov_rates, distribuicao, cv_faixa, vol_sistemica)
+    return snap.valor_recebiveis * (taxas @ np.asarray(snap.buckets_pct_norm, dtype=float))
+
+
+def simular_perdas(
+    snap: FundSnapshot,
+    n_caminhos: int = 100_000,
+    distribuicao: str = "beta",
+    cv_faixa: float = 0.5,
+    vol_sistemica: float = 0.3,
+    seed: int = 0,
+    tamanho_lote: int = TAMANHO_LOTE,
+) -> np.ndarray:
+    """
+    Perda total da carteira (R$) em cada caminho: valor dos recebíveis ×
+    Σ pct_faixa × taxa sorteada. Retorna um vetor (n_caminhos,).
+    """
+    perdas = np.empty(int(n_caminhos), dtype=float)
+    for inicio, n, semente in lotes_caminhos(n_caminhos, seed, tamanho_lote):
+        perdas[inicio:inicio + n] = perdas_lote(snap, n, semente, distribuicao, cv_faixa, vol_sistemica)
+    return perdas
+
+
+def simular_taxa_perda(
+    snap: FundSnapshot,
+    n_caminhos: int = 100_000,
+    distribuicao: str = "beta",
+    cv_faixa: float = 0.5,
+    vol_sistemica: float = 0.3,
+    seed: int = 0,
+    tamanho_lote: int = TAMANHO_LOTE,
+) -> np.ndarray:
+    """
+    Perda como fração da carteira em cada caminho (Σ pct_faixa × taxa).
+    Não depende do volume de recebíveis nem da estrutura de cotas, então a
+    mesma amostra serve para qualquer divisão Júnior/Mezz/Sênior.
+    """
+    return simular_perdas(replace(snap, valor_recebiveis=1.0), n_caminhos, distribuicao, cv_faixa, vol_sistemica, seed, tamanho_lote)
+
+
+def resumir_simulacao(perdas, snap: FundSnapshot, quantis=QUANTIS_PADRAO) -> dict:
+    """
+    Estatísticas da distribuição de perdas contra a subordinação mínima:
+    probabilidade de desenquadramento, aporte esperado, quantis de perda
+    (com a subordinação resultante) e perda esperada na cauda (ES 99%).
+    """
+    perdas = np.asarray(perdas, dtype=float)
+    curva = curva_stress(perdas, snap.valor_junior, snap.pl_total, snap.sub_min)
+
+    desenquadrado = curva["subordinacao_pct"] < snap.sub_min * 100
+    aporte = curva["aporte"]
+    q_perda = np.quantile(perdas, quantis)
+    var_99 = np.quantile(perdas, 0.99)
+
+    return {
+        "n_caminhos": perdas.size,
+        "perda_media": float(perdas.mean()),
+        "perda_desvio": float(perdas.std()),
+        "prob_desenquadramento": float(desenquadrado.mean()),
+        "prob_perda_junior_total": float((perdas >= snap.valor_junior).mean()),
+        "aporte_esperado": float(aporte.mean()),
+        "aporte_medio_se_desenquadrado": float(aporte[desenquadrado].mean()) if desenquadrado.any() else 0.0,
+        "quantis": np.asarray(quantis, dtype=float),
+        "perda_quantis": q_perda,
+        "subordinacao_quantis": curva_stress(q_perda, snap.valor_junior, snap.pl_total, snap.sub_min)["subordinacao_pct"],
+        "es_99": float(perdas[perdas >= var_99].mean()),
+    }
@@ -0,0 +1,155 @@
+"""
+TIR / XIRR de muitos fluxos de caixa ao mesmo tempo (sem dependência do Streamlit).
+
+Cada linha de uma matriz (K, N) é um fluxo; fluxos de tamanhos diferentes
+são completados com zeros (empilhar_fluxos), que não mudam o VPL. Os
+períodos podem ser irregulares (dias, meses, frações de ano) e diferentes
+por linha.
+
+O método é Newton em lote: todas as linhas iteram juntas e cada uma sai do
+conjunto ativo quando converge. As que não convergem (derivada nula,
+oscilação, chute ruim) passam para a bissecção, com o intervalo escolhido
+numa grade de taxas onde o VPL troca de sinal. Linhas sem troca de sinal
+(só entradas, só saídas) não têm TIR e ficam NaN.
+"""
+import numpy as np
+
+
+# Grade (taxa por período) usada para achar um intervalo com troca de sinal
+_GRADE_BISSECCAO = np.array([
+    -0.99, -0.9, -0.5, -0.2, -0.1, -0.05, -0.02, -0.01, -1e-3, -1e-4,
+    0.0, 1e-4, 1e-3, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0, 2.0, 5.0, 10.0, 100.0,
+])
+
+
+def empilhar_fluxos(fluxos, periodos=None) -> tuple:
+    """
+    Junta fluxos de tamanhos diferentes em matrizes (K, N_max) completadas
+    com zero. `periodos` (mesma estrutura) é opcional; sem ele o período
+    do j-ésimo fluxo é j.
+    """
+    fluxos = [np.asarray(f, dtype=float).ravel() for f in fluxos]
+    n_max = max((f.size for f in fluxos), default=0)
+    F = np.zeros((len(fluxos), n_max))
+    T = np.zeros((len(fluxos), n_max))
+    for i, f in enumerate(fluxos):
+        F[i, :f.size] = f
+        T[i, :f.size] = np.arange(f.size) if periodos is None else np.asarray(periodos[i], dtype=float).ravel()
+    return F, T
+
+
+def vpl(taxa, fluxos, periodos) -> np.ndarray:
+    """VPL de cada linha à sua taxa por período: Σ fluxo · (1+taxa)^(-período)."""
+    fluxos = np.atleast_2d(np.asarray(fluxos, dtype=float))
+    periodos = np.broadcast_to(np.asarray(periodos, dtype=float), fluxos.shape)
+    taxa = np.asarray(taxa, dtype=float).reshape(-1, 1)
+    with np.errstate(over="ignore", invalid="ignore", divide="ignore"):
+        desconto = (1 + taxa) ** -periodos
+        return np.where(fluxos != 0, fluxos * desconto, 0.0).sum(axis=1)
+
+
+def _chute(fluxos, periodos, valida):
+    # Uma saída e uma entrada só, no prazo médio ponderado de cada lado
+    entradas = np.where(fluxos > 0, fluxos, 0.0)
+    saidas = np.where(fluxos < 0, -fluxos, 0.0)
+    tot_ent, tot_sai = entradas.sum(axis=1), saidas.sum(axis=1)
+    t_ent = np.divide((entradas * periodos).sum(axis=1), tot_ent, out=np.zeros_like(tot_ent), where=tot_ent > 0)
+    t_sai = np.divide((saidas * periodos).sum(axis=1), tot_sai, out=np.zeros_like(tot_sai), where=tot_sai > 0)
+    prazo = t_ent - t_sai
+    razao = np.divide(tot_ent, tot_sai, out=np.ones_like(tot_ent), where=valida)
+    with np.errstate(over="ignore", invalid="ignore", divide="ignore"):
+        chute = np.where(np.abs(prazo) > 1e-12, razao ** (1 / np.where(prazo == 0, 1, prazo)) - 1, 0.0)
+    return np.where(np.isfinite(chute) & (chute > -1), chute, 0.0)
+
+
+def _newton(fluxos, periodos, taxa, ativa, max_iter, tol):
+    """Newton mascarado; devolve (taxa, convergiu)."""
+    convergiu = np.zeros(taxa.shape, dtype=bool)
+    for _ in range(max_iter):
+        if not ativa.any():
+            break
+        idx = np.flatnonzero(ativa)
+        r = taxa[idx, None]
+        f, t = fluxos[idx], periodos[idx]
+        with np.errstate(over="ignore", invalid="ignore", divide="ignore"):
+            desconto = (1 + r) ** -t
+            valor = np.where(f != 0, f * desconto, 0.0).sum(axis=1)
+            derivada = np.where(f != 0, -t * f * desconto / (1 + r), 0.0).sum(axis=1)
+            passo = valor / derivada
+        ruim = ~np.isfinite(passo)
+        novo = taxa[idx] - np.where(ruim, 0.0, passo)
+        novo = np.where(novo <= -1, (taxa[idx] - 1) / 2, novo)      # não cruza r = -100%
+        taxa[idx] = novo
+        ok = ~ruim & (np.abs(passo) <= tol * (1 + np.abs(novo)))
+        convergiu[idx[ok]] = True
+        ativa[idx[ok | ruim]] = False
+    return taxa, convergiu
+
+
+def _bisseccao(fluxos, periodos, max_iter, tol):
+    """TIR por bissecção no primeiro intervalo da grade com troca de sinal (NaN se não houver)."""
+    k = fluxos.shape[0]
+    na_grade = np.stack([vpl(np.full(k, g), fluxos, periodos) for g in _GRADE_BISSECCAO], axis=1)
+    sinal = np.sign(na_grade)
+    troca = (sinal[:, :-1] * sinal[:, 1:] <= 0) & np.isfinite(na_grade[:, :-1]) & np.isfinite(na_grade[:, 1:])
+    # entre as trocas, a mais próxima de 0%
+    distancia = np.where(troca, np.abs(_GRADE_BISSECCAO[:-1] + _GRADE_BISSECCAO[1:]), np.inf)
+    j = np.argmin(distancia, axis=1)
+    tem_troca = troca.any(axis=1)
+
+    lo, hi = _GRADE_BISSECCAO[j].copy(), _GRADE_BISSECCAO[j + 1].copy()
+    f_lo = na_grade[np.arange(k), j]
+    for _ in range(max_iter):
+        meio = (lo + hi) / 2
+        f_meio = vpl(meio, fluxos, periodos)
+        mesmo_lado = np.sign(f_meio) == np.sign(f_lo)
+        lo = np.where(mesmo_lado, meio, lo)
+        f_lo = np.where(mesmo_lado, f_meio, f_lo)
+        hi = np.where(mesmo_lado, hi, meio)
+        if np.all(hi - lo <= tol * (1 + np.abs(lo))):
+            break
+    return np.where(tem_troca, (lo + hi) / 2, np.nan)
+
+
+def tir_lote(fluxos, periodos=None, chute=None, max_iter: int = 50, tol: float = 1e-12, max_bisseccao: int = 200) -> np.ndarray:
+    """
+    TIR por período de cada linha de `fluxos` (K, N) ou de um fluxo (N,).
+
+    - periodos: (N,) comum a todas as linhas ou (K, N); padrão 0, 1, 2...
+      A taxa sai na unidade dos períodos (dias → taxa diária).
+    - chute: taxa inicial do Newton (escalar ou (K,)); padrão estimado por
+      linha a partir de uma entrada e uma saída equivalentes.
+
+    Retorna (K,) — ou escalar se `fluxos` for 1-D — com NaN onde não há TIR.
+    """
+    um_fluxo = np.ndim(fluxos) == 1
+    fluxos = np.atleast_2d(np.asarray(fluxos, dtype=float))
+    k, n = fluxos.shape
+    periodos = np.arange(n, dtype=float) if periodos is None else np.asarray(periodos, dtype=float)
+    periodos = np.ascontiguousarray(np.broadcast_to(periodos, (k, n)))
+
+    valida = (fluxos > 0).any(axis=1) & (fluxos < 0).any(axis=1)
+    taxa = _chute(fluxos, periodos, valida) if chute is None else np.broadcast_to(np.asarray(chute, dtype=float), (k,)).copy()
+    taxa, convergiu = _newton(fluxos, periodos, taxa, valida.copy(), max_iter, tol)
+
+    falhou = valida & ~convergiu
+    if falhou.any():
+        taxa[falhou] = _bisseccao(fluxos[falhou], periodos[falhou], max_bisseccao, tol)
+    taxa[~valida] = np.nan
+    return taxa[0] if um_fluxo else taxa
+
+
+def xirr_lote(fluxos, datas, **kwargs) -> np.ndarray:
+    """
+    XIRR (taxa efetiva anual, base 365 dias) de cada linha: `datas` com o
+    mesmo shape de `fluxos` (ou (N,) comum), em datetime64. Posições
+    completadas (fluxo zero) podem ter NaT.
+    """
+    datas = np.asarray(datas, dtype="datetime64[D]")
+    fluxos = np.asarray(fluxos, dtype=float)
+    datas_2d = np.atleast_2d(np.broadcast_to(datas, fluxos.shape))
+    valida = ~np.isnat(datas_2d)
+    dias = np.where(valida, datas_2d.astype("int64"), 0)
+    inicio = np.where(valida, dias, np.iinfo(np.int64).max).min(axis=1, keepdims=True)
+    anos = np.where(valida, (dias - inicio) / 365.0, 0.0)
+    return tir_lote(fluxos, anos.reshape(fluxos.shape) if fluxos.ndim == 1 else anos, **kwargs)